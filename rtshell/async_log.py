@@ -0,0 +1,226 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Asynchronous writer for logs.
+
+'''
+
+
+import collections
+import threading
+
+from rtshell import ilog
+
+
+###############################################################################
+## Overflow policies
+
+# Wait for space in the queue.
+BLOCK = 'block'
+# Discard the oldest queued entry to make space.
+DROP_OLDEST = 'drop-oldest'
+# Discard the entry being written.
+DROP_NEWEST = 'drop-newest'
+
+POLICIES = [BLOCK, DROP_OLDEST, DROP_NEWEST]
+
+DEFAULT_QUEUE_SIZE = 1000
+
+
+###############################################################################
+## Asynchronous log writer
+
+class AsyncLog(ilog.Log):
+    '''Writes entries to another log from a background thread.
+
+    Calls to @ref write place the entry in a bounded queue and return
+    immediately, so a slow disk does not hold up the caller. A writer thread
+    takes entries from the queue and writes them to the wrapped log. When the
+    queue is full, the overflow policy decides what happens:
+
+    - 'block': wait until the writer thread has made space.
+    - 'drop-oldest': discard the oldest entry in the queue.
+    - 'drop-newest': discard the entry being written.
+
+    Closing the log writes any queued entries, then closes the wrapped log.
+    The wrapped log should not be used directly while this object is open.
+
+    '''
+    def __init__(self, log, queue_size=DEFAULT_QUEUE_SIZE, overflow=BLOCK,
+            verbose=False, *args, **kwargs):
+        '''Constructor.
+
+        @param log The log to write to. It must be open for writing.
+        @param queue_size The maximum number of entries waiting to be written.
+        @param overflow The policy to apply when the queue is full.
+        @param verbose Print verbose output to stderr.
+
+        '''
+        self._is_open = False
+        if overflow not in POLICIES:
+            raise ValueError('Unknown overflow policy: {0}'.format(overflow))
+        if queue_size < 1:
+            raise ValueError('Queue size must be at least 1')
+        self._log = log
+        self._max_queue = queue_size
+        self._overflow = overflow
+        self._queued = 0
+        self._written = 0
+        self._dropped = 0
+        self._high_water = 0
+        super(AsyncLog, self).__init__(mode='w', meta=log.metadata,
+                verbose=verbose, *args, **kwargs)
+
+    def __str__(self):
+        return 'AsyncLog writing to {0}'.format(self._log)
+
+    @property
+    def dropped(self):
+        '''The number of entries discarded because the queue was full.'''
+        return self._dropped
+
+    @property
+    def high_water(self):
+        '''The largest number of entries that have been in the queue.'''
+        return self._high_water
+
+    @property
+    def log(self):
+        '''The log being written to.'''
+        return self._log
+
+    @property
+    def overflow(self):
+        '''The policy applied when the queue is full.'''
+        return self._overflow
+
+    @property
+    def queue_size(self):
+        '''The maximum number of entries waiting to be written.'''
+        return self._max_queue
+
+    @property
+    def queued(self):
+        '''The number of entries given to @ref write.'''
+        return self._queued
+
+    @property
+    def written(self):
+        '''The number of entries written to the wrapped log.'''
+        return self._written
+
+    def flush(self):
+        '''Wait until all queued entries have been written.'''
+        with self._cond:
+            while (self._queue or self._busy) and self._error is None:
+                self._cond.wait()
+        self._check_error()
+
+    def write(self, timestamp, data):
+        self._check_error()
+        with self._cond:
+            self._queued += 1
+            if len(self._queue) >= self._max_queue:
+                if self._overflow == DROP_NEWEST:
+                    self._dropped += 1
+                    return
+                elif self._overflow == DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                else:
+                    while (len(self._queue) >= self._max_queue and
+                            self._error is None):
+                        self._cond.wait()
+                    if self._error is not None:
+                        self._dropped += 1
+                        self._check_error()
+            self._queue.append((timestamp, data))
+            if len(self._queue) > self._high_water:
+                self._high_water = len(self._queue)
+            self._cond.notify_all()
+
+    def _check_error(self):
+        # The writer thread has stopped, so the error is kept to fail every
+        # later call rather than waiting for it
+        if self._error is not None:
+            self._reported = True
+            raise self._error
+
+    def _close(self):
+        if not self._is_open:
+            return
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._is_open = False
+        self._log.close()
+        self._vb_print('Closed async writer. {0} entries queued, {1} '
+                'written, {2} dropped; largest queue length {3}.'.format(
+                    self._queued, self._written, self._dropped,
+                    self._high_water))
+        if not self._reported:
+            self._check_error()
+
+    def _get_cur_pos(self):
+        return self._log.pos
+
+    def _get_start(self):
+        return self._log.start
+
+    def _get_end(self):
+        return self._log.end
+
+    def _open(self):
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._busy = False
+        self._error = None
+        self._reported = False
+        self._thread = threading.Thread(target=self._run,
+                name='rtlog-async-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        self._is_open = True
+        self._vb_print('Started async writer with queue size {0}, overflow '
+                'policy {1}.'.format(self._max_queue, self._overflow))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stop:
+                    self._cond.wait()
+                if not self._queue:
+                    # Stopped and drained
+                    return
+                ts, data = self._queue.popleft()
+                self._busy = True
+                self._cond.notify_all()
+            try:
+                self._log.write(ts, data)
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._busy = False
+                    self._dropped += len(self._queue) + 1
+                    self._queue.clear()
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._busy = False
+                self._written += 1
+                self._cond.notify_all()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Framed log of CDR-encoded data.
+
+'''
+
+
+import sys
+
+from rtshell import framed_log
+
+
+###############################################################################
+## CDR log
+##
+## The file format is the framed log format (see framed_log). The data of IDL
+## types is stored as CDR, the same encoding used to send it between ports,
+## in the machine's byte order. The repository ID of each channel's type is
+## recorded in its channel definition, so a reader that knows the IDL types
+## (for example, a C++ program) can decode the records without Python.
+##
+## Other values, such as the data of channels whose values are not all of
+## one IDL type, are pickled as in a framed log.
+##
+## The record headers can be read without decoding the payloads, so entries
+## are only decoded when they are read; entries of channels that are not
+## wanted, and entries skipped when seeking, are never decoded. The CDR is
+## decoded into the IDL type's Python class when an entry is read, so the
+## modules declaring the types must be imported.
+##
+## Logs written by this class can also be read by framed_log.FramedLog.
+
+class CdrLog(framed_log.FramedLog):
+    '''A framed log that stores the data of IDL types as CDR.
+
+    omniORB is required to write CDR. Without it, all values are pickled.
+
+    '''
+    def __init__(self, *args, **kwargs):
+        self._little = sys.byteorder == 'little'
+        super(CdrLog, self).__init__(*args, **kwargs)
+
+    def __str__(self):
+        return 'CdrLog({0}, {1}) at position {2}.'.format(self._fn,
+                self._mode, self.pos)
+
+    def _encode(self, chan, value):
+        type_id = self._chan_types.get(chan)
+        if type_id is None or \
+                getattr(value, '_NP_RepositoryId', None) != type_id:
+            return super(CdrLog, self)._encode(chan, value)
+        tc = framed_log.type_code(type_id)
+        flags = framed_log.FLAG_CDR
+        if self._little:
+            flags |= framed_log.FLAG_LITTLE_ENDIAN
+        return flags, framed_log.omniORB.cdrMarshal(tc, value, self._little)
+
+    def _type_id(self, value):
+        if framed_log.omniORB is None:
+            return None
+        return getattr(value, '_NP_RepositoryId', None)
+
@@ -0,0 +1,465 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Chunked, compressed log.
+
+'''
+
+
+import bisect
+import bz2
+import os
+import pickle
+import struct
+import zlib
+
+from rtshell import ilog
+from rtshell import log_io
+
+
+###############################################################################
+## Chunked log format
+##
+## All integers are little-endian.
+##
+## File header: magic (8 bytes), version (uint32), codec ID (uint32),
+##              directory offset (int64, -1 until the log is closed),
+##              metadata length (uint64)
+## Metadata (pickled)
+## [Chunks: chunk header, compressed records]
+## Chunk directory
+##
+## Each chunk header is: compressed length (uint32), uncompressed length
+## (uint32), number of records (uint32), index of the first record (int64),
+## timestamps of the first and last records and the latest timestamp in the
+## chunk (int64 nanoseconds).
+##
+## The uncompressed records are each a timestamp in nanoseconds (int64) and a
+## length (uint32) followed by the pickled data.
+##
+## The chunk directory is written when the log is closed. It is the number of
+## chunks (uint32) followed by each chunk's offset (int64) and header. If a log
+## was not closed, the directory is rebuilt from the chunk headers.
+
+MAGIC = b'RTLOGCHK'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sIIqQ')
+DIR_PTR_POS = 16
+CHUNK_HEADER = struct.Struct('<IIIqqqq')
+DIR_ENTRY = struct.Struct('<q')
+DIR_COUNT = struct.Struct('<I')
+REC_HEADER = struct.Struct('<qI')
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+def _lzma():
+    # lzma is not available in all Python versions
+    import lzma
+    return lzma
+
+
+CODECS = {
+        'zlib': (1, lambda d: zlib.compress(d, 6), zlib.decompress),
+        'bz2': (2, bz2.compress, bz2.decompress),
+        'lzma': (3, lambda d: _lzma().compress(d),
+            lambda d: _lzma().decompress(d)),
+        }
+
+
+def _codec_by_id(codec_id):
+    for name in CODECS:
+        if CODECS[name][0] == codec_id:
+            return name
+    raise ValueError('Unknown codec ID: {0}'.format(codec_id))
+
+
+###############################################################################
+## Chunk directory entry
+
+class Chunk(object):
+    '''The position and contents summary of a chunk.'''
+    __slots__ = ('offset', 'comp_len', 'length', 'count', 'first_ind',
+            'first_ts', 'last_ts', 'max_ts')
+
+    def __init__(self, offset, comp_len, length, count, first_ind, first_ts,
+            last_ts, max_ts):
+        self.offset = offset
+        self.comp_len = comp_len
+        self.length = length
+        self.count = count
+        self.first_ind = first_ind
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.max_ts = max_ts
+
+    def __str__(self):
+        return 'Chunk at {0}: {1} records from index {2}, time {3} to '\
+                '{4}'.format(self.offset, self.count, self.first_ind,
+                        self.first_ts, self.last_ts)
+
+    @property
+    def end(self):
+        '''The offset of the end of the chunk.'''
+        return self.offset + CHUNK_HEADER.size + self.comp_len
+
+    def pack(self):
+        return DIR_ENTRY.pack(self.offset) + CHUNK_HEADER.pack(self.comp_len,
+                self.length, self.count, self.first_ind, self.first_ts,
+                self.last_ts, self.max_ts)
+
+
+###############################################################################
+## Chunked, compressed log object.
+##
+## Entries are grouped into chunks, each compressed with a standard library
+## codec. Reading decompresses one chunk at a time, and seeking uses the chunk
+## directory to go straight to the chunk holding the target entry.
+
+class ChunkedLog(ilog.Log):
+    def __init__(self, filename='', codec='zlib',
+            chunk_size=DEFAULT_CHUNK_SIZE,
+            buffer_size=log_io.DEFAULT_BUFFER_SIZE, flush_interval=None,
+            fsync=log_io.FSYNC_NEVER, *args, **kwargs):
+        '''Constructor.
+
+        @param filename The name of the log file.
+        @param codec The compression codec to use when writing: zlib, bz2
+                     or lzma. When reading, the codec is read from the log.
+        @param chunk_size The uncompressed size, in bytes, at which a chunk is
+                          compressed and written.
+        @param buffer_size The size in bytes of the write buffer.
+        @param flush_interval When writing, flush the write buffer if this many
+                              seconds have passed since the last flush. None
+                              to only flush when the buffer is full.
+        @param fsync When to sync the log to the storage device when writing.
+                     See log_io.parse_fsync_policy. Counts of entries
+                     apply to chunks.
+
+        '''
+        self._is_open = False
+        if codec not in CODECS:
+            raise ValueError('Unknown codec: {0}'.format(codec))
+        self._policy = log_io.WritePolicy(buffer_size=buffer_size,
+                flush_interval=flush_interval, fsync=fsync)
+        self._fn = filename
+        self._codec = codec
+        self._chunk_size = chunk_size
+        self._chunks = []
+        self._max_ts = []
+        self._chunk_no = None
+        self._recs = []
+        self._data = b''
+        self._next = None
+        super(ChunkedLog, self).__init__(*args, **kwargs)
+
+    def __str__(self):
+        return 'ChunkedLog({0}, {1}) at position {2}.'.format(self._fn,
+                self._mode, self.pos)
+
+    @property
+    def chunks(self):
+        '''The chunk directory.'''
+        return list(self._chunks)
+
+    @property
+    def codec(self):
+        '''The name of the compression codec.'''
+        return self._codec
+
+    def write(self, timestamp, data):
+        ts = ilog.ts_to_ns(timestamp)
+        payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        if not self._pending:
+            self._pending_first = ts
+            self._pending_max = ts
+        elif ts > self._pending_max:
+            self._pending_max = ts
+        self._pending.append(REC_HEADER.pack(ts, len(payload)))
+        self._pending.append(payload)
+        self._pending_len += REC_HEADER.size + len(payload)
+        self._pending_last = ts
+        self._write_ind += 1
+        if self._pending_len >= self._chunk_size:
+            self._flush_chunk()
+
+    def read(self, timestamp=None, number=None):
+        if number is not None:
+            if number < 0:
+                raise ValueError
+            res = []
+            for ii in range(number):
+                if not self._read_one(res):
+                    break
+            return res
+        elif timestamp is not None:
+            if timestamp < 0:
+                raise ValueError
+            ts = ilog.ts_to_ns(timestamp)
+            res = []
+            while self._next is not None and self._next_rec()[0] <= ts:
+                self._read_one(res)
+            return res
+        else:
+            res = []
+            self._read_one(res)
+            return res
+
+    def rewind(self):
+        self._vb_print('Rewinding log from position {0}.'.format(self.pos))
+        if self._mode == 'r':
+            self._set_next(0, 0)
+        else:
+            self._file.seek(0)
+            self._file.truncate()
+            self._init_log()
+
+    def seek(self, timestamp=None, index=None):
+        self._vb_print('Seeking log from position {0}.'.format(self.pos))
+        if index is not None:
+            if index < 0:
+                raise ilog.InvalidIndexError
+            if not self._chunks:
+                return
+            firsts = [c.first_ind for c in self._chunks]
+            n = bisect.bisect_right(firsts, index) - 1
+            if n < 0:
+                n = 0
+            self._set_next(n, index - self._chunks[n].first_ind)
+        elif timestamp is not None:
+            ts = ilog.ts_to_ns(timestamp)
+            n = bisect.bisect_left(self._max_ts, ts)
+            if n == len(self._chunks):
+                self._next = None
+            else:
+                # The first entry at or after the time is in this chunk
+                self._load_chunk(n)
+                r = 0
+                while self._recs[r][0] < ts:
+                    r += 1
+                self._set_next(n, r)
+        self._vb_print('New current position: {0}.'.format(self.pos))
+
+    def _add_chunk(self, chunk):
+        self._chunks.append(chunk)
+        if self._max_ts and self._max_ts[-1] > chunk.max_ts:
+            self._max_ts.append(self._max_ts[-1])
+        else:
+            self._max_ts.append(chunk.max_ts)
+
+    def _backup_one(self):
+        '''Reverses in the log one entry.'''
+        if self._next is None:
+            if self._chunks:
+                self._set_next(len(self._chunks) - 1,
+                        self._chunks[-1].count - 1)
+        elif self._next[1] > 0:
+            self._next = (self._next[0], self._next[1] - 1)
+        elif self._next[0] > 0:
+            n = self._next[0] - 1
+            self._set_next(n, self._chunks[n].count - 1)
+
+    def _close(self):
+        if not self._is_open:
+            return
+        if self._mode == 'w':
+            self._flush_chunk()
+            # Write the directory, then point to it from the file header
+            directory = self._offset
+            self._file.write(DIR_COUNT.pack(len(self._chunks)))
+            for c in self._chunks:
+                self._file.write(c.pack())
+            self._file.seek(DIR_PTR_POS)
+            self._file.write(struct.pack('<q', directory))
+            self._vb_print('Wrote chunk directory at {0}'.format(directory))
+            self._policy.closing(self._file)
+        self._file.close()
+        self._is_open = False
+        self._vb_print('Closed file.')
+
+    def _eof(self):
+        return self._next is None
+
+    def _flush_chunk(self):
+        '''Compress and write the pending records as a chunk.'''
+        if not self._pending:
+            return
+        data = b''.join(self._pending)
+        comp = CODECS[self._codec][1](data)
+        count = len(self._pending) // 2
+        chunk = Chunk(self._offset, len(comp), len(data), count,
+                self._write_ind - count, self._pending_first,
+                self._pending_last, self._pending_max)
+        self._file.write(CHUNK_HEADER.pack(chunk.comp_len, chunk.length,
+            chunk.count, chunk.first_ind, chunk.first_ts, chunk.last_ts,
+            chunk.max_ts))
+        self._file.write(comp)
+        self._offset = chunk.end
+        self._add_chunk(chunk)
+        self._pending = []
+        self._pending_len = 0
+        self._policy.entry_written(self._file)
+        self._vb_print('Wrote chunk: {0}'.format(chunk))
+
+    def _get_cur_pos(self):
+        if self._mode == 'w':
+            return self._write_ind, -1
+        if self._next is not None:
+            n, r = self._next
+            return self._chunks[n].first_ind + r, \
+                    self._ns_to_ts(self._next_rec()[0])
+        return self._get_end()[0] + 1, self._get_end()[1]
+
+    def _get_end(self):
+        if not self._chunks:
+            return -1, None
+        last = self._chunks[-1]
+        return last.first_ind + last.count - 1, self._ns_to_ts(last.last_ts)
+
+    def _get_start(self):
+        if not self._chunks:
+            return 0, None
+        return 0, self._ns_to_ts(self._chunks[0].first_ts)
+
+    def _init_log(self):
+        if self._mode == 'r':
+            self._vb_print('Initialising log for reading.')
+            magic, version, codec, directory, meta_len = FILE_HEADER.unpack(
+                    self._file.read(FILE_HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('{0} is not a chunked log'.format(self._fn))
+            self._codec = _codec_by_id(codec)
+            self._meta = pickle.loads(self._file.read(meta_len))
+            self._data_start = FILE_HEADER.size + meta_len
+            self._chunks = []
+            self._max_ts = []
+            if directory >= 0:
+                self._read_directory(directory)
+            else:
+                self._vb_print('No chunk directory; scanning chunk headers.')
+                self._scan()
+            self._chunk_no = None
+            self._set_next(0, 0)
+        else:
+            self._vb_print('Initialising log for writing.')
+            meta = pickle.dumps(self._meta, pickle.HIGHEST_PROTOCOL)
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION,
+                CODECS[self._codec][0], -1, len(meta)))
+            self._file.write(meta)
+            self._offset = FILE_HEADER.size + len(meta)
+            self._chunks = []
+            self._max_ts = []
+            self._pending = []
+            self._pending_len = 0
+            self._write_ind = 0
+
+    def _load_chunk(self, n):
+        '''Decompress a chunk and build its record table.'''
+        if n == self._chunk_no:
+            return
+        chunk = self._chunks[n]
+        self._file.seek(chunk.offset + CHUNK_HEADER.size)
+        self._data = CODECS[self._codec][2](self._file.read(chunk.comp_len))
+        self._recs = []
+        pos = 0
+        for ii in range(chunk.count):
+            ts, length = REC_HEADER.unpack_from(self._data, pos)
+            pos += REC_HEADER.size
+            self._recs.append((ts, pos, pos + length))
+            pos += length
+        self._chunk_no = n
+        self._vb_print('Loaded chunk {0}'.format(chunk))
+
+    def _next_rec(self):
+        n, r = self._next
+        self._load_chunk(n)
+        return self._recs[r]
+
+    def _ns_to_ts(self, ns):
+        return ilog.EntryTS(sec=ns // 1000000000, nsec=ns % 1000000000)
+
+    def _open(self):
+        if self._is_open:
+            return
+        if self._mode == 'r':
+            flags = 'rb'
+        elif self._mode == 'w':
+            flags = 'wb'
+        else:
+            raise NotImplementedError
+        if self._mode == 'w':
+            self._file = self._policy.open(self._fn, flags)
+        else:
+            self._file = open(self._fn, flags)
+        self._init_log()
+        self._is_open = True
+        self._vb_print('Opened file {0} in mode {1}.'.format(self._fn,
+            self._mode))
+
+    def _read_directory(self, directory):
+        self._file.seek(directory)
+        count = DIR_COUNT.unpack(self._file.read(DIR_COUNT.size))[0]
+        raw = self._file.read(count * (DIR_ENTRY.size + CHUNK_HEADER.size))
+        pos = 0
+        for ii in range(count):
+            offset = DIR_ENTRY.unpack_from(raw, pos)[0]
+            pos += DIR_ENTRY.size
+            self._add_chunk(Chunk(offset, *CHUNK_HEADER.unpack_from(raw, pos)))
+            pos += CHUNK_HEADER.size
+
+    def _read_one(self, res):
+        '''Read the next entry into a result list.
+
+        Returns False at the end of the log.
+
+        '''
+        if self._next is None:
+            return False
+        n, r = self._next
+        ts, start, end = self._next_rec()
+        res.append((self._chunks[n].first_ind + r, self._ns_to_ts(ts),
+            pickle.loads(self._data[start:end])))
+        self._set_next(n, r + 1)
+        return True
+
+    def _scan(self):
+        '''Rebuild the chunk directory from the chunk headers.
+
+        A chunk that was not completely written is ignored.
+
+        '''
+        size = os.fstat(self._file.fileno()).st_size
+        offset = self._data_start
+        while offset + CHUNK_HEADER.size <= size:
+            self._file.seek(offset)
+            chunk = Chunk(offset, *CHUNK_HEADER.unpack(
+                self._file.read(CHUNK_HEADER.size)))
+            if chunk.end > size:
+                break
+            self._add_chunk(chunk)
+            offset = chunk.end
+
+    def _set_next(self, n, r):
+        '''Set the next entry to be read, moving to the next chunk if
+        necessary.'''
+        while n < len(self._chunks) and r >= self._chunks[n].count:
+            r -= self._chunks[n].count
+            n += 1
+        if n >= len(self._chunks):
+            self._next = None
+        else:
+            self._next = (n, r)
+
@@ -0,0 +1,652 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Framed binary log.
+
+'''
+
+
+import os
+import pickle
+import struct
+
+try:
+    import omniORB
+    from omniORB import CORBA
+except ImportError:
+    omniORB = None
+
+from rtshell import ilog
+from rtshell import log_index
+from rtshell import log_io
+
+
+###############################################################################
+## Framed log format
+##
+## All integers are little-endian.
+##
+## File header: magic (8 bytes), version (uint32), trailer offset (int64, -1
+##              until the log is closed), metadata length (uint64)
+## Metadata (pickled)
+## [Records: header, payload]
+##
+## Each record header is: payload length (uint32), timestamp in nanoseconds
+## (int64), channel ID (uint16), flags (uint16), offset of the previous data
+## record (int64, -1 for the first record).
+##
+## Data records carry the pickled data. If the data written to the log is a
+## (channel name, value) tuple, as written by rtlog, only the value is stored
+## in the payload and the name is given by the channel ID. Channel 0 is used
+## for data that is not a tuple of that form.
+##
+## If the FLAG_CDR flag of a data record is set, its payload is the value
+## marshalled to CDR with the type of its channel, rather than pickled. The
+## CDR is little-endian if FLAG_LITTLE_ENDIAN is also set, and big-endian
+## otherwise. These records are written by cdr_log.CdrLog.
+##
+## A channel definition record (channel ID CHANNEL_DEF) precedes the first
+## data record of each named channel. Its payload is the channel ID (uint16)
+## followed by the channel name in UTF-8. If the channel has a CDR type, the
+## name is followed by a NUL byte and the CORBA repository ID of the type
+## (e.g. 'IDL:RTC/TimedLong:1.0').
+##
+## The trailer record (channel ID CHANNEL_TRAILER) is written when the log is
+## closed. Its payload is the index, timestamp and offset of the last data
+## record (END), the number of channels (uint32), and then each channel's ID
+## (uint16), name length (uint16) and name, including the repository ID of
+## the channel's type as in the channel definition.
+##
+## Because the record headers are fixed-size, readers can skip records by
+## seeking, without decoding their payloads. An index of the data records is
+## written alongside the log (see log_index).
+
+MAGIC = b'RTLOGFRM'
+VERSION = 1
+FILE_HEADER = struct.Struct('<8sIqQ')
+TRAILER_PTR_POS = 12
+HEADER = struct.Struct('<IqHHq')
+CHANNEL_ID = struct.Struct('<H')
+CHANNEL_ENTRY = struct.Struct('<HH')
+END = struct.Struct('<qqqI')
+
+UNNAMED_CHANNEL = 0
+CHANNEL_TRAILER = 0xFFFE
+CHANNEL_DEF = 0xFFFF
+
+FLAG_CDR = 0x0001
+FLAG_LITTLE_ENDIAN = 0x0002
+
+
+_type_codes = {}
+
+
+def type_code(type_id):
+    '''Get the TypeCode of an IDL type from its repository ID.
+
+    The module declaring the type must have been imported. The TypeCodes
+    are cached.
+
+    '''
+    if omniORB is None:
+        raise ImportError('omniORB is required for CDR data.')
+    tc = _type_codes.get(type_id)
+    if tc is None:
+        tc = CORBA.TypeCode(type_id)
+        _type_codes[type_id] = tc
+    return tc
+
+
+###############################################################################
+## Record header
+
+class Record(object):
+    '''The header of a data record and its position in the log.'''
+    __slots__ = ('index', 'ts', 'channel', 'flags', 'offset', 'length',
+            'prev')
+
+    def __init__(self, index, ts, channel, flags, offset, length, prev):
+        self.index = index
+        self.ts = ts
+        self.channel = channel
+        self.flags = flags
+        self.offset = offset
+        self.length = length
+        self.prev = prev
+
+    def __str__(self):
+        return 'Index: {0}, timestamp: {1}, channel: {2}, flags: {3}, '\
+                'offset: {4}, length: {5}, previous: {6}'.format(self.index,
+                        self.ts, self.channel, self.flags, self.offset,
+                        self.length, self.prev)
+
+    @property
+    def end(self):
+        '''The offset of the end of the record.'''
+        return self.offset + HEADER.size + self.length
+
+    @property
+    def timestamp(self):
+        '''The record's timestamp as an EntryTS.'''
+        return ilog.EntryTS(sec=self.ts // 1000000000,
+                nsec=self.ts % 1000000000)
+
+
+###############################################################################
+## Framed binary log object.
+
+class FramedLog(ilog.Log):
+    def __init__(self, filename='', index=True, channels=None,
+            buffer_size=log_io.DEFAULT_BUFFER_SIZE, flush_interval=None,
+            fsync=log_io.FSYNC_NEVER, *args, **kwargs):
+        '''Constructor.
+
+        @param filename The name of the log file.
+        @param index Write (or use, when reading) an index of the records
+                     alongside the log.
+        @param channels When reading, only return records from the channels
+                        with these names. Other records are skipped without
+                        being decoded. None to read all records.
+        @param buffer_size The size in bytes of the write buffer.
+        @param flush_interval When writing, flush the write buffer if this many
+                              seconds have passed since the last flush. None
+                              to only flush when the buffer is full.
+        @param fsync When to sync the log to the storage device when writing.
+                     See log_io.parse_fsync_policy.
+
+        '''
+        self._is_open = False
+        self._policy = log_io.WritePolicy(buffer_size=buffer_size,
+                flush_interval=flush_interval, fsync=fsync)
+        self._fn = filename
+        self._use_index = index
+        self._index = None
+        self._idx_writer = None
+        self._filter_names = channels
+        self._filter = None
+        self._chans = {}
+        self._chan_names = {}
+        self._chan_types = {}
+        self._next = None
+        self._last = None
+        self._end = None
+        self._start = None
+        super(FramedLog, self).__init__(*args, **kwargs)
+
+    def __str__(self):
+        return 'FramedLog({0}, {1}) at position {2}.'.format(self._fn,
+                self._mode, self.pos)
+
+    @property
+    def channels(self):
+        '''The channels in the log, as a dictionary of {ID: name}.'''
+        return dict(self._chans)
+
+    @property
+    def channel_types(self):
+        '''The repository IDs of the CDR types of the channels, as a
+        dictionary of {ID: repository ID}. Channels without a CDR type are
+        not included.'''
+        return dict(self._chan_types)
+
+    def write(self, timestamp, data):
+        if type(data) == tuple and len(data) == 2 and \
+                isinstance(data[0], str):
+            chan = self._channel_id(data[0], self._type_id(data[1]))
+            value = data[1]
+        else:
+            chan = UNNAMED_CHANNEL
+            value = data
+        ts = ilog.ts_to_ns(timestamp)
+        flags, payload = self._encode(chan, value)
+        self._write_record(ts, chan, flags, payload)
+
+    def read(self, timestamp=None, number=None):
+        if number is not None:
+            if number < 0:
+                raise ValueError
+            res = []
+            for ii in range(number):
+                if not self._read_one(res):
+                    break
+            return res
+        elif timestamp is not None:
+            if timestamp < 0:
+                raise ValueError
+            ts = ilog.ts_to_ns(timestamp)
+            res = []
+            while self._next is not None and self._next.ts <= ts:
+                self._read_one(res)
+            return res
+        else:
+            res = []
+            self._read_one(res)
+            return res
+
+    def read_headers(self):
+        '''Read the headers of the records from the current position to the
+        end of the log, without decoding the data.
+
+        Returns a generator of Record objects. The position is moved as each
+        record is read.
+
+        '''
+        while self._next is not None:
+            rec = self._next
+            self._step_forward()
+            yield rec
+
+    def rebuild_index(self):
+        '''Rebuild the record index by reading through the record headers.
+
+        The new index is saved alongside the log if possible.
+
+        '''
+        self._vb_print('Rebuilding index of log {0}.'.format(self._fn))
+        self._scan()
+        try:
+            self._index.save(log_index.index_file_name(self._fn))
+        except (IOError, OSError):
+            self._vb_print('Could not save the rebuilt index.')
+        return self._index
+
+    def rewind(self):
+        self._vb_print('Rewinding log from position {0}.'.format(self.pos))
+        if self._mode == 'r':
+            self._last = None
+            self._next = self._advance(self._data_start, 0)
+        else:
+            self._file.seek(0)
+            self._file.truncate()
+            self._init_log()
+
+    def seek(self, timestamp=None, index=None):
+        self._vb_print('Seeking log from position {0}.'.format(self.pos))
+        if index is not None:
+            if index < 0:
+                raise ilog.InvalidIndexError
+            idx = self._get_index()
+            self._jump_to(idx, idx.find_index(index))
+        elif timestamp is not None:
+            idx = self._get_index()
+            self._jump_to(idx, idx.find_timestamp(ilog.ts_to_ns(timestamp)))
+        self._vb_print('New current position: {0}.'.format(self.pos))
+
+    def _add_channel(self, chan, name):
+        '''Add a channel from its definition: the name, optionally followed
+        by a NUL and the repository ID of its type.'''
+        name, sep, type_id = name.partition('\0')
+        if type_id:
+            self._chan_types[chan] = type_id
+        self._chans[chan] = name
+        self._chan_names[name] = chan
+        if self._filter_names is not None and name in self._filter_names:
+            self._filter.add(chan)
+
+    def _advance(self, offset, index):
+        '''Find the next wanted data record, starting from an offset.
+
+        Channel definitions found along the way are recorded. Returns None
+        at the end of the log.
+
+        '''
+        while True:
+            rec = self._read_header(offset, index)
+            if rec is None:
+                return None
+            if self._filter is None or rec.channel in self._filter:
+                return rec
+            offset = rec.end
+            index += 1
+
+    def _backup_one(self):
+        '''Reverses in the log one record.'''
+        if self._next is None:
+            if self._end[0] < 0:
+                return
+            target = self._end[2]
+            index = self._end[0]
+        elif self._next.prev < 0:
+            self._vb_print('Backup already at start.')
+            return
+        else:
+            target = self._next.prev
+            index = self._next.index - 1
+        while True:
+            rec = self._read_header(target, index)
+            if self._filter is None or rec.channel in self._filter or \
+                    rec.prev < 0:
+                break
+            target = rec.prev
+            index -= 1
+        self._next = rec
+        self._last = None
+
+    def _channel_def(self, chan):
+        '''Get the definition of a channel: its name and the repository ID
+        of its type.'''
+        if chan in self._chan_types:
+            return self._chans[chan] + '\0' + self._chan_types[chan]
+        return self._chans[chan]
+
+    def _channel_id(self, name, type_id=None):
+        '''Get the ID of a named channel, defining it if it is new.
+
+        @param name The name of the channel.
+        @param type_id The repository ID of the CDR type of the channel's
+                       values, or None to pickle them.
+
+        '''
+        chan = self._chan_names.get(name)
+        if chan is None:
+            chan = len(self._chans) + 1
+            if chan >= CHANNEL_TRAILER:
+                raise ValueError('Too many channels in log')
+            if type_id:
+                self._add_channel(chan, name + '\0' + type_id)
+            else:
+                self._add_channel(chan, name)
+            payload = CHANNEL_ID.pack(chan) + \
+                    self._channel_def(chan).encode('utf-8')
+            self._write_raw(0, CHANNEL_DEF, 0, -1, payload)
+        return chan
+
+    def _close(self):
+        if not self._is_open:
+            return
+        if self._mode == 'w':
+            # Write the trailer, then point to it from the file header
+            trailer = self._offset
+            self._write_raw(0, CHANNEL_TRAILER, 0, -1, self._make_trailer())
+            self._file.seek(TRAILER_PTR_POS)
+            self._file.write(struct.pack('<q', trailer))
+            self._vb_print('Wrote trailer at {0}'.format(trailer))
+            if self._idx_writer:
+                self._idx_writer.close()
+                self._idx_writer = None
+            self._policy.closing(self._file)
+        self._file.close()
+        self._is_open = False
+        self._vb_print('Closed file.')
+
+    def _decode(self, rec):
+        '''Read and decode the data of a record.'''
+        self._file.seek(rec.offset + HEADER.size)
+        payload = self._file.read(rec.length)
+        if len(payload) != rec.length:
+            raise ilog.EndOfLogError
+        value = self._decode_payload(rec, payload)
+        if rec.channel == UNNAMED_CHANNEL:
+            return value
+        return (self._chans[rec.channel], value)
+
+    def _decode_payload(self, rec, payload):
+        if rec.flags & FLAG_CDR:
+            tc = type_code(self._chan_types[rec.channel])
+            return omniORB.cdrUnmarshal(tc, payload,
+                    bool(rec.flags & FLAG_LITTLE_ENDIAN))
+        return pickle.loads(payload)
+
+    def _encode(self, chan, value):
+        '''Encode a value for writing. Returns (flags, payload).'''
+        return 0, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def _eof(self):
+        return self._next is None
+
+    def _get_cur_pos(self):
+        if self._mode == 'w':
+            return self._write_ind, -1
+        if self._next is not None:
+            return self._next.index, self._next.timestamp
+        if self._last is not None:
+            return self._last.index + 1, self._last.timestamp
+        return self._end[0] + 1, self._ns_to_ts(self._end[1])
+
+    def _get_end(self):
+        return self._end[0], self._ns_to_ts(self._end[1])
+
+    def _get_index(self):
+        '''Get the record index, loading or rebuilding it if necessary.'''
+        if self._index is None:
+            self._index = self._load_index()
+            if self._index is None:
+                self.rebuild_index()
+        return self._index
+
+    def _get_start(self):
+        if self._start is None:
+            rec = self._read_header(self._data_start, 0)
+            if rec is None:
+                return 0, None
+            self._start = rec
+        return self._start.index, self._start.timestamp
+
+    def _init_log(self):
+        if self._mode == 'r':
+            self._vb_print('Initialising log for reading.')
+            magic, version, trailer, meta_len = FILE_HEADER.unpack(
+                    self._file.read(FILE_HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('{0} is not a framed log'.format(self._fn))
+            self._meta = pickle.loads(self._file.read(meta_len))
+            self._data_start = FILE_HEADER.size + meta_len
+            if self._filter_names is not None:
+                self._filter = set()
+            if trailer >= 0 and self._read_trailer(trailer):
+                self._vb_print('Read trailer at {0}'.format(trailer))
+            else:
+                # Not closed properly; find the end from the record headers
+                self._vb_print('No trailer found; scanning record headers.')
+                self._scan()
+            self._last = None
+            self._next = self._advance(self._data_start, 0)
+        else:
+            self._vb_print('Initialising log for writing.')
+            meta = pickle.dumps(self._meta, pickle.HIGHEST_PROTOCOL)
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, -1, len(meta)))
+            self._file.write(meta)
+            self._offset = FILE_HEADER.size + len(meta)
+            self._data_start = self._offset
+            self._write_ind = 0
+            self._prev = -1
+            self._end = (-1, 0, -1)
+            self._chans = {}
+            self._chan_names = {}
+            self._chan_types = {}
+            if self._use_index:
+                if self._idx_writer:
+                    self._idx_writer.close()
+                self._idx_writer = log_index.IndexWriter(
+                        log_index.index_file_name(self._fn))
+
+    def _jump_to(self, index, pos):
+        '''Moves directly to the record at a position in the index.
+
+        If the position is None, the log is moved to the end.
+
+        '''
+        self._last = None
+        if pos is None:
+            self._next = None
+            return
+        ind, ts, offset = index.entry(pos)
+        self._next = self._advance(offset, ind)
+
+    def _load_index(self):
+        '''Load the index file of the log, if it exists and is up to date.'''
+        if not self._use_index:
+            return None
+        fn = log_index.index_file_name(self._fn)
+        if not os.path.isfile(fn):
+            return None
+        index = log_index.LogIndex()
+        try:
+            index.load(fn)
+        except (IOError, OSError, ValueError):
+            self._vb_print('Could not read index file {0}.'.format(fn))
+            return None
+        if len(index) != self._end[0] + 1 or (len(index) and
+                index.entry(len(index) - 1)[2] != self._end[2]):
+            self._vb_print('Index file {0} is out of date.'.format(fn))
+            return None
+        return index
+
+    def _make_trailer(self):
+        result = [END.pack(self._end[0], self._end[1], self._end[2],
+            len(self._chans))]
+        for chan in sorted(self._chans):
+            name = self._channel_def(chan).encode('utf-8')
+            result.append(CHANNEL_ENTRY.pack(chan, len(name)) + name)
+        return b''.join(result)
+
+    def _ns_to_ts(self, ns):
+        return ilog.EntryTS(sec=ns // 1000000000, nsec=ns % 1000000000)
+
+    def _open(self):
+        if self._is_open:
+            return
+        if self._mode == 'r':
+            flags = 'rb'
+        elif self._mode == 'w':
+            flags = 'wb'
+        else:
+            raise NotImplementedError
+        if self._mode == 'w':
+            self._file = self._policy.open(self._fn, flags)
+        else:
+            self._file = open(self._fn, flags)
+        self._init_log()
+        self._is_open = True
+        self._vb_print('Opened file {0} in mode {1}.'.format(self._fn,
+            self._mode))
+
+    def _read_header(self, offset, index):
+        '''Read the data record header at an offset.
+
+        Channel definition records are read and skipped. Returns None at the
+        end of the log.
+
+        '''
+        while True:
+            self._file.seek(offset)
+            raw = self._file.read(HEADER.size)
+            if len(raw) < HEADER.size:
+                return None
+            length, ts, chan, flags, prev = HEADER.unpack(raw)
+            if chan == CHANNEL_DEF:
+                payload = self._file.read(length)
+                if len(payload) < length:
+                    return None
+                self._add_channel(CHANNEL_ID.unpack(payload[:2])[0],
+                        payload[2:].decode('utf-8'))
+                offset += HEADER.size + length
+                continue
+            elif chan == CHANNEL_TRAILER:
+                return None
+            return Record(index, ts, chan, flags, offset, length, prev)
+
+    def _read_one(self, res):
+        '''Read the next record into a result list.
+
+        Returns False at the end of the log.
+
+        '''
+        if self._next is None:
+            return False
+        rec = self._next
+        try:
+            data = self._decode(rec)
+        except ilog.EndOfLogError:
+            self._next = None
+            return False
+        res.append((rec.index, rec.timestamp, data))
+        self._step_forward()
+        return True
+
+    def _read_trailer(self, trailer):
+        self._file.seek(trailer)
+        raw = self._file.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            return False
+        length, ts, chan, flags, prev = HEADER.unpack(raw)
+        if chan != CHANNEL_TRAILER:
+            return False
+        payload = self._file.read(length)
+        end_ind, end_ts, end_offset, num_chans = END.unpack(
+                payload[:END.size])
+        self._end = (end_ind, end_ts, end_offset)
+        pos = END.size
+        for ii in range(num_chans):
+            chan, name_len = CHANNEL_ENTRY.unpack(
+                    payload[pos:pos + CHANNEL_ENTRY.size])
+            pos += CHANNEL_ENTRY.size
+            self._add_channel(chan, payload[pos:pos + name_len].decode('utf-8'))
+            pos += name_len
+        return True
+
+    def _scan(self):
+        '''Read through all record headers to find the end of the log.
+
+        The record index and the channel table are built along the way.
+
+        '''
+        index = log_index.LogIndex()
+        size = os.fstat(self._file.fileno()).st_size
+        offset = self._data_start
+        ind = 0
+        last = None
+        while True:
+            rec = self._read_header(offset, ind)
+            if rec is None:
+                break
+            if rec.end > size:
+                # Incomplete final record
+                break
+            index.append(ind, rec.ts, rec.offset)
+            last = rec
+            offset = rec.end
+            ind += 1
+        if last is None:
+            self._end = (-1, 0, -1)
+        else:
+            self._end = (last.index, last.ts, last.offset)
+        self._index = index
+
+    def _step_forward(self):
+        self._last = self._next
+        self._next = self._advance(self._last.end, self._last.index + 1)
+
+    def _type_id(self, value):
+        '''Get the repository ID of the CDR type to record a new channel's
+        values as, or None to pickle them.'''
+        return None
+
+    def _write_raw(self, ts, chan, flags, prev, payload):
+        self._file.write(HEADER.pack(len(payload), ts, chan, flags, prev))
+        self._file.write(payload)
+        self._offset += HEADER.size + len(payload)
+
+    def _write_record(self, ts, chan, flags, payload):
+        offset = self._offset
+        self._write_raw(ts, chan, flags, self._prev, payload)
+        if self._idx_writer:
+            self._idx_writer.append(self._write_ind, ts, offset)
+        self._end = (self._write_ind, ts, offset)
+        self._prev = offset
+        self._write_ind += 1
+        self._policy.entry_written(self._file)
+
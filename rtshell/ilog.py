@@ -40,94 +40,117 @@ class InvalidIndexError(EOFError):
 ## Entry timestamps
 
 class EntryTS(object):
-    def __init__(self, sec=0, nsec=0, time=None):
+    '''The timestamp of a log entry.
+
+    The time is stored as an integer number of nanoseconds, so comparing two
+    timestamps is a single integer comparison. It is pickled as seconds and
+    nanoseconds, the same as logs written before, so old and new logs can be
+    read by either version.
+
+    '''
+    __slots__ = ('_ns',)
+
+    def __init__(self, sec=0, nsec=0, time=None, ns=None):
         super(EntryTS, self).__init__()
-        if time is not None:
-            self._sec, self._nsec = self._get_values(time)
+        if ns is not None:
+            self._ns = ns
+        elif time is not None:
+            self._ns = _float_to_ns(time)
         else:
-            self._sec = sec
-            self._nsec = nsec
+            self._ns = sec * 1000000000 + nsec
 
     def __repr__(self):
-        return 'EntryTS(_sec={0}, _nsec={1})'.format(self._sec, self._nsec)
+        return 'EntryTS(_sec={0}, _nsec={1})'.format(self.sec, self.nsec)
 
     def __str__(self):
-        return '{0}.{1:09}'.format(self._sec, self._nsec)
+        return '{0}.{1:09}'.format(self.sec, self.nsec)
+
+    def __getstate__(self):
+        return {'_sec': self.sec, '_nsec': self.nsec}
+
+    def __setstate__(self, state):
+        self._ns = state['_sec'] * 1000000000 + state['_nsec']
+
+    def __hash__(self):
+        return hash(self._ns)
 
     def __lt__(self, other):
-        sec, nsec = self._get_values(other)
-        if self._sec < sec:
-            return True
-        elif self._sec == sec:
-            if self._nsec < nsec:
-                return True
-        return False
+        if type(other) is EntryTS:
+            return self._ns < other._ns
+        return self._ns < _float_to_ns(other)
 
     def __le__(self, other):
-        sec, nsec = self._get_values(other)
-        if self._sec < sec:
-            return True
-        elif self._sec == sec:
-            if self._nsec <= nsec:
-                return True
-        return False
+        if type(other) is EntryTS:
+            return self._ns <= other._ns
+        return self._ns <= _float_to_ns(other)
 
     def __eq__(self, other):
-        sec, nsec = self._get_values(other)
-        if self._sec == sec and self._nsec == nsec:
-            return True
-        return False
+        if type(other) is EntryTS:
+            return self._ns == other._ns
+        return self._ns == _float_to_ns(other)
 
     def __ne__(self, other):
-        sec, nsec = self._get_values(other)
-        if self._sec != sec or self._nsec != nsec:
-            return True
-        return False
+        if type(other) is EntryTS:
+            return self._ns != other._ns
+        return self._ns != _float_to_ns(other)
 
     def __gt__(self, other):
-        sec, nsec = self._get_values(other)
-        if self._sec > sec:
-            return True
-        elif self._sec == sec:
-            if self._nsec > nsec:
-                return True
-        return False
+        if type(other) is EntryTS:
+            return self._ns > other._ns
+        return self._ns > _float_to_ns(other)
 
     def __ge__(self, other):
-        sec, nsec = self._get_values(other)
-        if self._sec > sec:
-            return True
-        elif self._sec == sec:
-            if self._nsec >= nsec:
-                return True
-        return False
+        if type(other) is EntryTS:
+            return self._ns >= other._ns
+        return self._ns >= _float_to_ns(other)
 
     @property
     def float(self):
         '''Get the time value as a float.'''
-        return float(self._sec) + float(self._nsec) / 1e9
+        return float(self.sec) + float(self.nsec) / 1e9
+
+    @property
+    def ns(self):
+        '''Get the time value as an integer number of nanoseconds.'''
+        return self._ns
 
     @property
     def sec(self):
-        return self._sec
+        return self._ns // 1000000000
 
     @sec.setter
     def sec(self, sec):
-        self._sec = sec
+        self._ns = sec * 1000000000 + self._ns % 1000000000
 
     @property
     def nsec(self):
-        return self._nsec
+        return self._ns % 1000000000
 
     @nsec.setter
     def nsec(self, nsec):
-        self._nsec = nsec
+        self._ns = self._ns - self._ns % 1000000000 + nsec
 
-    def _get_values(self, other):
-        if type(other) == EntryTS:
-            return other.sec, other.nsec
-        else:
-            return int(other), int((other * 1000000000) % 1000000000)
+
+def _float_to_ns(value):
+    '''Convert a number of seconds to nanoseconds.
+
+    The seconds and the fraction are truncated separately, matching how
+    numbers have always been compared with timestamps.
+
+    '''
+    return int(value) * 1000000000 + int((value * 1000000000) % 1000000000)
+
+
+def ts_to_ns(ts):
+    '''Convert a log timestamp to integer nanoseconds.
+
+    The timestamp may be an EntryTS or a number of seconds. Numbers are
+    converted the same way as when they are compared with an EntryTS.
+
+    '''
+    if type(ts) is EntryTS:
+        return ts._ns
+    return _float_to_ns(ts)
 
 
 ###############################################################################
@@ -300,6 +323,83 @@ class Log(object):
         '''
         raise NotImplementedError
 
+    def read_channel(self, name, start=None, end=None, batch=1000,
+            index=False):
+        '''Read the entries of one channel in batches of arrays.
+
+        The entries must be (channel name, data) tuples, as written by
+        rtlog. Each batch is a dictionary of NumPy arrays: the entry indices
+        ('index'), the timestamps in integer nanoseconds ('timestamp_ns')
+        and one array per field of the data. The fields are flattened as
+        described in log_export.
+
+        The log is moved to the start position before reading. NumPy is
+        required.
+
+        @param name The name of the channel to read.
+        @param start The time or entry index of the first entry to read.
+                     None to read from the start of the log.
+        @param end The time or entry index of the last entry to read. None to
+                   read to the end of the log.
+        @param batch The maximum number of entries in each batch.
+        @param index Treat start and end as entry indices.
+        @return A generator of batches.
+
+        '''
+        # Imported here because log_export depends on this module
+        from rtshell import log_export
+        if batch < 1:
+            raise ValueError('Batch size must be at least 1')
+        if start is None:
+            self.rewind()
+        elif index:
+            self.seek(index=start)
+        else:
+            self.seek(timestamp=start)
+        entries = []
+        while True:
+            chunk = self.read(number=batch)
+            for e in chunk:
+                if end is not None and \
+                        ((index and e[0] > end) or (not index and e[1] > end)):
+                    chunk = []
+                    break
+                if type(e[2]) == tuple and len(e[2]) == 2 and \
+                        e[2][0] == name:
+                    entries.append((e[0], e[1], e[2][1]))
+            if len(entries) >= batch or (not chunk and entries):
+                yield log_export.to_arrays(entries[:batch])
+                entries = entries[batch:]
+            if not chunk and not entries:
+                return
+
+    def read_reverse(self, number=1):
+        '''Read entries backwards from the current position.
+
+        The entries before the current position are returned, latest first,
+        and the log is moved back to the earliest entry returned. Calling
+        this repeatedly steps backwards through the log; reading forwards
+        afterwards returns the earliest entry returned again.
+
+        Implementations should override this if stepping back one entry costs
+        more than stepping forward one entry.
+
+        @param number The number of entries to read.
+        @return A list of tuples, [(index, timestamp, data), ...], or an empty
+                list at the start of the log.
+
+        '''
+        res = []
+        for ii in range(number):
+            before = self.pos[0]
+            self._backup_one()
+            if self.pos[0] == before:
+                # At the start
+                break
+            res += self.read()
+            self._backup_one()
+        return res
+
     def rewind(self):
         '''Rewind the log to the first entry.'''
         raise NotImplementedError
@@ -323,6 +423,15 @@ class Log(object):
         '''
         raise NotImplementedError
 
+    def _backup_one(self):
+        '''Move back one entry in the log.
+
+        Should be implemented by implementation objects. At the start of the
+        log, the position should not change.
+
+        '''
+        raise NotImplementedError
+
     def _close(self):
         raise NotImplementedError
 
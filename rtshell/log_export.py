@@ -0,0 +1,535 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Export of logs to NumPy files.
+
+'''
+
+
+from __future__ import print_function
+
+import os
+import os.path
+import re
+import sys
+import tempfile
+import zipfile
+
+try:
+    import numpy
+    import numpy.lib.format
+except ImportError:
+    numpy = None
+
+from rtshell import ilog
+from rtshell import parallel_scan
+
+
+###############################################################################
+## Export format
+##
+## Each channel of the log is written to its own .npz file. Every file holds
+## the entry indices ('index'), the entry timestamps in seconds ('timestamp')
+## and nanoseconds ('timestamp_ns'), and one array per field of the data.
+##
+## Struct fields are flattened into arrays named by their path, e.g.
+## 'pose.position.x'. Time fields (RTC.Time and other structs of sec and nsec)
+## become a single array of seconds, so the standard 'tm' and 'data' fields of
+## the RTC data types become the 'tm' and 'data' arrays. Sequences of numbers
+## become either a two-dimensional array padded with NaN (or zero for integer
+## types) along with a '<name>.length' array, or, in ragged mode, a flat array
+## of all the values along with a '<name>.offsets' array giving where each
+## entry's values start and end. The fields of sequences of structs are
+## treated as sequences of numbers. Strings become arrays of strings, or
+## UTF-8 bytes and offsets in ragged mode. Other values (e.g. sequences of
+## sequences) are not exported.
+##
+## The values are written to temporary files in batches as the log is read,
+## so memory use does not depend on the length of the log.
+
+DEFAULT_BATCH_SIZE = 4096
+
+if sys.version_info[0] >= 3:
+    _INT_TYPES = (int,)
+    _STR_TYPES = (str,)
+    _BYTES_TYPES = (bytes,)
+else:
+    _INT_TYPES = (int, long)
+    _STR_TYPES = (str, unicode)
+    _BYTES_TYPES = ()
+
+
+def channel_file_name(prefix, channel):
+    '''Get the name of the export file for a channel.'''
+    return '{0}_{1}.npz'.format(prefix, re.sub(r'[^A-Za-z0-9_.-]', '_',
+        channel))
+
+
+def export_npz(log, prefix, ragged=False, batch_size=DEFAULT_BATCH_SIZE,
+        verbose=False):
+    '''Export each channel of a log to a NumPy .npz file.
+
+    The log is read once, from its current position to the end.
+
+    @param log The log to export. Its entries should be (channel name, data)
+               tuples, as recorded by rtlog. Other entries are exported as the
+               channel 'data'.
+    @param prefix The path and start of the file name of the export files.
+                  The channel name and '.npz' are added to it.
+    @param ragged Export sequences as flat arrays of values and offsets
+                  rather than padded arrays.
+    @param batch_size The number of entries to hold in memory for each array
+                      before writing them to a temporary file.
+    @param verbose Print verbose output to stderr.
+    @return A dictionary of {channel name: export file name}.
+
+    '''
+    return _export((_flatten_entry(e) for e in log), prefix, ragged,
+            batch_size, verbose)
+
+
+def export_npz_parallel(l_type, filename, prefix, ragged=False,
+        batch_size=DEFAULT_BATCH_SIZE, jobs=0, log_opts={}, verbose=False):
+    '''Export each channel of a log to a NumPy .npz file using a pool of
+    worker processes.
+
+    The entries are decoded and flattened by the workers, and the results
+    are written by this process in index order. The files are the same as
+    those written by @ref export_npz.
+
+    @param l_type The type of the log.
+    @param filename The name of the log file.
+    @param prefix The path and start of the file name of the export files.
+    @param ragged Export sequences as flat arrays of values and offsets.
+    @param batch_size The number of entries to hold in memory for each array
+                      before writing them to a temporary file.
+    @param jobs The number of worker processes. 0 uses one per CPU.
+    @param log_opts Extra options to give when opening the log.
+    @param verbose Print verbose output to stderr.
+    @return A dictionary of {channel name: export file name}.
+
+    '''
+    def records():
+        for r in parallel_scan.scan(l_type, filename, _flatten_range,
+                jobs=jobs, log_opts=log_opts, verbose=verbose):
+            for rec in r:
+                yield rec
+    return _export(records(), prefix, ragged, batch_size, verbose)
+
+
+def _export(records, prefix, ragged, batch_size, verbose):
+    '''Export flattened entries, given as (channel, index, timestamp in
+    nanoseconds, leaves) tuples.'''
+    if numpy is None:
+        raise ImportError('NumPy is required to export logs.')
+    tmp_dir = os.path.dirname(os.path.abspath(prefix))
+    channels = {}
+    try:
+        for name, index, ts_ns, leaves in records:
+            if name not in channels:
+                if verbose:
+                    print('Exporting channel {0}'.format(name),
+                            file=sys.stderr)
+                channels[name] = _Channel(name, batch_size, tmp_dir)
+            channels[name].add(index, ts_ns, leaves)
+        result = {}
+        for name in sorted(channels.keys()):
+            fn = channel_file_name(prefix, name)
+            channels[name].save(fn, ragged)
+            if verbose:
+                print('Wrote {0} entries of channel {1} to {2}'.format(
+                    channels[name].count, name, fn), file=sys.stderr)
+            result[name] = fn
+        return result
+    finally:
+        for c in channels.values():
+            c.close()
+
+
+def to_arrays(entries):
+    '''Convert a list of entries to NumPy arrays.
+
+    The arrays are the same as those exported by @ref export_npz, except
+    that sequences are always padded and there is no 'timestamp' array.
+    Fields missing from some entries are filled with NaN, zero or an empty
+    string.
+
+    @param entries A list of (index, timestamp, value) tuples.
+    @return A dictionary of {name: array}.
+
+    '''
+    if numpy is None:
+        raise ImportError('NumPy is required to convert entries to arrays.')
+    result = {'index': numpy.array([e[0] for e in entries], dtype='<i8'),
+            'timestamp_ns': numpy.array([ilog.ts_to_ns(e[1])
+                for e in entries], dtype='<i8')}
+    columns = {}
+    for row, (index, ts, value) in enumerate(entries):
+        leaves = []
+        _flatten(value, '', leaves)
+        for name, kind, v in leaves:
+            if not name:
+                name = 'value'
+            if name not in columns:
+                columns[name] = (kind, [None] * len(entries))
+            columns[name][1][row] = v
+    for name, (kind, values) in columns.items():
+        if kind == 't':
+            result[name] = numpy.array([v if v is not None else u''
+                for v in values])
+        elif kind == 's':
+            dtype = numpy.asarray([v for v in values if v is not None]).dtype
+            fill = numpy.nan if dtype.kind == 'f' else 0
+            result[name] = numpy.array([v if v is not None else fill
+                for v in values], dtype=dtype)
+        else:
+            values = [v if v is not None else [] for v in values]
+            lengths = numpy.array([len(v) for v in values], dtype='<i8')
+            flat = numpy.asarray([x for v in values for x in v])
+            if not len(flat):
+                flat = flat.astype('<f8')
+            if flat.dtype.kind == 'f':
+                data = numpy.full((len(values), lengths.max()), numpy.nan,
+                        dtype=flat.dtype)
+            else:
+                data = numpy.zeros((len(values), lengths.max()),
+                        dtype=flat.dtype)
+            data[numpy.arange(lengths.max()) < lengths[:, numpy.newaxis]] = \
+                    flat
+            result[name] = data
+            result[name + '.length'] = lengths
+    return result
+
+
+###############################################################################
+## Flattening of data values
+
+def _flatten_entry(entry):
+    '''Flatten an entry into a (channel, index, timestamp in nanoseconds,
+    leaves) tuple.'''
+    index, ts, data = entry
+    if type(data) == tuple and len(data) == 2 and \
+            isinstance(data[0], _STR_TYPES):
+        name, value = data
+    else:
+        name, value = 'data', data
+    leaves = []
+    _flatten(value, '', leaves)
+    return name, index, ilog.ts_to_ns(ts), leaves
+
+
+def _flatten_range(log, first, last):
+    '''Flatten the entries of a range of a log. Used by parallel exports.'''
+    return [_flatten_entry(e) for e in parallel_scan.entries(log, first,
+        last)]
+
+
+def _is_time(value):
+    fields = getattr(value, '__dict__', None)
+    return fields is not None and sorted(fields.keys()) == ['nsec', 'sec']
+
+
+def _is_number(value):
+    return isinstance(value, (bool, float) + _INT_TYPES) or \
+            hasattr(value, '_v') # CORBA enum
+
+
+def _number(value):
+    if hasattr(value, '_v'):
+        return value._v
+    return value
+
+
+def _fields(value):
+    return sorted([f for f in getattr(value, '__dict__', {}).keys()
+        if not f.startswith('_')])
+
+
+def _flatten(value, name, out):
+    '''Flatten a value into a list of (name, kind, value) leaves.
+
+    The kinds are 's' (a single number), 't' (a string) and 'r' (a list of
+    numbers).
+
+    '''
+    if _is_time(value):
+        out.append((name, 's', value.sec + value.nsec / 1e9))
+    elif _is_number(value):
+        out.append((name, 's', _number(value)))
+    elif isinstance(value, _STR_TYPES):
+        out.append((name, 't', value))
+    elif isinstance(value, _BYTES_TYPES):
+        out.append((name, 'r', bytearray(value)))
+    elif isinstance(value, (list, tuple)):
+        if all([_is_number(v) for v in value]):
+            out.append((name, 'r', [_number(v) for v in value]))
+        elif all([_fields(v) for v in value]):
+            # A sequence of structs; each field is a sequence of numbers
+            leaves = {}
+            for v in value:
+                fields = []
+                _flatten(v, name, fields)
+                for f_name, kind, f_value in fields:
+                    if kind == 's':
+                        leaves.setdefault(f_name, []).append(f_value)
+            for f_name in sorted(leaves.keys()):
+                out.append((f_name, 'r', leaves[f_name]))
+    else:
+        for f in _fields(value):
+            _flatten(getattr(value, f), name + '.' + f if name else f, out)
+
+
+###############################################################################
+## Array spooling
+
+class _Spool(object):
+    '''An array of values being written to a temporary file in batches.'''
+    def __init__(self, batch_size, tmp_dir, dtype=None):
+        super(_Spool, self).__init__()
+        self._batch_size = batch_size
+        self._file = tempfile.TemporaryFile(dir=tmp_dir)
+        self._batch = []
+        self._dtype = numpy.dtype(dtype) if dtype is not None else None
+        self._fixed = dtype is not None
+        self.count = 0
+
+    @property
+    def dtype(self):
+        '''The type of the values. Doubles if no values have been added.'''
+        if self._dtype is None:
+            return numpy.dtype('<f8')
+        return self._dtype
+
+    def append(self, value):
+        self._batch.append(value)
+        self.count += 1
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def extend(self, values):
+        self._batch.extend(values)
+        self.count += len(values)
+        if len(self._batch) >= self._batch_size:
+            self.flush()
+
+    def close(self):
+        self._file.close()
+
+    def flush(self):
+        if not self._batch:
+            return
+        if self._fixed:
+            data = numpy.asarray(self._batch, dtype=self._dtype)
+        else:
+            data = numpy.asarray(self._batch)
+            if data.dtype.kind == 'b':
+                data = data.astype('?')
+            elif data.dtype.kind in 'iu':
+                data = data.astype('<i8')
+            elif data.dtype.kind == 'f':
+                data = data.astype('<f8')
+            else:
+                raise ValueError('Cannot export values of type {0}'.format(
+                    data.dtype))
+            if self._dtype is None:
+                self._dtype = data.dtype
+            elif data.dtype != self._dtype:
+                if not numpy.can_cast(data.dtype, self._dtype):
+                    raise ValueError(
+                            'Values changed type from {0} to {1}'.format(
+                                self._dtype, data.dtype))
+                data = data.astype(self._dtype)
+        self._file.write(data.tobytes())
+        self._batch = []
+
+    def rewind(self):
+        '''Go back to the first value, ready to read the values back.'''
+        self.flush()
+        self._file.seek(0)
+
+    def read(self, number):
+        '''Read back the next values.'''
+        data = self._file.read(int(number) * self.dtype.itemsize)
+        return numpy.frombuffer(data, dtype=self.dtype)
+
+    def batches(self):
+        '''Read back all the values, one batch at a time.'''
+        self.rewind()
+        while True:
+            data = self.read(self._batch_size)
+            if not len(data):
+                return
+            yield data
+
+
+class _Column(object):
+    '''A field of a channel.'''
+    def __init__(self, name, kind, batch_size, tmp_dir, rows=0):
+        super(_Column, self).__init__()
+        self.name = name
+        self.kind = kind
+        self._batch_size = batch_size
+        if kind == 't':
+            self._values = _Spool(batch_size, tmp_dir, dtype='u1')
+        else:
+            self._values = _Spool(batch_size, tmp_dir)
+        if kind == 's':
+            self._lengths = None
+        else:
+            self._lengths = _Spool(batch_size, tmp_dir, dtype='<i8')
+            # Entries before the field appeared had no values
+            for ii in range(rows):
+                self._lengths.append(0)
+
+    def add(self, value):
+        if self.kind == 's':
+            self._values.append(value)
+            return
+        if self.kind == 't':
+            value = bytearray(value.encode('utf-8'))
+        self._values.extend(value)
+        self._lengths.append(len(value))
+
+    def add_default(self):
+        if self.kind == 's':
+            self._values.append(0)
+        else:
+            self._lengths.append(0)
+
+    def close(self):
+        self._values.close()
+        if self._lengths is not None:
+            self._lengths.close()
+
+    def save(self, zf, rows, ragged):
+        if self.kind == 's':
+            _write_member(zf, self.name, self._values.dtype, (rows,),
+                    self._values.batches())
+        elif ragged:
+            _write_member(zf, self.name, self._values.dtype,
+                    (self._values.count,), self._values.batches())
+            _write_member(zf, self.name + '.offsets', numpy.dtype('<i8'),
+                    (rows + 1,), self._offsets())
+        else:
+            width = 0
+            for lens in self._lengths.batches():
+                width = max(width, int(lens.max()))
+            if self.kind == 't':
+                dtype = numpy.dtype('<U{0}'.format(max(width, 1)))
+                _write_member(zf, self.name, dtype, (rows,),
+                        self._padded(width, dtype))
+                return
+            _write_member(zf, self.name, self._values.dtype, (rows, width),
+                    self._padded(width, self._values.dtype))
+            _write_member(zf, self.name + '.length', numpy.dtype('<i8'),
+                    (rows,), self._lengths.batches())
+
+    def _offsets(self):
+        '''Generate batches of the offsets of each entry's values.'''
+        total = 0
+        yield numpy.zeros(1, dtype='<i8')
+        for lens in self._lengths.batches():
+            ends = numpy.cumsum(lens) + total
+            total = ends[-1]
+            yield ends
+
+    def _padded(self, width, dtype):
+        '''Generate batches of rows of the values, padded to a width.'''
+        self._values.rewind()
+        for lens in self._lengths.batches():
+            vals = self._values.read(lens.sum())
+            if self.kind == 't':
+                data = vals.tobytes()
+                ends = numpy.cumsum(lens)
+                yield numpy.array([data[e - l:e].decode('utf-8')
+                    for e, l in zip(ends, lens)], dtype=dtype)
+                continue
+            if dtype.kind == 'f':
+                rows = numpy.full((len(lens), width), numpy.nan, dtype=dtype)
+            else:
+                rows = numpy.zeros((len(lens), width), dtype=dtype)
+            mask = numpy.arange(width) < lens[:, numpy.newaxis]
+            rows[mask] = vals
+            yield rows
+
+
+class _Channel(object):
+    '''The arrays of one channel of a log.'''
+    def __init__(self, name, batch_size, tmp_dir):
+        super(_Channel, self).__init__()
+        self.name = name
+        self._batch_size = batch_size
+        self._tmp_dir = tmp_dir
+        self._index = _Spool(batch_size, tmp_dir, dtype='<i8')
+        self._ts = _Spool(batch_size, tmp_dir, dtype='<i8')
+        self._columns = {}
+        self.count = 0
+
+    def add(self, index, ts_ns, leaves):
+        self._index.append(index)
+        self._ts.append(ts_ns)
+        seen = set()
+        for name, kind, v in leaves:
+            if not name:
+                name = 'value'
+            col = self._columns.get(name)
+            if col is None:
+                col = _Column(name, kind, self._batch_size, self._tmp_dir,
+                        rows=self.count)
+                self._columns[name] = col
+            col.add(v)
+            seen.add(name)
+        for name, col in self._columns.items():
+            if name not in seen:
+                col.add_default()
+        self.count += 1
+
+    def close(self):
+        self._index.close()
+        self._ts.close()
+        for c in self._columns.values():
+            c.close()
+
+    def save(self, filename, ragged):
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED,
+                allowZip64=True) as zf:
+            _write_member(zf, 'index', numpy.dtype('<i8'), (self.count,),
+                    self._index.batches())
+            _write_member(zf, 'timestamp_ns', numpy.dtype('<i8'),
+                    (self.count,), self._ts.batches())
+            _write_member(zf, 'timestamp', numpy.dtype('<f8'), (self.count,),
+                    (t / 1e9 for t in self._ts.batches()))
+            for name in sorted(self._columns.keys()):
+                self._columns[name].save(zf, self.count, ragged)
+
+
+def _write_member(zf, name, dtype, shape, batches):
+    '''Write an array to a zip file as a .npy file, one batch at a time.'''
+    header = {'descr': numpy.lib.format.dtype_to_descr(dtype),
+            'fortran_order': False, 'shape': shape}
+    if sys.version_info >= (3, 6):
+        with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+            numpy.lib.format.write_array_header_1_0(f, header)
+            for b in batches:
+                f.write(numpy.ascontiguousarray(b, dtype=dtype).tobytes())
+    else:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(
+                os.path.abspath(zf.filename))) as f:
+            numpy.lib.format.write_array_header_1_0(f, header)
+            for b in batches:
+                f.write(numpy.ascontiguousarray(b, dtype=dtype).tobytes())
+            f.flush()
+            zf.write(f.name, name + '.npy')
@@ -0,0 +1,204 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Offset index for log files.
+
+'''
+
+
+import array
+import bisect
+import struct
+import sys
+
+
+###############################################################################
+## Index file format
+##
+## The index is stored in a sidecar file next to the log. It is a small header
+## followed by one fixed-size record per log entry:
+## Header: magic (8 bytes), version (uint32)
+## [Entries: (index (int64), timestamp in nanoseconds (int64),
+##            file offset (int64))]
+
+MAGIC = b'RTLOGIDX'
+VERSION = 1
+HEADER = struct.Struct('<8sI')
+ENTRY = struct.Struct('<qqq')
+
+
+def index_file_name(log_fn):
+    '''Get the name of the index file for a log file.'''
+    return log_fn + '.idx'
+
+
+###############################################################################
+## In-memory index
+
+class LogIndex(object):
+    '''Table of (index, timestamp, file offset) for the entries of a log.
+
+    Lookups by index and by timestamp are done by bisection. Timestamps are
+    stored as integer nanoseconds. Lookups by timestamp bisect the running
+    maximum of the timestamps, so they find the first entry at or after the
+    requested time even if the timestamps in the log are not in order.
+
+    '''
+    def __init__(self):
+        super(LogIndex, self).__init__()
+        self._inds = array.array('q')
+        self._ts = array.array('q')
+        self._max_ts = array.array('q')
+        self._offsets = array.array('q')
+
+    def __len__(self):
+        return len(self._inds)
+
+    def __str__(self):
+        return 'LogIndex of {0} entries'.format(len(self))
+
+    def append(self, index, ts_ns, offset):
+        '''Add an entry to the end of the index.'''
+        self._inds.append(index)
+        self._ts.append(ts_ns)
+        if self._max_ts and self._max_ts[-1] > ts_ns:
+            self._max_ts.append(self._max_ts[-1])
+        else:
+            self._max_ts.append(ts_ns)
+        self._offsets.append(offset)
+
+    def entry(self, pos):
+        '''Get the (index, timestamp, file offset) at a position.'''
+        return self._inds[pos], self._ts[pos], self._offsets[pos]
+
+    def find_index(self, index):
+        '''Find the position of an entry index.
+
+        Returns None if the index is after the last entry.
+
+        '''
+        pos = bisect.bisect_left(self._inds, index)
+        if pos == len(self._inds):
+            return None
+        return pos
+
+    def find_timestamp(self, ts_ns):
+        '''Find the position of the first entry at or after a time.
+
+        Returns None if all entries are before the time.
+
+        '''
+        pos = bisect.bisect_left(self._max_ts, ts_ns)
+        if pos == len(self._max_ts):
+            return None
+        return pos
+
+    def truncate(self, length):
+        '''Remove all entries from a position onwards.'''
+        del self._inds[length:]
+        del self._ts[length:]
+        del self._max_ts[length:]
+        del self._offsets[length:]
+
+    def offset(self, pos):
+        '''Get the file offset of the entry at a position.'''
+        return self._offsets[pos]
+
+    @property
+    def offsets(self):
+        '''The file offsets of all entries, in order.'''
+        return self._offsets
+
+    @property
+    def timestamps(self):
+        '''The timestamps of all entries in nanoseconds, in order.'''
+        return self._ts
+
+    def load(self, filename):
+        '''Load the index from an index file.
+
+        Raises ValueError if the file is not an index file. A truncated final
+        entry (for example from a recorder that did not finish writing it) is
+        ignored.
+
+        '''
+        with open(filename, 'rb') as f:
+            header = f.read(HEADER.size)
+            if len(header) != HEADER.size:
+                raise ValueError('Truncated index header')
+            magic, version = HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError('Not a log index file')
+            body = f.read()
+        body = body[:len(body) - (len(body) % ENTRY.size)]
+        values = array.array('q')
+        if hasattr(values, 'frombytes'):
+            values.frombytes(body)
+        else:
+            values.fromstring(body)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        self._inds = values[0::3]
+        self._ts = values[1::3]
+        self._offsets = values[2::3]
+        self._max_ts = array.array('q')
+        highest = None
+        for ts in self._ts:
+            if highest is None or ts > highest:
+                highest = ts
+            self._max_ts.append(highest)
+
+    def save(self, filename):
+        '''Write the whole index to an index file.'''
+        with IndexWriter(filename) as w:
+            for ii in range(len(self)):
+                w.append(*self.entry(ii))
+
+
+###############################################################################
+## Incremental index writer
+
+class IndexWriter(object):
+    '''Writes index entries to an index file as the log is written.
+
+    Nothing is kept in memory, so this is suitable for long recordings.
+
+    '''
+    def __init__(self, filename):
+        super(IndexWriter, self).__init__()
+        self._fn = filename
+        self._file = open(filename, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def append(self, index, ts_ns, offset):
+        '''Write an entry to the index file.'''
+        self._file.write(ENTRY.pack(index, ts_ns, offset))
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def flush(self):
+        self._file.flush()
+
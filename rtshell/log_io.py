@@ -0,0 +1,327 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+File access helpers for logs.
+
+'''
+
+
+import mmap
+import os
+import os.path
+import threading
+import time
+
+
+###############################################################################
+## Shared memory maps
+##
+## Every reader of the same file in a process shares one read-only map of it.
+## Readers in other processes map the same pages from the page cache.
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+class _SharedMap(object):
+    def __init__(self, key, filename):
+        super(_SharedMap, self).__init__()
+        self.key = key
+        self.users = 0
+        with open(filename, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+
+def _map_key(filename):
+    st = os.stat(filename)
+    return (os.path.realpath(filename), st.st_dev, st.st_ino, st.st_size,
+            st.st_mtime)
+
+
+def _acquire_map(filename):
+    key = _map_key(filename)
+    with _maps_lock:
+        m = _maps.get(key)
+        if m is None:
+            m = _SharedMap(key, filename)
+            _maps[key] = m
+        m.users += 1
+        return m
+
+
+def _release_map(m):
+    with _maps_lock:
+        m.users -= 1
+        if m.users == 0:
+            del _maps[m.key]
+            m.close()
+
+
+def shared_map_users(filename):
+    '''Get the number of open MappedFile objects sharing a file's map.'''
+    with _maps_lock:
+        m = _maps.get(_map_key(filename))
+        if m is None:
+            return 0
+        return m.users
+
+
+###############################################################################
+## Memory-mapped file object
+
+class MappedFile(object):
+    '''A read-only, file-like view of a memory-mapped file.
+
+    Each MappedFile has its own position, so several readers (in different
+    threads, for example) can each use one while sharing the same map.
+
+    '''
+    def __init__(self, filename):
+        super(MappedFile, self).__init__()
+        self._name = filename
+        self._map = _acquire_map(filename)
+        self._pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    @property
+    def closed(self):
+        return self._map is None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def size(self):
+        '''The size of the mapped file.'''
+        return len(self._map.map)
+
+    @property
+    def view(self):
+        '''A memoryview of the whole file.'''
+        return self._map.view
+
+    def close(self):
+        if self._map is not None:
+            _release_map(self._map)
+            self._map = None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = self.size
+        else:
+            end = min(self._pos + size, self.size)
+        data = self._map.view[self._pos:end].tobytes()
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        end = self._map.map.find(b'\n', self._pos)
+        if end == -1:
+            end = self.size
+        else:
+            end += 1
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        return self.read(end - self._pos)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        elif whence == os.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError('Invalid whence: {0}'.format(whence))
+        if self._pos < 0:
+            self._pos = 0
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+###############################################################################
+## Write buffering and durability
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Never sync the file; leave it to the operating system.
+FSYNC_NEVER = 'never'
+# Sync the file once, when it is closed.
+FSYNC_CLOSE = 'close'
+
+
+def parse_fsync_policy(policy):
+    '''Parse an fsync policy string.
+
+    The policy is one of 'never', 'close', a number of entries (e.g. '100'),
+    or a number of seconds followed by 's' (e.g. '0.5s').
+
+    Returns a tuple of (entries, seconds, on_close). Raises ValueError if the
+    policy is not valid.
+
+    '''
+    policy = str(policy).strip().lower()
+    if policy == FSYNC_NEVER:
+        return None, None, False
+    if policy == FSYNC_CLOSE:
+        return None, None, True
+    try:
+        if policy.endswith('s'):
+            seconds = float(policy[:-1])
+            if seconds <= 0:
+                raise ValueError
+            return None, seconds, True
+        entries = int(policy)
+        if entries <= 0:
+            raise ValueError
+        return entries, None, True
+    except ValueError:
+        raise ValueError('Invalid fsync policy: {0}'.format(policy))
+
+
+class WritePolicy(object):
+    '''Controls how a log file is buffered, flushed and synced when writing.
+
+    Entries are collected in a write buffer of @ref buffer_size bytes, so
+    the operating system sees a few large writes rather than one small
+    write per entry. The buffer is flushed when it is full, and also when an
+    entry is written @ref flush_interval or more seconds after the last flush
+    (if set).
+
+    Flushing only hands the data to the operating system. The fsync policy
+    decides when the file is also synced to the storage device: never, on
+    close, every N entries, or every T seconds. Syncing more often loses
+    less data if the machine fails, at the cost of throughput.
+
+    '''
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, flush_interval=None,
+            fsync=FSYNC_NEVER):
+        '''Constructor.
+
+        @param buffer_size The size of the write buffer in bytes.
+        @param flush_interval The longest time, in seconds, that an entry may
+                              wait in the write buffer. None to only flush
+                              when the buffer is full.
+        @param fsync The fsync policy. See @ref parse_fsync_policy.
+
+        '''
+        super(WritePolicy, self).__init__()
+        if buffer_size < 1:
+            raise ValueError('Buffer size must be at least 1 byte')
+        if flush_interval is not None and flush_interval <= 0:
+            flush_interval = None
+        self._buf_size = buffer_size
+        self._flush_int = flush_interval
+        self._fsync = fsync
+        self._sync_entries, self._sync_int, self._sync_close = \
+                parse_fsync_policy(fsync)
+        self._pending = 0
+        self._last_flush = time.time()
+        self._last_sync = self._last_flush
+        self._flushes = 0
+        self._syncs = 0
+
+    def __str__(self):
+        return 'WritePolicy(buffer {0} bytes, flush interval {1}, fsync ' \
+                '{2})'.format(self._buf_size, self._flush_int, self._fsync)
+
+    @property
+    def buffer_size(self):
+        '''The size of the write buffer in bytes.'''
+        return self._buf_size
+
+    @property
+    def flush_interval(self):
+        '''The longest time an entry may wait in the write buffer.'''
+        return self._flush_int
+
+    @property
+    def flushes(self):
+        '''The number of flushes made by the policy.'''
+        return self._flushes
+
+    @property
+    def fsync(self):
+        '''The fsync policy.'''
+        return self._fsync
+
+    @property
+    def syncs(self):
+        '''The number of times the file has been synced.'''
+        return self._syncs
+
+    def open(self, filename, mode='wb'):
+        '''Open a file with the policy's write buffer size.'''
+        self._pending = 0
+        self._last_flush = self._last_sync = time.time()
+        return open(filename, mode, self._buf_size)
+
+    def entry_written(self, f):
+        '''Apply the policy after an entry has been written to a file.'''
+        self._pending += 1
+        if self._sync_entries is None and self._sync_int is None and \
+                self._flush_int is None:
+            return
+        now = time.time()
+        if self._sync_entries is not None and \
+                self._pending >= self._sync_entries:
+            self.sync(f, now)
+        elif self._sync_int is not None and \
+                now - self._last_sync >= self._sync_int:
+            self.sync(f, now)
+        elif self._flush_int is not None and \
+                now - self._last_flush >= self._flush_int:
+            self.flush(f, now)
+
+    def closing(self, f):
+        '''Apply the policy to a file that is about to be closed.'''
+        if self._sync_close:
+            self.sync(f)
+        else:
+            self.flush(f)
+
+    def flush(self, f, now=None):
+        '''Flush the write buffer of a file to the operating system.'''
+        f.flush()
+        self._flushes += 1
+        self._last_flush = now if now is not None else time.time()
+
+    def sync(self, f, now=None):
+        '''Flush a file and sync it to the storage device.'''
+        self.flush(f, now)
+        os.fsync(f.fileno())
+        self._syncs += 1
+        self._pending = 0
+        self._last_sync = self._last_flush
@@ -0,0 +1,109 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Merging of logs.
+
+'''
+
+
+import copy
+import heapq
+
+from rtshell import ilog
+
+
+def is_rtlog_metadata(meta):
+    '''Check if log metadata is in the form written by rtlog:
+    (start time, [port specification, ...]).'''
+    return type(meta) in (list, tuple) and len(meta) == 2 and \
+            type(meta[1]) in (list, tuple) and \
+            all([hasattr(p, 'name') for p in meta[1]])
+
+
+def merge_metadata(metas):
+    '''Combine the metadata of several logs written by rtlog.
+
+    The start time of the result is the earliest start time. The port
+    specifications of all logs are included. A channel whose name is already
+    used by an earlier log is renamed by adding a number to its name, e.g.
+    'laser' becomes 'laser_2'.
+
+    @param metas A list of (start time, port specifications) tuples.
+    @return A tuple of (metadata, renames), where renames is a list holding
+            a dictionary of {old name: new name} for each log.
+
+    '''
+    start = min([m[0] for m in metas])
+    specs = []
+    used = set()
+    renames = []
+    for m in metas:
+        names = {}
+        for p in m[1]:
+            name = p.name
+            if name in used:
+                n = 2
+                while '{0}_{1}'.format(p.name, n) in used:
+                    n += 1
+                name = '{0}_{1}'.format(p.name, n)
+                names[p.name] = name
+                p = copy.copy(p)
+                p.name = name
+            used.add(name)
+            specs.append(p)
+        renames.append(names)
+    return (start, specs), renames
+
+
+def merge(inputs, output, renames=None):
+    '''Merge the entries of several logs into one log in time order.
+
+    The logs are read one entry at a time, and the entry with the earliest
+    timestamp is written next, so memory use does not depend on the size of
+    the logs. Entries with equal timestamps are written in the order of the
+    input logs. Each input log should be in time order.
+
+    @param inputs A list of logs, open for reading.
+    @param output The log to write to, open for writing.
+    @param renames A list holding a dictionary of {old name: new name} for
+                   the channels of each input log, as returned by
+                   @ref merge_metadata. None to keep the channel names.
+    @return The number of entries written.
+
+    '''
+    heap = []
+    for ii, log in enumerate(inputs):
+        _push(heap, log, ii)
+    count = 0
+    while heap:
+        ts_ns, ii, ts, data = heapq.heappop(heap)
+        if renames and renames[ii] and type(data) == tuple and \
+                len(data) == 2 and data[0] in renames[ii]:
+            data = (renames[ii][data[0]], data[1])
+        output.write(ts, data)
+        count += 1
+        _push(heap, inputs[ii], ii)
+    return count
+
+
+def _push(heap, log, ii):
+    '''Push the next entry of a log onto the merge heap.'''
+    entry = log.read()
+    if entry:
+        index, ts, data = entry[0]
+        # The log number breaks ties, so the data is never compared
+        heapq.heappush(heap, (ilog.ts_to_ns(ts), ii, ts, data))
+
@@ -0,0 +1,372 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Statistics of the channels of logs.
+
+'''
+
+
+import heapq
+import math
+import pickle
+
+from rtshell import framed_log
+from rtshell import ilog
+from rtshell import parallel_scan
+
+
+###############################################################################
+## Channel statistics
+##
+## The statistics are gathered in one pass over the log, using memory that
+## does not depend on the length of the log. The intervals between the
+## entries of a channel are counted in a histogram of logarithmically-spaced
+## bins, so their percentiles are accurate to about 1%. Statistics gathered
+## from consecutive ranges of a log can be merged, so the log can be scanned
+## in parallel (see parallel_scan).
+##
+## The payload size of an entry is the size of its data when pickled. For
+## framed logs, it is the stored size of the record, which is found without
+## decoding the data.
+
+# Histogram bins per factor of ten
+BINS_PER_DECADE = 100
+# The number of largest gaps to keep
+GAPS = 3
+
+
+class ChannelStats(object):
+    '''Statistics of the entries of one channel.'''
+    def __init__(self, name):
+        super(ChannelStats, self).__init__()
+        self.name = name
+        self.count = 0
+        self.bytes = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.min_ts = None
+        self.max_ts = None
+        self.min_interval = None
+        self.max_interval = None
+        self.regressions = 0
+        self.max_regression = 0
+        self._intervals = 0
+        self._sum = 0
+        self._sum_sq = 0
+        self._hist = {}
+        self._gaps = []
+
+    def __str__(self):
+        return '{0}: {1} entries, {2} bytes'.format(self.name, self.count,
+                self.bytes)
+
+    @property
+    def gaps(self):
+        '''The largest intervals, as [(interval, timestamp before the gap),
+        ...] in nanoseconds, largest first.'''
+        return sorted(self._gaps, reverse=True)
+
+    @property
+    def mean_bytes(self):
+        '''The mean payload size.'''
+        if not self.count:
+            return 0
+        return self.bytes / float(self.count)
+
+    @property
+    def mean_interval(self):
+        '''The mean interval between entries, in nanoseconds.'''
+        if not self._intervals:
+            return None
+        return self._sum / float(self._intervals)
+
+    @property
+    def mean_rate(self):
+        '''The number of entries per second, over the time they cover.'''
+        if self.count < 2 or self.max_ts == self.min_ts:
+            return None
+        return (self.count - 1) * 1e9 / (self.max_ts - self.min_ts)
+
+    @property
+    def std_interval(self):
+        '''The standard deviation of the intervals, in nanoseconds.'''
+        if not self._intervals:
+            return None
+        mean = self._sum / float(self._intervals)
+        return math.sqrt(max(self._sum_sq / float(self._intervals) -
+            mean * mean, 0))
+
+    def add(self, ts_ns, size):
+        '''Add an entry.
+
+        @param ts_ns The timestamp of the entry in nanoseconds.
+        @param size The payload size of the entry.
+
+        '''
+        if self.last_ts is not None:
+            self._add_interval(self.last_ts, ts_ns)
+        else:
+            self.first_ts = ts_ns
+        self.last_ts = ts_ns
+        if self.min_ts is None or ts_ns < self.min_ts:
+            self.min_ts = ts_ns
+        if self.max_ts is None or ts_ns > self.max_ts:
+            self.max_ts = ts_ns
+        self.count += 1
+        self.bytes += size
+
+    def merge(self, other):
+        '''Add the statistics of the entries following these ones.'''
+        if not other.count:
+            return
+        if not self.count:
+            self.__dict__.update(other.__dict__)
+            self._hist = dict(other._hist)
+            self._gaps = list(other._gaps)
+            return
+        # The interval between the two sets of entries
+        self._add_interval(self.last_ts, other.first_ts)
+        self.last_ts = other.last_ts
+        self.min_ts = min(self.min_ts, other.min_ts)
+        self.max_ts = max(self.max_ts, other.max_ts)
+        if other.min_interval is not None:
+            self.min_interval = min(self.min_interval, other.min_interval)
+            self.max_interval = max(self.max_interval, other.max_interval)
+        self.count += other.count
+        self.bytes += other.bytes
+        self.regressions += other.regressions
+        self.max_regression = max(self.max_regression, other.max_regression)
+        self._intervals += other._intervals
+        self._sum += other._sum
+        self._sum_sq += other._sum_sq
+        for b, n in other._hist.items():
+            self._hist[b] = self._hist.get(b, 0) + n
+        for g in other._gaps:
+            self._add_gap(g)
+
+    def percentile(self, p):
+        '''Get a percentile of the intervals, in nanoseconds.
+
+        @param p The percentile, from 0 to 100.
+
+        '''
+        if not self._intervals:
+            return None
+        return _percentile(self._hist, self._intervals, p, self.min_interval,
+                self.max_interval)
+
+    def _add_gap(self, gap):
+        if len(self._gaps) < GAPS:
+            heapq.heappush(self._gaps, gap)
+        elif gap > self._gaps[0]:
+            heapq.heapreplace(self._gaps, gap)
+
+    def _add_interval(self, before, after):
+        interval = after - before
+        if interval < 0:
+            self.regressions += 1
+            self.max_regression = max(self.max_regression, -interval)
+            return
+        if self.min_interval is None or interval < self.min_interval:
+            self.min_interval = interval
+        if self.max_interval is None or interval > self.max_interval:
+            self.max_interval = interval
+        self._intervals += 1
+        self._sum += interval
+        self._sum_sq += interval * interval
+        b = _bin(interval)
+        self._hist[b] = self._hist.get(b, 0) + 1
+        self._add_gap((interval, before))
+
+
+class LogStats(object):
+    '''Statistics of the channels of a log.'''
+    def __init__(self):
+        super(LogStats, self).__init__()
+        self.channels = {}
+        self.count = 0
+        self.regressions = 0
+        self._first_ts = None
+        self._last_ts = None
+
+    def add(self, name, ts_ns, size):
+        '''Add an entry of a channel.'''
+        if name not in self.channels:
+            self.channels[name] = ChannelStats(name)
+        self.channels[name].add(ts_ns, size)
+        if self._last_ts is not None and ts_ns < self._last_ts:
+            self.regressions += 1
+        if self._first_ts is None:
+            self._first_ts = ts_ns
+        self._last_ts = ts_ns
+        self.count += 1
+
+    def merge(self, other):
+        '''Add the statistics of the entries following these ones.'''
+        if self._last_ts is not None and other.count and \
+                other._first_ts < self._last_ts:
+            self.regressions += 1
+        for name, c in other.channels.items():
+            if name not in self.channels:
+                self.channels[name] = ChannelStats(name)
+            self.channels[name].merge(c)
+        self.regressions += other.regressions
+        self.count += other.count
+        if self._first_ts is None:
+            self._first_ts = other._first_ts
+        if other._last_ts is not None:
+            self._last_ts = other._last_ts
+
+
+###############################################################################
+## Lateness statistics
+##
+## How late events were compared with when they were due, counted in the same
+## kind of histogram as the channel intervals.
+
+class Lateness(object):
+    '''Statistics of how late events happened, such as entries published
+    during playback.
+
+    Events that happened early count as on time.
+
+    '''
+    def __init__(self):
+        super(Lateness, self).__init__()
+        self.count = 0
+        self.max = None
+        self.min = None
+        self._sum = 0
+        self._hist = {}
+
+    def __str__(self):
+        if not self.count:
+            return 'No events'
+        return 'mean {0:.3f} ms, p99 {1:.3f} ms, max {2:.3f} ms'.format(
+                self.mean / 1e6, self.percentile(99) / 1e6, self.max / 1e6)
+
+    @property
+    def mean(self):
+        '''The mean lateness, in nanoseconds.'''
+        if not self.count:
+            return None
+        return self._sum / float(self.count)
+
+    def add(self, late):
+        '''Add an event.
+
+        @param late How late the event was, in nanoseconds.
+
+        '''
+        late = max(late, 0)
+        if self.max is None or late > self.max:
+            self.max = late
+        if self.min is None or late < self.min:
+            self.min = late
+        self.count += 1
+        self._sum += late
+        b = _bin(late)
+        self._hist[b] = self._hist.get(b, 0) + 1
+
+    def percentile(self, p):
+        '''Get a percentile of the lateness, in nanoseconds.
+
+        @param p The percentile, from 0 to 100.
+
+        '''
+        if not self.count:
+            return None
+        return _percentile(self._hist, self.count, p, self.min, self.max)
+
+
+def _bin(value):
+    '''Get the histogram bin of a value.'''
+    if value <= 0:
+        return -1
+    return int(math.floor(math.log10(value) * BINS_PER_DECADE))
+
+
+def _percentile(hist, count, p, low, high):
+    '''Find a percentile from a histogram of values between low and high.'''
+    target = count * p / 100.0
+    seen = 0
+    for b in sorted(hist.keys()):
+        seen += hist[b]
+        if seen >= target:
+            if b < 0:
+                return 0
+            # The middle of the bin, clamped to the known range
+            value = 10 ** ((b + 0.5) / BINS_PER_DECADE)
+            return min(max(value, low), high)
+    return high
+
+
+def gather(log, first=None, last=None):
+    '''Gather the statistics of a range of entries of a log.
+
+    @param log The log, open for reading.
+    @param first The index of the first entry. None to start from the
+                 current position.
+    @param last The index of the last entry. None to read to the end.
+    @return A LogStats object.
+
+    '''
+    stats = LogStats()
+    if first is not None:
+        log.seek(index=first)
+    if isinstance(log, framed_log.FramedLog):
+        chans = log.channels
+        for rec in log.read_headers():
+            if last is not None and rec.index > last:
+                break
+            if rec.channel != framed_log.UNNAMED_CHANNEL and \
+                    rec.channel not in chans:
+                # Channel definitions are found as the headers are read
+                chans = log.channels
+            stats.add(chans.get(rec.channel, 'data'), rec.ts, rec.length)
+        return stats
+    while True:
+        e = log.read()
+        if not e or (last is not None and e[0][0] > last):
+            break
+        index, ts, data = e[0]
+        if type(data) == tuple and len(data) == 2 and \
+                isinstance(data[0], str):
+            name, value = data
+        else:
+            name, value = 'data', data
+        stats.add(name, ilog.ts_to_ns(ts), len(pickle.dumps(value,
+            pickle.HIGHEST_PROTOCOL)))
+    return stats
+
+
+def gather_parallel(l_type, filename, jobs=0, log_opts={}, verbose=False):
+    '''Gather the statistics of a log using a pool of worker processes.
+
+    @param l_type The type of the log.
+    @param filename The name of the log file.
+    @param jobs The number of worker processes. 0 uses one per CPU.
+    @param log_opts Extra options to give when opening the log.
+    @param verbose Print verbose output to stderr.
+    @return A LogStats object.
+
+    '''
+    stats = LogStats()
+    for s in parallel_scan.scan(l_type, filename, gather, jobs=jobs,
+            log_opts=log_opts, verbose=verbose):
+        stats.merge(s)
+    return stats
+
@@ -0,0 +1,181 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+In-memory looping reader for logs.
+
+'''
+
+
+import array
+import pickle
+
+from rtshell import ilog
+
+
+###############################################################################
+## Looping log reader
+##
+## The entries are held in memory as their timestamps in nanoseconds and their
+## data pickled. The data is unpickled each time an entry is read, so every
+## loop gets new objects that can be changed without affecting later loops.
+##
+## Each loop follows the one before it without a gap: the time of an entry in
+## loop n is its time in the log plus n times the length of a loop, which is
+## the time from the first entry to the last plus the mean interval between
+## entries.
+
+class LoopLog(ilog.Log):
+    '''Plays a range of another log repeatedly from memory.
+
+    The entries from the current position of the wrapped log are loaded when
+    this object is opened, and the wrapped log is closed. Reading then goes
+    through the entries the given number of times, with the timestamps and
+    indices of each loop continuing from the one before.
+
+    '''
+    def __init__(self, log, loops=1, end=None, count=-1, verbose=False,
+            *args, **kwargs):
+        '''Constructor.
+
+        @param log The log to load the entries from. It must be open for
+                   reading, at the first entry to play.
+        @param loops The number of times to play the entries. 0 to play them
+                     forever.
+        @param end The time of the last entry to load. None to load to the
+                   end of the log.
+        @param count The maximum number of entries to load. -1 for no limit.
+        @param verbose Print verbose output to stderr.
+
+        '''
+        self._is_open = False
+        if loops < 0:
+            raise ValueError('Loop count must not be negative')
+        self._log = log
+        self._loops = loops
+        self._end_ts = end
+        self._count = count
+        super(LoopLog, self).__init__(mode='r', meta=log.metadata,
+                verbose=verbose, *args, **kwargs)
+
+    def __str__(self):
+        return 'LoopLog of {0} entries, playing {1} times'.format(
+                len(self._data), self._loops or 'infinite')
+
+    @property
+    def loop(self):
+        '''The number of the loop being played, starting from 0.'''
+        return self._loop
+
+    @property
+    def loops(self):
+        '''The number of times the entries are played. 0 for forever.'''
+        return self._loops
+
+    @property
+    def period(self):
+        '''The length of a loop in nanoseconds.'''
+        return self._period
+
+    def read(self, timestamp=None, number=None):
+        if number is not None:
+            if number < 0:
+                raise ValueError
+        elif timestamp is None:
+            number = 1
+        else:
+            if timestamp < 0:
+                raise ValueError
+            limit = ilog.ts_to_ns(timestamp)
+        res = []
+        while not self._eof() and (number is None or len(res) < number):
+            ts = self._ts[self._next] + self._loop * self._period
+            if number is None and ts > limit:
+                break
+            res.append((self._first_ind + self._loop * len(self._data) +
+                self._next, self._ns_to_ts(ts),
+                pickle.loads(self._data[self._next])))
+            self._next += 1
+            if self._next == len(self._data):
+                self._next = 0
+                self._loop += 1
+        return res
+
+    def rewind(self):
+        self._next = 0
+        self._loop = 0
+
+    def _close(self):
+        self._is_open = False
+
+    def _eof(self):
+        return not self._data or (self._loops and self._loop >= self._loops)
+
+    def _get_cur_pos(self):
+        if self._eof():
+            return self._get_end()[0] + 1, self._get_end()[1]
+        return self._first_ind + self._loop * len(self._data) + self._next, \
+                self._ns_to_ts(self._ts[self._next] +
+                        self._loop * self._period)
+
+    def _get_start(self):
+        if not self._data:
+            return self._first_ind, None
+        return self._first_ind, self._ns_to_ts(self._ts[0])
+
+    def _get_end(self):
+        '''The last entry of the last loop, or of the first loop if playing
+        forever.'''
+        if not self._data:
+            return self._first_ind - 1, None
+        last = max(self._loops, 1) - 1
+        return self._first_ind + (last + 1) * len(self._data) - 1, \
+                self._ns_to_ts(self._ts[-1] + last * self._period)
+
+    def _ns_to_ts(self, ns):
+        return ilog.EntryTS(ns=ns)
+
+    def _open(self):
+        self._ts = array.array('q')
+        self._data = []
+        self._first_ind = self._log.pos[0]
+        end = None
+        if self._end_ts is not None:
+            end = ilog.ts_to_ns(self._end_ts)
+        while self._count < 0 or len(self._data) < self._count:
+            entries = self._log.read()
+            if not entries:
+                break
+            index, ts, data = entries[0]
+            ts = ilog.ts_to_ns(ts)
+            if end is not None and ts > end:
+                break
+            self._ts.append(ts)
+            self._data.append(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        if len(self._ts) > 1:
+            span = self._ts[-1] - self._ts[0]
+            self._period = span + span // (len(self._ts) - 1)
+        else:
+            # A single entry has no interval, so play it once a second
+            self._period = 1000000000
+        self._log.close()
+        self._next = 0
+        self._loop = 0
+        self._is_open = True
+        self._vb_print('Loaded {0} entries ({1} bytes) to play {2} times; '
+                'loop length {3} ns.'.format(len(self._data),
+                    sum([len(d) for d in self._data]),
+                    self._loops or 'infinite', self._period))
+
@@ -0,0 +1,160 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Parallel scanning of logs over a pool of processes.
+
+'''
+
+
+from __future__ import print_function
+
+import collections
+import multiprocessing
+import sys
+
+
+###############################################################################
+## Parallel scans
+##
+## A scan applies a function to every entry of a log. The log is split into
+## ranges of entries, and each range is read by a worker process that opens
+## the log itself and seeks to the start of its range using the log's index
+## (the entry index of SimplePickle and framed logs, the chunk index of
+## chunked logs or the manifest of segmented logs). Only the entries of the
+## ranges being processed are held in memory at any time: no more than two
+## ranges per worker are given out ahead of the range whose result is being
+## returned. The results of the ranges are returned in index order.
+##
+## The scan function is given the open log and the first and last entry
+## indices of its range, and returns a picklable result. It must be a
+## module-level function so that it can be sent to the workers. The data
+## type modules needed to decode the log should be loaded before the scan is
+## started, as the workers are forked from the current process.
+
+# The number of ranges to make per worker. More ranges balance the load
+# better when some parts of the log are slower to decode than others.
+RANGES_PER_WORKER = 4
+# The smallest range worth giving to a worker.
+MIN_RANGE_SIZE = 100
+# The largest range to give to a worker, to limit the size of its result.
+MAX_RANGE_SIZE = 10000
+
+
+def worker_count(jobs):
+    '''Get the number of workers to use. 0 or less means one per CPU.'''
+    if jobs < 1:
+        try:
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+    return jobs
+
+
+def split(first, last, ranges, min_size=MIN_RANGE_SIZE,
+        max_size=MAX_RANGE_SIZE):
+    '''Split a range of entry indices into smaller ranges.
+
+    @param first The index of the first entry.
+    @param last The index of the last entry.
+    @param ranges The number of ranges to make. More are made if needed to
+                  keep them within the maximum size.
+    @param min_size The smallest number of entries in a range.
+    @param max_size The largest number of entries in a range.
+    @return A list of (first, last) tuples, in order.
+
+    '''
+    count = last - first + 1
+    if count < 1:
+        return []
+    ranges = max(ranges, (count + max_size - 1) // max_size)
+    ranges = max(1, min(ranges, count // max(min_size, 1)))
+    result = []
+    for ii in range(ranges):
+        start = first + count * ii // ranges
+        end = first + count * (ii + 1) // ranges - 1
+        result.append((start, end))
+    return result
+
+
+def entries(log, first, last):
+    '''Read the entries of a range of indices from a log.
+
+    @param log The log, open for reading.
+    @param first The index of the first entry.
+    @param last The index of the last entry.
+    @return A generator of (index, timestamp, data) tuples.
+
+    '''
+    log.seek(index=first)
+    while True:
+        e = log.read()
+        if not e or e[0][0] > last:
+            return
+        yield e[0]
+
+
+def scan(l_type, filename, func, jobs=1, log_opts={}, verbose=False):
+    '''Apply a function to ranges of a log in parallel.
+
+    @param l_type The type of the log, e.g. simpkl_log.SimplePickleLog.
+    @param filename The name of the log file.
+    @param func The function to apply to each range. It is called as
+                func(log, first, last).
+    @param jobs The number of worker processes. 1 scans the log in this
+                process. 0 uses one worker per CPU.
+    @param log_opts Extra options to give when opening the log.
+    @param verbose Print verbose output to stderr.
+    @return A generator of the results of each range, in index order.
+
+    '''
+    jobs = worker_count(jobs)
+    with l_type(filename=filename, mode='r', verbose=verbose,
+            **log_opts) as log:
+        ranges = split(log.start[0], log.end[0], jobs * RANGES_PER_WORKER)
+        if jobs == 1 or len(ranges) < 2:
+            if verbose:
+                print('Scanning {0} in {1} ranges in one process'.format(
+                    filename, len(ranges)), file=sys.stderr)
+            for first, last in ranges:
+                yield func(log, first, last)
+            return
+    if verbose:
+        print('Scanning {0} in {1} ranges with {2} workers'.format(filename,
+            len(ranges), jobs), file=sys.stderr)
+    tasks = collections.deque([(l_type, filename, log_opts, func, f, l)
+        for f, l in ranges])
+    pool = multiprocessing.Pool(min(jobs, len(ranges)))
+    pending = collections.deque()
+    try:
+        while tasks or pending:
+            while tasks and len(pending) < jobs * 2:
+                pending.append(pool.apply_async(_scan_range,
+                    (tasks.popleft(),)))
+            yield pending.popleft().get()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _scan_range(task):
+    '''Open a log and apply the scan function to a range of it.'''
+    l_type, filename, log_opts, func, first, last = task
+    with l_type(filename=filename, mode='r', **log_opts) as log:
+        return func(log, first, last)
+
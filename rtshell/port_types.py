@@ -68,6 +68,10 @@ class PortSpec(object):
         '''The name of the port.'''
         return self._name
 
+    @name.setter
+    def name(self, name):
+        self._name = name
+
     @property
     def output(self):
         '''If the port is an output port or not.'''
@@ -0,0 +1,290 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Decode-ahead reader for logs.
+
+'''
+
+
+import collections
+import pickle
+import threading
+import time
+
+from rtshell import ilog
+
+
+DEFAULT_BUFFER_SIZE = 100
+
+
+###############################################################################
+## Prefetching log reader
+
+class PrefetchLog(ilog.Log):
+    '''Reads entries from another log ahead of time in a background thread.
+
+    A reader thread reads and decodes the entries following the current
+    position of the wrapped log into a bounded buffer, so calls to @ref read
+    usually only take an entry that is already decoded. The buffer is full
+    when it holds the maximum number of entries, or when the entries in it
+    total the maximum number of bytes. The size of an entry is the size of
+    its data when pickled, which costs the reader thread an extra pickling of
+    each entry, so it is only measured when a byte limit is given.
+
+    When an entry is wanted but the buffer is empty, the caller waits for the
+    reader thread. Each wait is counted as an underrun; if there are many, the
+    buffer is too small or the storage is too slow.
+
+    In reverse mode, the entries before the current position are read, and
+    are taken with @ref read_reverse rather than @ref read.
+
+    The buffer is filled before the constructor returns. Only reading is
+    supported; the wrapped log should not be used directly while this object
+    is open.
+
+    '''
+    def __init__(self, log, buffer_size=DEFAULT_BUFFER_SIZE, buffer_bytes=0,
+            reverse=False, verbose=False, *args, **kwargs):
+        '''Constructor.
+
+        @param log The log to read from. It must be open for reading.
+        @param buffer_size The maximum number of entries in the buffer. 0 for
+                           no limit.
+        @param buffer_bytes The maximum total size of the entries in the
+                            buffer. 0 for no limit.
+        @param reverse Read the log backwards.
+        @param verbose Print verbose output to stderr.
+
+        '''
+        self._is_open = False
+        if buffer_size < 0 or buffer_bytes < 0:
+            raise ValueError('Buffer limits must not be negative')
+        if not buffer_size and not buffer_bytes:
+            raise ValueError('Buffer needs a size or a byte limit')
+        self._log = log
+        self._max_entries = buffer_size
+        self._max_bytes = buffer_bytes
+        self._reverse = reverse
+        # The reader thread must be the only user of the wrapped log, so the
+        # positions that do not change are found now
+        self._start = log.start
+        self._end = log.end
+        self._decoded = 0
+        self._taken = 0
+        self._underruns = 0
+        self._wait_time = 0.0
+        super(PrefetchLog, self).__init__(mode='r', meta=log.metadata,
+                verbose=verbose, *args, **kwargs)
+
+    def __str__(self):
+        return 'PrefetchLog reading from {0}'.format(self._log)
+
+    @property
+    def buffer_bytes(self):
+        '''The maximum total size of the entries in the buffer.'''
+        return self._max_bytes
+
+    @property
+    def buffer_size(self):
+        '''The maximum number of entries in the buffer.'''
+        return self._max_entries
+
+    @property
+    def decoded(self):
+        '''The number of entries read from the wrapped log.'''
+        return self._decoded
+
+    @property
+    def log(self):
+        '''The log being read from.'''
+        return self._log
+
+    @property
+    def reverse(self):
+        '''True if the log is being read backwards.'''
+        return self._reverse
+
+    @property
+    def taken(self):
+        '''The number of entries taken from the buffer.'''
+        return self._taken
+
+    @property
+    def underruns(self):
+        '''The number of times an entry was wanted and the buffer was
+        empty.'''
+        return self._underruns
+
+    @property
+    def wait_time(self):
+        '''The total time in seconds spent waiting for entries.'''
+        return self._wait_time
+
+    def read(self, timestamp=None, number=None):
+        if self._reverse:
+            raise ValueError('Log is being read in reverse')
+        return self._take(timestamp, number)
+
+    def read_reverse(self, number=1):
+        if not self._reverse:
+            raise ValueError('Log is not being read in reverse')
+        return self._take(None, number)
+
+    def _check_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _close(self):
+        if not self._is_open:
+            return
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._is_open = False
+        self._log.close()
+        self._vb_print('Closed prefetching reader. {0} entries decoded, {1} '
+                'taken; {2} underruns, {3:.3f} s waiting.'.format(
+                    self._decoded, self._taken, self._underruns,
+                    self._wait_time))
+
+    def _entry_size(self, entry):
+        if not self._max_bytes:
+            return 0
+        return len(pickle.dumps(entry[2], pickle.HIGHEST_PROTOCOL))
+
+    def _eof(self):
+        with self._cond:
+            self._wait_for_entry()
+            return not self._buffer
+
+    def _full(self):
+        if self._max_entries > 0 and len(self._buffer) >= self._max_entries:
+            return True
+        return self._max_bytes > 0 and len(self._buffer) > 0 and \
+                self._bytes >= self._max_bytes
+
+    def _get_cur_pos(self):
+        with self._cond:
+            self._wait_for_entry()
+            if self._buffer:
+                entry = self._buffer[0][0]
+                return entry[0], entry[1]
+        # The reader thread has finished with the wrapped log
+        return self._log.pos
+
+    def _get_start(self):
+        return self._start
+
+    def _get_end(self):
+        return self._end
+
+    def _open(self):
+        self._buffer = collections.deque()
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._done = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run,
+                name='rtlog-prefetch')
+        self._thread.daemon = True
+        self._thread.start()
+        self._is_open = True
+        # Fill the buffer before playing starts
+        with self._cond:
+            while not self._full() and not self._done:
+                self._cond.wait()
+        self._vb_print('Started prefetching reader with buffer size {0}, '
+                'byte limit {1}; {2} entries decoded.'.format(
+                    self._max_entries, self._max_bytes, len(self._buffer)))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._full() and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+            try:
+                if self._reverse:
+                    entries = self._log.read_reverse()
+                else:
+                    entries = self._log.read()
+                size = 0
+                if entries:
+                    size = self._entry_size(entries[0])
+            except Exception as e:
+                with self._cond:
+                    self._error = e
+                    self._done = True
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                if not entries:
+                    self._done = True
+                    self._cond.notify_all()
+                    return
+                self._buffer.append((entries[0], size))
+                self._bytes += size
+                self._decoded += 1
+                self._cond.notify_all()
+
+    def _take(self, timestamp, number):
+        '''Take entries from the buffer.
+
+        With neither a time limit nor a number, one entry is taken.
+
+        '''
+        if number is not None and number < 0:
+            raise ValueError
+        if timestamp is not None:
+            if timestamp < 0:
+                raise ValueError
+            # Compare the entries' timestamps as integers
+            timestamp = ilog.EntryTS(ns=ilog.ts_to_ns(timestamp))
+        elif number is None:
+            number = 1
+        res = []
+        with self._cond:
+            while number is None or len(res) < number:
+                self._wait_for_entry()
+                if not self._buffer:
+                    break
+                entry, size = self._buffer[0]
+                if timestamp is not None and entry[1] > timestamp:
+                    break
+                self._buffer.popleft()
+                self._bytes -= size
+                self._taken += 1
+                res.append(entry)
+                self._cond.notify_all()
+        return res
+
+    def _wait_for_entry(self):
+        '''Wait until there is an entry in the buffer or the reader thread
+        has finished. Must be called with the lock held.'''
+        if not self._buffer and not self._done:
+            self._underruns += 1
+            start = time.time()
+            while not self._buffer and not self._done:
+                self._cond.wait()
+            self._wait_time += time.time() - start
+        if not self._buffer:
+            self._check_error()
+
@@ -0,0 +1,260 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Per-channel recording policies.
+
+'''
+
+
+from rtshell import ilog
+
+
+###############################################################################
+## Recording policies
+##
+## A policy is given as the channel name, a colon, and a comma-separated list
+## of rules:
+##
+##   every=K   Keep every K-th sample, starting with the first.
+##   rate=HZ   Keep at most HZ samples per second of sample time.
+##   changed   Keep a sample only if its data differs from the last sample
+##             kept. The time stamp of the data is not compared.
+##
+## When there are several rules, a sample is kept only if all of them keep it.
+## For example, "laser:every=3" keeps every third laser scan, and
+## "pose:changed,rate=10" keeps at most ten changed poses per second.
+
+EVERY = 'every'
+RATE = 'rate'
+CHANGED = 'changed'
+
+
+class ChannelPolicy(object):
+    '''Decides which samples of a channel are recorded.
+
+    A policy looks only at the time and the data of each sample, so it can be
+    applied before anything is written to the log.
+
+    '''
+    def __init__(self, every=1, rate=0.0, changed=False):
+        '''Constructor.
+
+        @param every Keep every this-many-th sample.
+        @param rate The maximum number of samples to keep per second. 0 for no
+                    limit.
+        @param changed Only keep samples whose data has changed.
+
+        '''
+        super(ChannelPolicy, self).__init__()
+        if every < 1:
+            raise ValueError('Sample interval must be at least 1')
+        if rate < 0:
+            raise ValueError('Rate must not be negative')
+        self._every = every
+        self._rate = rate
+        if rate > 0:
+            self._interval = int(1000000000 / rate)
+        else:
+            self._interval = 0
+        self._changed = changed
+        self._seen = 0
+        self._kept = 0
+        self._last_ns = None
+        self._last_data = None
+
+    def __str__(self):
+        rules = []
+        if self._every > 1:
+            rules.append('{0}={1}'.format(EVERY, self._every))
+        if self._rate > 0:
+            rules.append('{0}={1}'.format(RATE, self._rate))
+        if self._changed:
+            rules.append(CHANGED)
+        return ','.join(rules) or 'all'
+
+    @property
+    def changed(self):
+        '''True if only changed samples are kept.'''
+        return self._changed
+
+    @property
+    def every(self):
+        '''The interval between kept samples, in samples.'''
+        return self._every
+
+    @property
+    def kept(self):
+        '''The number of samples kept.'''
+        return self._kept
+
+    @property
+    def rate(self):
+        '''The maximum number of samples kept per second.'''
+        return self._rate
+
+    @property
+    def seen(self):
+        '''The number of samples given to the policy.'''
+        return self._seen
+
+    @property
+    def skipped(self):
+        '''The number of samples not kept.'''
+        return self._seen - self._kept
+
+    def keep(self, ts, data):
+        '''Decide if a sample should be recorded.
+
+        @param ts The time of the sample.
+        @param data The data of the sample.
+        @return True if the sample should be recorded.
+
+        '''
+        self._seen += 1
+        if (self._seen - 1) % self._every:
+            return False
+        if self._interval:
+            ns = ilog.ts_to_ns(ts)
+            # A sample from before the last one kept means the source's clock
+            # has gone backwards, so start again from it
+            if self._last_ns is not None and \
+                    0 <= ns - self._last_ns < self._interval:
+                return False
+        if self._changed and self._last_data is not None and \
+                same_data(data, self._last_data):
+            return False
+        if self._interval:
+            self._last_ns = ns
+        if self._changed:
+            self._last_data = data
+        self._kept += 1
+        return True
+
+
+def changed_members(a, b):
+    '''Find the members of a structure that differ from another's.
+
+    @param a The structure to compare.
+    @param b The structure to compare it to.
+    @return A list of the names of the members of a that differ from b, or
+            None if a and b are not structures of the same type with the same
+            members.
+
+    '''
+    if type(a) is not type(b) or not hasattr(a, '__dict__') or \
+            not hasattr(b, '__dict__'):
+        return None
+    if len(a.__dict__) != len(b.__dict__):
+        return None
+    res = []
+    for k in a.__dict__:
+        if k not in b.__dict__:
+            return None
+        if not _same(a.__dict__[k], b.__dict__[k]):
+            res.append(k)
+    return res
+
+
+def same_data(a, b):
+    '''Compare two data values, ignoring the time stamp of each.
+
+    The generated classes of IDL structures do not compare their members, so
+    they are compared member by member.
+
+    '''
+    if hasattr(a, '__dict__') and hasattr(b, '__dict__'):
+        return _same_members(a.__dict__, b.__dict__, ('tm',))
+    return _same(a, b)
+
+
+def _same(a, b):
+    if type(a) is not type(b):
+        return False
+    if type(a) in (list, tuple):
+        if a == b:
+            return True
+        # Sequences of numbers are different if they did not compare equal;
+        # only sequences of structures need comparing member by member
+        if len(a) != len(b) or not hasattr(a[0], '__dict__'):
+            return False
+        for x, y in zip(a, b):
+            if not _same(x, y):
+                return False
+        return True
+    if hasattr(a, '__dict__'):
+        return _same_members(a.__dict__, b.__dict__, ())
+    return a == b
+
+
+def _same_members(a, b, ignore):
+    if len(a) != len(b):
+        return False
+    for k in a:
+        if k in ignore:
+            continue
+        if k not in b or not _same(a[k], b[k]):
+            return False
+    return True
+
+
+def parse_policy(text):
+    '''Parse a recording policy.
+
+    @param text The policy, as the channel name, a colon and the rules.
+    @return A tuple of (channel name, @ref ChannelPolicy).
+    @raises ValueError if the policy is not valid.
+
+    '''
+    name, sep, rules = text.strip().partition(':')
+    name = name.strip()
+    if not name or not sep or not rules.strip():
+        raise ValueError('Invalid recording policy: {0}'.format(text))
+    args = {}
+    for r in rules.split(','):
+        key, sep, value = r.strip().partition('=')
+        key = key.strip().lower()
+        if key in args:
+            raise ValueError('Repeated rule in recording policy: {0}'.format(
+                text))
+        if key == EVERY and sep:
+            args['every'] = int(value)
+        elif key == RATE and sep:
+            args['rate'] = float(value)
+        elif key == CHANGED and not sep:
+            args['changed'] = True
+        else:
+            raise ValueError('Invalid recording policy: {0}'.format(text))
+    return name, ChannelPolicy(**args)
+
+
+def load_policies(filename):
+    '''Read recording policies from a file.
+
+    The file holds one policy per line. Blank lines and lines starting with
+    "#" are ignored.
+
+    @param filename The file to read.
+    @return A list of the policies' lines.
+
+    '''
+    res = []
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                res.append(line)
+    return res
+
@@ -0,0 +1,440 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Flight recorder: an in-memory ring of entries written to a log on a trigger.
+
+'''
+
+
+import collections
+import operator
+import os.path
+import pickle
+import threading
+
+from rtshell import ilog
+
+
+###############################################################################
+## Trigger conditions
+##
+## A condition is given as the channel name, a colon, the path of a member of
+## the channel's data, a comparison operator and a value. For example,
+## "battery:data<11.5" triggers when the data member of the battery channel's
+## data falls below 11.5, and "pose:position.x>=10" when the x member of the
+## position member reaches 10. The value is compared as a number if it is one,
+## and as a string otherwise.
+##
+## A condition triggers when it becomes true, not for every entry for which it
+## is true, so a value that stays below a limit triggers only once.
+
+# Longer operators first, so "<=" is not taken as "<"
+OPERATORS = [('<=', operator.le), ('>=', operator.ge), ('==', operator.eq),
+        ('!=', operator.ne), ('<', operator.lt), ('>', operator.gt)]
+
+
+class Condition(object):
+    '''A condition on the data of a channel that triggers a dump.'''
+    def __init__(self, channel, member, op, value):
+        '''Constructor.
+
+        @param channel The name of the channel.
+        @param member The path of the member to compare, with the names of
+                      nested members separated by ".".
+        @param op The comparison operator, one of those in OPERATORS.
+        @param value The value to compare the member to.
+
+        '''
+        super(Condition, self).__init__()
+        ops = dict(OPERATORS)
+        if op not in ops:
+            raise ValueError('Unknown operator: {0}'.format(op))
+        self._channel = channel
+        self._member = member
+        self._path = member.split('.')
+        self._op = op
+        self._cmp = ops[op]
+        self._value = value
+        self._met = False
+
+    def __str__(self):
+        return '{0}:{1}{2}{3}'.format(self._channel, self._member, self._op,
+                self._value)
+
+    @property
+    def channel(self):
+        '''The name of the channel the condition is on.'''
+        return self._channel
+
+    def test(self, data):
+        '''Test the condition against a channel's data.
+
+        A member that does not exist, or a value that cannot be compared, does
+        not meet the condition.
+
+        @param data The data of an entry of the channel.
+        @return True if the condition has become true.
+
+        '''
+        value = data
+        try:
+            for name in self._path:
+                value = getattr(value, name)
+            met = bool(self._cmp(value, self._value))
+        except (AttributeError, TypeError):
+            met = False
+        triggered = met and not self._met
+        self._met = met
+        return triggered
+
+
+def parse_trigger(text):
+    '''Parse a trigger condition.
+
+    @param text The condition, as the channel name, a colon, the member path,
+                an operator and a value.
+    @return A @ref Condition.
+    @raises ValueError if the condition is not valid.
+
+    '''
+    channel, sep, expr = text.strip().partition(':')
+    channel = channel.strip()
+    if not channel or not sep:
+        raise ValueError('Invalid trigger condition: {0}'.format(text))
+    for op, f in OPERATORS:
+        member, sep, value = expr.partition(op)
+        if sep:
+            break
+    else:
+        raise ValueError('Invalid trigger condition: {0}'.format(text))
+    member = member.strip()
+    value = value.strip()
+    if not member or not value:
+        raise ValueError('Invalid trigger condition: {0}'.format(text))
+    for t in (int, float):
+        try:
+            value = t(value)
+            break
+        except ValueError:
+            pass
+    return Condition(channel, member, op, value)
+
+
+def dump_file_name(filename, number):
+    '''Get the file name of a dump of the ring.
+
+    The dump number is placed before the extension, so dump 3 of
+    "robot.rtlog" is "robot-0003.rtlog".
+
+    '''
+    root, ext = os.path.splitext(filename)
+    return '{0}-{1:04d}{2}'.format(root, number, ext)
+
+
+###############################################################################
+## Flight recorder
+##
+## The entries are held in memory as their timestamps in nanoseconds and their
+## data pickled, in order of writing. The ring keeps the entries covering the
+## given duration of sample time back from the newest entry, and at most the
+## given number of bytes of pickled data; older entries are discarded.
+##
+## When triggered, the entries in the ring (the pre-trigger window) are handed
+## to a writer thread, which creates a new log file and writes them to it. The
+## entries written after the trigger are then handed to the writer thread for
+## the same file, until one is more than the post-trigger time after the
+## trigger. A trigger during the post-trigger window extends it. The file is
+## then closed, and the ring starts filling again from empty, so an entry is
+## never written to two files. The thread writing to the ring (and the thread
+## triggering a dump) therefore never waits for a dump to be written.
+##
+## A trigger when the ring is empty and there is no post-trigger window has
+## nothing to write, so no file is created. Nor is one if the log is closed
+## before any entries arrive in the post-trigger window.
+
+class RingLog(ilog.Log):
+    '''Keeps recent entries in memory, and writes them to a log only when
+    triggered.
+
+    A trigger may come from another thread (for example, a signal handler) by
+    calling @ref trigger, or from a condition on the data being written.
+
+    '''
+    def __init__(self, logger_type, filename, meta=None, duration=0, size=0,
+            post=0, conditions=[], logger_opts={}, verbose=False, *args,
+            **kwargs):
+        '''Constructor.
+
+        @param logger_type The type of log to write the dumps with.
+        @param filename The name of the log file. Each dump is written to a
+                        file named by @ref dump_file_name.
+        @param meta The metadata of the dumped logs.
+        @param duration The seconds of sample time to keep in the ring. 0 for
+                        no limit.
+        @param size The maximum number of bytes of data to keep in the ring.
+                    0 for no limit.
+        @param post The seconds of sample time after a trigger to write.
+        @param conditions A list of @ref Condition that trigger a dump.
+        @param logger_opts Options to give the logs of the dumps.
+        @param verbose Print verbose output to stderr.
+
+        '''
+        self._is_open = False
+        if duration < 0 or size < 0 or post < 0:
+            raise ValueError('Ring limits must not be negative')
+        if not duration and not size:
+            raise ValueError('Ring needs a duration or a size')
+        self._logger_type = logger_type
+        self._fn = filename
+        self._duration = ilog.ts_to_ns(duration)
+        self._size = size
+        self._post = ilog.ts_to_ns(post)
+        self._conditions = {}
+        for c in conditions:
+            self._conditions.setdefault(c.channel, []).append(c)
+        self._logger_opts = logger_opts
+        self._written = 0
+        self._discarded = 0
+        self._dumped = 0
+        self._dumps = []
+        super(RingLog, self).__init__(mode='w', meta=meta, verbose=verbose,
+                *args, **kwargs)
+
+    def __str__(self):
+        return 'RingLog of {0} entries ({1} bytes) for {2}'.format(
+                len(self._ring), self._bytes, self._fn)
+
+    @property
+    def buffered(self):
+        '''The number of entries in the ring.'''
+        return len(self._ring)
+
+    @property
+    def discarded(self):
+        '''The number of entries discarded from the ring without being
+        written.'''
+        return self._discarded
+
+    @property
+    def dumped(self):
+        '''The number of entries written to dumps.'''
+        return self._dumped
+
+    @property
+    def dumps(self):
+        '''The file names of the dumps written.'''
+        return self._dumps
+
+    @property
+    def triggered(self):
+        '''True if the entries being written are going to a dump.'''
+        return self._dumping is not None
+
+    @property
+    def written(self):
+        '''The number of entries given to @ref write.'''
+        return self._written
+
+    def trigger(self, reason=''):
+        '''Write the ring to a new dump, or extend the current dump.
+
+        Safe to call from any thread.
+
+        @param reason The cause of the trigger, for the verbose output.
+
+        '''
+        with self._lock:
+            self._trigger(reason, self._last_ns)
+
+    def write(self, timestamp, data):
+        ns = ilog.ts_to_ns(timestamp)
+        with self._lock:
+            self._check_error()
+            self._written += 1
+            self._last = timestamp
+            self._last_ns = ns
+            reason = self._test(data)
+            d = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+            if self._dumping is not None:
+                if self._post_end is None:
+                    self._post_end = ns + self._post
+                if ns <= self._post_end:
+                    self._pending.append((self._dumping, ns, d))
+                    self._cond.notify_all()
+                    if reason:
+                        self._trigger(reason, ns)
+                    return
+                self._finish_dump()
+            self._ring.append((ns, d))
+            self._bytes += len(d)
+            self._trim(ns)
+            if reason:
+                self._trigger(reason, ns)
+
+    def _check_error(self):
+        # The writer thread stops on an error, so it is kept to fail every
+        # later call
+        if self._error is not None:
+            raise self._error
+
+    def _close(self):
+        if not self._is_open:
+            return
+        with self._lock:
+            if self._dumping is not None:
+                self._finish_dump()
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._is_open = False
+        self._check_error()
+        self._vb_print('Closed ring. {0} entries written, {1} dumped to {2} '
+                'files, {3} discarded; {4} left in the ring.'.format(
+                    self._written, self._dumped, len(self._dumps),
+                    self._discarded, len(self._ring)))
+
+    def _finish_dump(self):
+        '''End the current dump. Must be called with the lock held.'''
+        self._pending.append((self._dumping, None, None))
+        self._dumping = None
+        self._cond.notify_all()
+
+    def _get_cur_pos(self):
+        return self._written, self._last
+
+    def _get_start(self):
+        return 0, None
+
+    def _get_end(self):
+        return self._written - 1, self._last
+
+    def _open(self):
+        self._ring = collections.deque()
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self._cond = threading.Condition(self._lock)
+        # Entries to write to dumps, as (file name, ns, pickled data); None
+        # for the time and data marks the end of a dump
+        self._pending = collections.deque()
+        self._dumping = None
+        self._next_dump = 0
+        self._stop = False
+        self._error = None
+        self._post_end = None
+        self._last = None
+        self._last_ns = None
+        self._thread = threading.Thread(target=self._run,
+                name='rtlog-ring-writer')
+        self._thread.daemon = True
+        self._thread.start()
+        self._is_open = True
+        self._vb_print('Started ring of {0} ns, {1} bytes; {2} ns written '
+                'after a trigger.'.format(self._duration, self._size,
+                    self._post))
+
+    def _run(self):
+        '''Write the dumps. Runs in the writer thread.'''
+        out = None
+        while True:
+            with self._cond:
+                while not self._pending and not self._stop:
+                    self._cond.wait()
+                if not self._pending:
+                    # Stopped and drained
+                    return
+                fn, ns, d = self._pending.popleft()
+            if ns is None:
+                if out is not None:
+                    out.close()
+                    out = None
+                    self._vb_print('Finished dump {0}.'.format(fn))
+                else:
+                    # Nothing arrived for the dump, so there is no file
+                    with self._lock:
+                        self._dumps.remove(fn)
+                    self._vb_print('Dump {0} was empty.'.format(fn))
+                continue
+            try:
+                if out is None:
+                    out = self._logger_type(filename=fn, mode='w',
+                            meta=self._meta, verbose=self._vb,
+                            **self._logger_opts)
+                out.write(ilog.EntryTS(ns=ns), pickle.loads(d))
+            except Exception as e:
+                with self._lock:
+                    self._error = e
+                    self._pending.clear()
+                return
+            with self._lock:
+                self._dumped += 1
+
+    def _test(self, data):
+        '''Test the conditions on an entry's channel.
+
+        @return A description of the first condition met, or None.
+
+        '''
+        if not self._conditions or type(data) is not tuple or len(data) != 2:
+            return None
+        reason = None
+        for c in self._conditions.get(data[0], []):
+            # Every condition is tested so each knows if it was met
+            if c.test(data[1]) and reason is None:
+                reason = str(c)
+        return reason
+
+    def _trigger(self, reason, ns):
+        '''Start or extend a dump. Must be called with the lock held.'''
+        if ns is None:
+            # Nothing written yet; the window starts from the first entry
+            self._post_end = None
+        else:
+            self._post_end = ns + self._post
+        if self._dumping is not None:
+            self._vb_print('Trigger ({0}) extended dump {1}.'.format(reason,
+                self._dumping))
+            return
+        if not self._ring and not self._post:
+            self._vb_print('Trigger ({0}) with nothing to write.'.format(
+                reason))
+            return
+        fn = dump_file_name(self._fn, self._next_dump)
+        self._next_dump += 1
+        self._vb_print('Trigger ({0}); writing {1} entries to {2}.'.format(
+            reason, len(self._ring), fn))
+        self._dumps.append(fn)
+        self._dumping = fn
+        # Hand the whole ring to the writer thread
+        self._pending.extend([(fn, ns, d) for ns, d in self._ring])
+        self._ring.clear()
+        self._bytes = 0
+        self._cond.notify_all()
+        if not self._post:
+            self._finish_dump()
+
+    def _trim(self, ns):
+        '''Discard the oldest entries until the ring is within its limits.
+
+        The newest entry is always kept. Entries from after the newest entry
+        mean the source's clock has gone backwards, so they are discarded.
+
+        '''
+        while len(self._ring) > 1 and \
+                ((self._size and self._bytes > self._size) or
+                (self._duration and not
+                    0 <= ns - self._ring[0][0] <= self._duration)):
+            self._bytes -= len(self._ring.popleft()[1])
+            self._discarded += 1
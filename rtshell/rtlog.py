@@ -25,6 +25,7 @@ import os
 import os.path
 import rtctree.tree
 import rtctree.utils
+import signal
 import sys
 import threading
 import time
@@ -32,17 +33,166 @@ import traceback
 import OpenRTM_aist
 import RTC
 
+from rtshell import async_log
+from rtshell import cdr_log
+from rtshell import chunked_log
 from rtshell import comp_mgmt
+from rtshell import framed_log
+from rtshell import ilog
+from rtshell import log_export
+from rtshell import log_io
+from rtshell import log_merge
+from rtshell import log_stats
 from rtshell import modmgr
 from rtshell import path
 from rtshell import port_types
+from rtshell import record_policy
+from rtshell import ring_log
 from rtshell import rtlog_comps
 from rtshell import rts_exceptions
+from rtshell import segmented_log
 from rtshell import simpkl_log
+from rtshell import stream_log
 from rtshell import text_log
 import rtshell
 
 
+###############################################################################
+## Log types
+
+RECORD = 'recording'
+PLAY = 'playback'
+REVERSE = 'reverse playback'
+DISPLAY = 'information display'
+EXPORT = 'exporting'
+MERGE = 'merging'
+RECOVER = 'recovery'
+SLICE = 'slicing'
+SEGMENT = 'segmentation'
+
+# The class of each type of logger given by --logger, and the operations it
+# supports. Merging reads and writes logs of the type given.
+LOG_TYPES = {
+        'simpkl': (simpkl_log.SimplePickleLog, [RECORD, PLAY, REVERSE,
+            DISPLAY, EXPORT, MERGE, RECOVER, SLICE, SEGMENT]),
+        'framed': (framed_log.FramedLog, [RECORD, PLAY, REVERSE, DISPLAY,
+            EXPORT, MERGE, SEGMENT]),
+        'cdr': (cdr_log.CdrLog, [RECORD, PLAY, REVERSE, DISPLAY, EXPORT,
+            MERGE, SEGMENT]),
+        'chunked': (chunked_log.ChunkedLog, [RECORD, PLAY, REVERSE, DISPLAY,
+            EXPORT, MERGE, SEGMENT]),
+        'text': (text_log.TextLog, [RECORD, PLAY, REVERSE, DISPLAY, EXPORT,
+            MERGE]),
+        'stream': (stream_log.StreamLog, [RECORD, PLAY]),
+        }
+
+# The operations that read an existing log, so find a segmented log from its
+# manifest whatever the logger type given
+READ_OPERATIONS = [PLAY, REVERSE, DISPLAY, EXPORT, RECOVER, SLICE]
+# The operations supported by segmented logs
+SEGMENTED_OPERATIONS = [PLAY, REVERSE, DISPLAY, EXPORT, RECOVER]
+
+
+def logger_type(options, operation):
+    '''Get the class of log to use for an operation.
+
+    @param options The command line options, giving the logger type and the
+                   log file name.
+    @param operation The operation to be done on the log.
+    @return The class of the log.
+    @raises BadLogTypeError if the logger type is not known.
+    @raises UnsupportedLogTypeError if the type of log does not support the
+            operation.
+
+    '''
+    if operation in READ_OPERATIONS and \
+            segmented_log.is_manifest(options.filename):
+        # The type of the segments is recorded in the manifest
+        if operation not in SEGMENTED_OPERATIONS:
+            raise rts_exceptions.UnsupportedLogTypeError('segmented',
+                    operation)
+        return segmented_log.SegmentedLog
+    if options.logger not in LOG_TYPES:
+        raise rts_exceptions.BadLogTypeError(options.logger)
+    l_type, operations = LOG_TYPES[options.logger]
+    if operation not in operations:
+        raise rts_exceptions.UnsupportedLogTypeError(options.logger,
+                operation)
+    return l_type
+
+
+def read_log_opts(options):
+    '''Get the options for opening a log for reading.'''
+    return {'mmap': options.mmap}
+
+
+def write_log_opts(options):
+    '''Get the options for opening a log for writing.'''
+    return {'codec': options.codec, 'chunk_size': options.chunk_size,
+            'buffer_size': options.buffer_size,
+            'flush_interval': options.flush_interval, 'fsync': options.fsync,
+            'checkpoint_interval': options.checkpoint_interval,
+            'keyframe_interval': options.keyframe_interval,
+            'text_format': options.text_format}
+
+
+def select_stdio_logger(options):
+    '''Select the stream logger if the log file is standard input or output.
+
+    Only the stream logger can be written to and read from a pipe, so it is
+    used for the file name "-" unless another logger was chosen.
+
+    '''
+    logger = stream_log.stdio_logger(options.filename, options.logger)
+    if logger is None:
+        raise rts_exceptions.UnsupportedLogTypeError(options.logger,
+                'standard input/output')
+    options.logger = logger
+
+
+def make_record_policies(options, port_specs):
+    '''Get the recording policies for the ports being recorded.
+
+    Policies may be given on the command line and in a file.
+
+    @return A dictionary of {port name: recording policy}.
+
+    '''
+    texts = list(options.policies)
+    if options.policy_file:
+        texts += record_policy.load_policies(options.policy_file)
+    names = [p.name for p in port_specs]
+    res = {}
+    for t in texts:
+        try:
+            name, policy = record_policy.parse_policy(t)
+        except ValueError:
+            raise rts_exceptions.BadRecordPolicyError(t)
+        if name in res or names.count(name) != 1:
+            raise rts_exceptions.PolicyChannelError(name)
+        res[name] = policy
+    return res
+
+
+def make_triggers(options, port_specs):
+    '''Get the trigger conditions for flight recorder mode.
+
+    @return A list of @ref ring_log.Condition.
+
+    '''
+    names = [p.name for p in port_specs]
+    res = []
+    for t in options.triggers:
+        try:
+            c = ring_log.parse_trigger(t)
+        except ValueError:
+            raise rts_exceptions.BadTriggerError(t)
+        if names.count(c.channel) != 1:
+            raise rts_exceptions.TriggerChannelError(c.channel)
+        res.append(c)
+    return res
+
+
 def record_log(raw_paths, options, tree=None):
     event = threading.Event()
 
@@ -51,6 +201,11 @@ def record_log(raw_paths, options, tree=None):
     if options.end is None and options.index:
         print('{0}: WARNING: --index has no effect without --end'.format(
             os.path.basename(sys.argv[0])), file=sys.stderr)
+    try:
+        log_io.parse_fsync_policy(options.fsync)
+    except ValueError:
+        raise rts_exceptions.BadFsyncPolicyError(options.fsync)
+    select_stdio_logger(options)
 
     mm = modmgr.ModuleMgr(verbose=options.verbose, paths=options.paths)
     mm.load_mods_and_poas(options.modules)
@@ -71,12 +226,14 @@ def record_log(raw_paths, options, tree=None):
                 print('Recording until {0} ({1}).'.format(end_str,
                     options.end), file=sys.stderr)
 
-    if options.logger == 'simpkl':
-        l_type = simpkl_log.SimplePickleLog
-    elif options.logger == 'text':
-        l_type = text_log.TextLog
-    else:
-        raise rts_exceptions.BadLogTypeError(options.logger)
+    l_type = logger_type(options, RECORD)
+    logger_opts = write_log_opts(options)
+    if options.segment_size or options.segment_duration:
+        logger_type(options, SEGMENT)
+        logger_opts['logger_type'] = l_type
+        logger_opts['segment_size'] = options.segment_size
+        logger_opts['segment_duration'] = options.segment_duration
+        l_type = segmented_log.SegmentedLog
 
     sources = port_types.parse_targets(raw_paths)
     if not tree:
@@ -87,6 +244,23 @@ def record_log(raw_paths, options, tree=None):
     if options.verbose:
         print('Port specifications: {0}'.format([str(p) for p in port_specs]),
                 file=sys.stderr)
+    policies = make_record_policies(options, port_specs)
+    if options.verbose and policies:
+        print('Recording policies: {0}'.format(', '.join(['{0}:{1}'.format(n,
+            policies[n]) for n in sorted(policies.keys())])), file=sys.stderr)
+    ring = options.ring_duration > 0 or options.ring_size > 0
+    if ring and options.filename == stream_log.STDIO:
+        raise rts_exceptions.UnsupportedLogTypeError(options.logger,
+                'flight recorder mode on standard output')
+    triggers = make_triggers(options, port_specs)
+    if ring:
+        print('Flight recorder mode: writing to disk only when triggered '
+                '(press Enter{0}).'.format(', send SIGUSR1' if hasattr(signal,
+                    'SIGUSR1') else ''), file=sys.stderr)
+    elif triggers:
+        print('{0}: WARNING: --trigger has no effect without --ring-duration '
+                'or --ring-size'.format(os.path.basename(sys.argv[0])),
+                file=sys.stderr)
 
     if options.end is None:
         end = -1 # Send -1 as the default
@@ -96,7 +270,11 @@ def record_log(raw_paths, options, tree=None):
             rtlog_comps.Recorder, port_specs, event=event,
             logger_type=l_type, filename=options.filename,
             lims_are_ind=options.index, end=end,
-            verbose=options.verbose, rate=options.exec_rate)
+            verbose=options.verbose, logger_opts=logger_opts,
+            queue_size=options.queue_size, overflow=options.overflow,
+            policies=policies, ring_duration=options.ring_duration,
+            ring_size=options.ring_size, post_trigger=options.post_trigger,
+            triggers=triggers, rate=options.exec_rate)
     if options.verbose:
         print('Created component {0}'.format(comp_name), file=sys.stderr)
     try:
@@ -106,6 +284,8 @@ def record_log(raw_paths, options, tree=None):
     except Exception as e:
         #comp_mgmt.shutdown(mgr)
         raise e
+    if ring and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda s, f: comp.trigger('SIGUSR1'))
     try:
         if options.timeout is not None:
             event.wait(options.timeout)
@@ -121,6 +301,8 @@ def record_log(raw_paths, options, tree=None):
                     input()
                 else:
                     raw_input()
+                if ring:
+                    comp.trigger('stdin')
             # The manager will catch the Ctrl-C and shut down itself, so don't
             # disconnect/deactivate the component
     except KeyboardInterrupt:
@@ -145,6 +327,7 @@ def play_log(raw_paths, options, tree=None):
         print('{0}: WARNING: --index has no effect without '\
                 '--start or --end'.format(os.path.basename(sys.argv[0])),
                 file=sys.stderr)
+    select_stdio_logger(options)
 
     mm = modmgr.ModuleMgr(verbose=options.verbose, paths=options.paths)
     mm.load_mods_and_poas(options.modules)
@@ -187,12 +370,7 @@ def play_log(raw_paths, options, tree=None):
                 print('Playing from {0} ({1}).'.format(start_str,
                     options.start), file=sys.stderr)
 
-    if options.logger == 'simpkl':
-        l_type = simpkl_log.SimplePickleLog
-    elif options.logger == 'text':
-        raise rts_exceptions.UnsupportedLogTypeError('text', 'playback')
-    else:
-        raise rts_exceptions.BadLogTypeError(options.logger)
+    l_type = logger_type(options, PLAY)
 
     targets = port_types.parse_targets(raw_paths)
     if not tree:
@@ -204,6 +382,18 @@ def play_log(raw_paths, options, tree=None):
                 file=sys.stderr)
     port_types.require_all_output(port_specs)
 
+    if options.rate == 0:
+        raise rts_exceptions.BadPlaybackRateError(options.rate)
+    if options.loop_forever:
+        loops = 0
+    elif options.loop < 1:
+        raise rts_exceptions.BadLoopCountError(options.loop)
+    else:
+        loops = options.loop
+    if loops != 1 and options.rate < 0:
+        raise rts_exceptions.ReverseLoopError
+    if options.rate < 0:
+        logger_type(options, REVERSE)
     if options.start is None:
         start = 0 # Send 0 as the default
     else:
@@ -217,7 +407,9 @@ def play_log(raw_paths, options, tree=None):
             filename=options.filename, lims_are_ind=options.index, start=start,
             end=end, scale_rate=options.rate, abs_times=options.abs_times,
             ignore_times=options.ig_times, verbose=options.verbose,
-            rate=options.exec_rate)
+            logger_opts=read_log_opts(options), prefetch=options.prefetch,
+            prefetch_bytes=options.prefetch_bytes, timed=options.timed,
+            loops=loops, rate=options.exec_rate)
     if options.verbose:
         print('Created component {0}'.format(comp_name), file=sys.stderr)
     comp = comp_mgmt.find_comp_in_mgr(comp_name, mgr)
@@ -261,12 +453,7 @@ def display_info(options):
     if not options.filename:
         raise rts_exceptions.NoLogFileNameError
 
-    if options.logger == 'simpkl':
-        l_type = simpkl_log.SimplePickleLog
-    elif options.logger == 'text':
-        raise rts_exceptions.UnsupportedLogTypeError('text', 'inspection')
-    else:
-        raise rts_exceptions.BadLogTypeError(options.logger)
+    l_type = logger_type(options, DISPLAY)
 
     mm = modmgr.ModuleMgr(verbose=options.verbose, paths=options.paths)
     mm.load_mods_and_poas(options.modules)
@@ -274,8 +461,15 @@ def display_info(options):
         print('Pre-loaded modules: {0}'.format(mm.loaded_mod_names),
                 file=sys.stderr)
 
-    statinfo = os.stat(options.filename)
-    size = statinfo.st_size
+    log = l_type(filename=options.filename, mode='r', verbose=options.verbose,
+            **read_log_opts(options))
+
+    if l_type == segmented_log.SegmentedLog:
+        log_dir = os.path.dirname(options.filename)
+        size = sum([os.stat(os.path.join(log_dir, s.filename)).st_size
+            for s in log.segments])
+    else:
+        size = os.stat(options.filename).st_size
     if size > 1024 * 1024 * 1024: # GiB
         size_str = '{0:.2f}GiB ({1}B)'.format(size / (1024.0 * 1024 * 1024), size)
     elif size > 1024 * 1024: # MiB
@@ -284,7 +478,6 @@ def display_info(options):
         size_str = '{0:.2f}KiB ({1}B)'.format(size / 1024.0, size)
     else:
         size_str = '{0}B'.format(size)
-    log = l_type(filename=options.filename, mode='r', verbose=options.verbose)
 
     start_time, port_specs = log.metadata
     start_time_str = time.strftime('%Y-%m-%d %H:%M:%S',
@@ -302,6 +495,21 @@ def display_info(options):
     print('First entry time: {0} ({1})'.format(first_time_str, first_time))
     print('End time: {0} ({1})'.format(end_time_str, end_time))
     print('Number of entries: {0}'.format(end_ind + 1))
+    if l_type == segmented_log.SegmentedLog:
+        print('Number of segments: {0}'.format(len(log.segments)))
+    if getattr(log, 'recovered', False):
+        print('The log was not closed. Use --recover to repair it.')
+    stats = None
+    if options.stats:
+        if options.jobs == 1:
+            log.rewind()
+            stats = log_stats.gather(log)
+        else:
+            stats = log_stats.gather_parallel(l_type, options.filename,
+                    jobs=options.jobs, log_opts=read_log_opts(options),
+                    verbose=options.verbose)
+        print('Timestamp regressions: {0}'.format(stats.regressions))
+    log.close()
     for ii, p in enumerate(port_specs):
         print('Channel {0}'.format(ii + 1))
         print('  Name: {0}'.format(p.name))
@@ -309,6 +517,173 @@ def display_info(options):
         print('  Sources:')
         for r in p.raw:
             print('    {0}'.format(r))
+        if stats:
+            display_channel_stats(stats.channels.get(p.name,
+                log_stats.ChannelStats(p.name)))
+    if stats:
+        names = set([p.name for p in port_specs])
+        for name in sorted(stats.channels.keys()):
+            if name not in names:
+                print('Unlisted channel')
+                print('  Name: {0}'.format(name))
+                display_channel_stats(stats.channels[name])
+
+
+def format_interval(ns):
+    if ns is None:
+        return '-'
+    if ns >= 1000000000:
+        return '{0:.3f}s'.format(ns / 1e9)
+    return '{0:.3f}ms'.format(ns / 1e6)
+
+
+def display_channel_stats(c):
+    print('  Entries: {0}'.format(c.count))
+    if c.mean_rate is not None:
+        print('  Rate: mean {0:.2f}Hz, min {1:.2f}Hz, max {2}'.format(
+            c.mean_rate, 1e9 / c.max_interval if c.max_interval else 0,
+            '{0:.2f}Hz'.format(1e9 / c.min_interval) if c.min_interval
+                else 'unlimited'))
+    if c.mean_interval is not None:
+        print('  Interval: mean {0}, std. dev. {1}'.format(
+            format_interval(c.mean_interval),
+            format_interval(c.std_interval)))
+        print('  Interval percentiles: 50% {0}, 90% {1}, 99% {2}, '
+                '99.9% {3}'.format(*[format_interval(c.percentile(p))
+                    for p in (50, 90, 99, 99.9)]))
+        print('  Largest gaps: {0}'.format(', '.join(['{0} after {1}'.format(
+            format_interval(g), ilog.EntryTS(sec=ts // 1000000000,
+                nsec=ts % 1000000000)) for g, ts in c.gaps])))
+    print('  Payload: {0}B total, {1:.1f}B mean'.format(c.bytes,
+        c.mean_bytes))
+    print('  Timestamp regressions: {0}'.format(c.regressions), end='')
+    if c.regressions:
+        print(' (largest {0})'.format(format_interval(c.max_regression)))
+    else:
+        print()
+
+
+def export_log(options):
+    if not options.filename:
+        raise rts_exceptions.NoLogFileNameError
+
+    l_type = logger_type(options, EXPORT)
+
+    mm = modmgr.ModuleMgr(verbose=options.verbose, paths=options.paths)
+    mm.load_mods_and_poas(options.modules)
+    if options.verbose:
+        print('Pre-loaded modules: {0}'.format(mm.loaded_mod_names),
+                file=sys.stderr)
+
+    prefix = options.export_prefix
+    if not prefix:
+        prefix = os.path.splitext(options.filename)[0]
+    if options.jobs == 1:
+        with l_type(filename=options.filename, mode='r',
+                verbose=options.verbose, **read_log_opts(options)) as log:
+            files = log_export.export_npz(log, prefix, ragged=options.ragged,
+                    verbose=options.verbose)
+    else:
+        files = log_export.export_npz_parallel(l_type, options.filename,
+                prefix, ragged=options.ragged, jobs=options.jobs,
+                log_opts=read_log_opts(options), verbose=options.verbose)
+    for name in sorted(files.keys()):
+        print('{0}: {1}'.format(name, files[name]))
+
+
+def merge_logs(filenames, options):
+    if not options.filename:
+        raise rts_exceptions.NoLogFileNameError
+
+    l_type = logger_type(options, MERGE)
+
+    mm = modmgr.ModuleMgr(verbose=options.verbose, paths=options.paths)
+    mm.load_mods_and_poas(options.modules)
+    if options.verbose:
+        print('Pre-loaded modules: {0}'.format(mm.loaded_mod_names),
+                file=sys.stderr)
+
+    inputs = []
+    try:
+        for fn in filenames:
+            if segmented_log.is_manifest(fn):
+                in_type = segmented_log.SegmentedLog
+            else:
+                in_type = l_type
+            inputs.append(in_type(filename=fn, mode='r',
+                verbose=options.verbose, **read_log_opts(options)))
+        for fn, log in zip(filenames, inputs):
+            if not log_merge.is_rtlog_metadata(log.metadata):
+                raise rts_exceptions.NotRtlogLogError(fn)
+        meta, renames = log_merge.merge_metadata(
+                [log.metadata for log in inputs])
+        for fn, names in zip(filenames, renames):
+            for old in sorted(names.keys()):
+                print('Channel {0} of {1} renamed to {2}.'.format(old, fn,
+                    names[old]), file=sys.stderr)
+        with l_type(filename=options.filename, mode='w', meta=meta,
+                verbose=options.verbose, **write_log_opts(options)) as out:
+            count = log_merge.merge(inputs, out, renames)
+    finally:
+        for log in inputs:
+            log.close()
+    print('Merged {0} entries from {1} logs into {2}.'.format(count,
+        len(inputs), options.filename))
+
+
+def recover_log(options):
+    if not options.filename:
+        raise rts_exceptions.NoLogFileNameError
+
+    l_type = logger_type(options, RECOVER)
+
+    mm = modmgr.ModuleMgr(verbose=options.verbose, paths=options.paths)
+    mm.load_mods_and_poas(options.modules)
+    if options.verbose:
+        print('Pre-loaded modules: {0}'.format(mm.loaded_mod_names),
+                file=sys.stderr)
+
+    with l_type(filename=options.filename, mode='r',
+            verbose=options.verbose) as log:
+        if not log.recover():
+            print('{0} was closed correctly; nothing to recover.'.format(
+                options.filename))
+            return
+        end_ind, end_time = log.end
+    print('Recovered {0}: {1} entries, ending at {2}.'.format(
+        options.filename, end_ind + 1, end_time))
+
+
+def slice_log(filenames, options):
+    if not options.filename:
+        raise rts_exceptions.NoLogFileNameError
+    if len(filenames) != 1:
+        raise rts_exceptions.NoLogFileNameError
+    if options.start is not None and options.start < 0:
+        raise rts_exceptions.BadStartPointError
+    if options.end is not None and options.end < 0:
+        raise rts_exceptions.BadEndPointError
+
+    l_type = logger_type(options, SLICE)
+
+    mm = modmgr.ModuleMgr(verbose=options.verbose, paths=options.paths)
+    mm.load_mods_and_poas(options.modules)
+    if options.verbose:
+        print('Pre-loaded modules: {0}'.format(mm.loaded_mod_names),
+                file=sys.stderr)
+
+    if options.index:
+        start = None if options.start is None else int(options.start)
+        end = None if options.end is None else int(options.end)
+    else:
+        start = options.start
+        end = options.end
+    with l_type(filename=options.filename, mode='r',
+            verbose=options.verbose, **read_log_opts(options)) as log:
+        count = log.slice(filenames[0], start=start, end=end,
+                index=options.index)
+    print('Copied {0} entries from {1} to {2}.'.format(count,
+        options.filename, filenames[0]))
 
 
 def main(argv=None, tree=None):
@@ -321,6 +696,27 @@ Record data from output ports, or replay data into input ports.'''
             help='Times from the logged data are sent as recorded during '
             'replay, rather than adjusted to the current timeframe. '
             '[Default: %default]')
+    parser.add_option('--buffer-size', dest='buffer_size', action='store',
+            type='int', default=log_io.DEFAULT_BUFFER_SIZE,
+            help='(Record mode only.) The size in bytes of the write buffer. '
+            'Entries are written to the file in blocks of this size. '
+            '[Default: %default]')
+    parser.add_option('--checkpoint-interval', dest='checkpoint_interval',
+            action='store', type='float',
+            default=simpkl_log.DEFAULT_CHECKPOINT_INTERVAL,
+            help='(SimplePickle logger only.) Seconds between writing the '
+            'position of the last entry into the log while recording, so a '
+            'log that is not closed can be recovered quickly. 0 to disable. '
+            '[Default: %default]')
+    parser.add_option('--chunk-size', dest='chunk_size', action='store',
+            type='int', default=chunked_log.DEFAULT_CHUNK_SIZE,
+            help='(Chunked logger only.) The uncompressed size in bytes of '
+            'each chunk of entries. [Default: %default]')
+    parser.add_option('--codec', dest='codec', action='store',
+            type='choice', choices=sorted(chunked_log.CODECS.keys()),
+            default='zlib', help='(Chunked logger only.) The compression '
+            'codec to use when recording: zlib, bz2 or lzma. [Default: '
+            '%default]')
     parser.add_option('-d', '--display-info', dest='display_info',
             action='store_true', default=False, help='Display the log '
             'information and exit.')
@@ -330,46 +726,190 @@ Record data from output ports, or replay data into input ports.'''
             'within the bounds of the log. Specify -1 to record forever or '
             'replay to the end of the log. Use --index to specify that this '
             'value is an index. [Default: %default]')
+    parser.add_option('--export', dest='export', action='store_true',
+            default=False, help='Export each channel of the log to a NumPy '
+            '.npz file and exit. Requires NumPy. [Default: %default]')
+    parser.add_option('--export-prefix', dest='export_prefix',
+            action='store', type='string', default='', help='(Export mode '
+            'only.) The start of the export file names. The channel name and '
+            '".npz" are added to it. By default, the log file name without '
+            'its extension is used.')
     parser.add_option('-f', '--filename', dest='filename', action='store',
             type='string', default='', help='File name of the log file to '
             'record to/playback from. If not specified for recording, a '
             'default will be created based on the current time. Must be '
-            'specified for playback.')
+            'specified for playback. Specify "-" to record to standard output '
+            'or play back from standard input using the stream logger.')
+    parser.add_option('--flush-interval', dest='flush_interval',
+            action='store', type='float', default=None, help='(Record mode '
+            'only.) Flush the write buffer when an entry is recorded this '
+            'many seconds after the last flush. By default, the buffer is '
+            'only flushed when it is full.')
+    parser.add_option('--fsync', dest='fsync', action='store',
+            type='string', default=log_io.FSYNC_NEVER, help='(Record mode '
+            'only.) When to sync the log to the storage device: "never", '
+            'when the log is closed ("close"), every N entries (e.g. "100") '
+            'or every T seconds (e.g. "0.5s"). For the chunked logger, N '
+            'counts chunks. [Default: %default]')
     parser.add_option('--path', dest='paths', action='append', type='string',
             default=[], help='Extra module search paths to add to the '
             'PYTHONPATH.')
     parser.add_option('-i', '--index', dest='index', action='store_true',
             default=False, help='Interpret the start and end values as entry '
             'indices. [Default: %default]')
+    parser.add_option('-j', '--jobs', dest='jobs', action='store',
+            type='int', default=1, help='(Display and export modes only.) '
+            'The number of worker processes to decode the log with. 0 uses '
+            'one per CPU. [Default: %default]')
+    parser.add_option('--keyframe-interval', dest='keyframe_interval',
+            action='store', type='int', default=0, help='(SimplePickle '
+            'logger only.) Store the data of each port in full only every '
+            'this many entries of the port, and only the changes from it in '
+            'between. Reduces the size of logs of ports whose data rarely '
+            'changes. 0 stores every entry in full. [Default: %default]')
     parser.add_option('-l', '--logger', dest='logger', action='store',
             type='string', default='simpkl', help='The type of logger to '
             'use. The default is the SimplePickle logger. Alternatively, '
-            'the text logger (specify using "text") may be used. The text '
-            'logger does not support playback.')
+            'the framed binary logger (specify using "framed"), the framed '
+            'logger with data stored as CDR (specify using "cdr"), the '
+            'chunked, compressed logger (specify using "chunked"), the '
+            'structured text logger (specify using "text") or the '
+            'sequential logger for pipes (specify using "stream") may be '
+            'used.')
+    parser.add_option('--loop', dest='loop', action='store', type='int',
+            default=1, help='(Replay mode only.) Load the entries to play '
+            'into memory once and play them this many times, with the '
+            'times of each loop following on from the last. [Default: '
+            '%default]')
+    parser.add_option('--loop-forever', dest='loop_forever',
+            action='store_true', default=False, help='(Replay mode only.) '
+            'Like --loop, but play the entries until stopped. [Default: '
+            '%default]')
+    parser.add_option('--merge', dest='merge', action='store_true',
+            default=False, help='Merge the logs given as arguments into one '
+            'log, in time order, and exit. Use --filename to specify the '
+            'merged log. [Default: %default]')
     parser.add_option('-m', '--mod', dest='modules', action='append',
             type='string', default=[],
             help='Extra modules to import. If automatic module loading '
             'struggles with your data types, try listing the modules here. '
             'The module and its __POA partner will be imported.')
+    parser.add_option('--mmap', dest='mmap', action='store_true',
+            default=False, help='Memory-map the log file when reading it. All '
+            'readers of the same file share the mapped pages. [Default: '
+            '%default]')
     parser.add_option('-n', '--ignore-times', dest='ig_times',
             action='store_true', default=False, help='Ignore the log '
             'timestamps and play back a fixed number of entries per '
             'execution. Use --rate to change the number played back per '
             'execution. The value of --rate will be treated as an integer '
             'in this case.')
+    parser.add_option('--no-stats', dest='stats', action='store_false',
+            default=True, help='(Display mode only.) Do not read the log to '
+            'gather the statistics of each channel.')
+    parser.add_option('--overflow', dest='overflow', action='store',
+            type='choice', choices=async_log.POLICIES,
+            default=async_log.BLOCK, help='(Recording with --queue-size '
+            'only.) What to do when the write queue is full: wait for space '
+            '("block"), discard the oldest queued entry ("drop-oldest") or '
+            'discard the new entry ("drop-newest"). [Default: %default]')
     parser.add_option('-p', '--play', dest='play', action='store_true',
             default=False, help='Replay mode. [Default: %default]')
+    parser.add_option('--policy', dest='policies', action='append',
+            type='string', default=[], help='(Record mode only.) A recording '
+            'policy for one port, as the port name, a colon and a comma-'
+            'separated list of rules: "every=K" records every K-th sample, '
+            '"rate=HZ" records at most HZ samples per second, and "changed" '
+            'records a sample only if its data differs from the last sample '
+            'recorded. For example, "laser:every=3". May be given more than '
+            'once.')
+    parser.add_option('--policy-file', dest='policy_file', action='store',
+            type='string', default='', help='(Record mode only.) Read '
+            'recording policies from this file, one per line in the same '
+            'format as --policy. Lines starting with "#" are ignored.')
+    parser.add_option('--post-trigger', dest='post_trigger', action='store',
+            type='float', default=0, help='(Flight recorder mode only.) '
+            'Seconds of data after a trigger to write to the log, in addition '
+            'to the data held in memory. [Default: %default]')
+    parser.add_option('--prefetch', dest='prefetch', action='store',
+            type='int', default=0, help='(Replay mode only.) Read and decode '
+            'up to this many entries ahead of time in a background thread, '
+            'so large entries do not delay playing. 0 reads each entry when '
+            'it is played. [Default: %default]')
+    parser.add_option('--prefetch-bytes', dest='prefetch_bytes',
+            action='store', type='int', default=0, help='(Replay mode only.) '
+            'Limit the entries read ahead of time to this many bytes of '
+            'data. May be used with or without --prefetch. [Default: '
+            '%default]')
+    parser.add_option('--queue-size', dest='queue_size', action='store',
+            type='int', default=0, help='Write the log from a background '
+            'thread, queueing up to this many entries. Use this when the '
+            'storage is too slow to write each entry as it arrives. 0 writes '
+            'each entry immediately. [Default: %default]')
+    parser.add_option('--ragged', dest='ragged', action='store_true',
+            default=False, help='(Export mode only.) Export sequences as a '
+            'flat array of values and an array of offsets, rather than an '
+            'array padded to the longest sequence. [Default: %default]')
+    parser.add_option('--recover', dest='recover', action='store_true',
+            default=False, help='Repair a log that was not closed (for '
+            'example, because the recorder was killed) and exit. The end of '
+            'the log is found from the last checkpoint. [Default: %default]')
     parser.add_option('-r', '--rate', dest='rate', action='store',
             type='float', default=1.0,
-            help='Scale the playback speed of the log. [Default: %default]')
+            help='Scale the playback speed of the log. A negative rate '
+            'plays the log backwards, from the end time to the start time. '
+            '[Default: %default]')
+    parser.add_option('--ring-duration', dest='ring_duration',
+            action='store', type='float', default=0, help='(Record mode '
+            'only.) Flight recorder mode: keep the last this many seconds of '
+            'data in memory, and write it to a log only when triggered by '
+            'SIGUSR1, a line on standard input or a --trigger condition. '
+            'Each trigger writes a new log file, numbered after the file name '
+            'given by --filename. [Default: %default]')
+    parser.add_option('--ring-size', dest='ring_size', action='store',
+            type='int', default=0, help='(Record mode only.) Flight recorder '
+            'mode: keep at most this many bytes of data in memory. May be '
+            'used with or without --ring-duration. [Default: %default]')
+    parser.add_option('--segment-duration', dest='segment_duration',
+            action='store', type='float', default=0, help='(Record mode '
+            'only.) Split the log into segment files, starting a new segment '
+            'when the current one covers this many seconds. The file name '
+            'given by --filename is used for a manifest listing the '
+            'segments. [Default: %default]')
+    parser.add_option('--segment-size', dest='segment_size', action='store',
+            type='int', default=0, help='(Record mode only.) Split the log '
+            'into segment files, starting a new segment when the current one '
+            'reaches this many bytes. [Default: %default]')
+    parser.add_option('--slice', dest='slice', action='store_true',
+            default=False, help='Copy the entries between --start and --end '
+            'to the log file given as an argument and exit. The entries are '
+            'copied without being decoded. [Default: %default]')
     parser.add_option('-s', '--start', dest='start', action='store',
             type='float', default=None,
             help='Time or entry index to start playback from. Must be within '
             'the bounds of the log. Use --index to specify that this value '
             'is an index. [Default: %default]')
+    parser.add_option('--text-format', dest='text_format', action='store',
+            type='choice', choices=text_log.FORMATS, default=text_log.CSV,
+            help='(Text logger only.) The format to record in: one CSV row '
+            '("csv") or one JSON object ("jsonl") per entry, with the fields '
+            'of the data in separate columns. When reading, the format is '
+            'found from the log. [Default: %default]')
+    parser.add_option('--timed', dest='timed', action='store_true',
+            default=False, help='(Replay mode only.) Publish each entry at '
+            'its own time from a separate thread, rather than when the '
+            'component executes, and print how late the entries were. Not '
+            'used with --ignore-times. [Default: %default]')
     parser.add_option('-t', '--timeout', dest='timeout', action='store',
             type='float', default=None, help='Record/replay data for this '
             'many seconds. This option overrides --start/--end.')
+    parser.add_option('--trigger', dest='triggers', action='append',
+            type='string', default=[], help='(Flight recorder mode only.) '
+            'A condition on the data of a port that triggers writing the '
+            'log, as the port name, a colon, the path of a member of the data '
+            'and a comparison with a value. For example, "battery:data<11.5". '
+            'Triggers when the condition becomes true. May be given more than '
+            'once.')
     parser.add_option('-v', '--verbose', dest='verbose', action='store_true',
             default=False,
             help='Output verbose information. [Default: %default]')
@@ -386,13 +926,22 @@ Record data from output ports, or replay data into input ports.'''
         print('OptionError:', e, file=sys.stderr)
         return 1
 
-    if len(args) < 1 and not options.display_info:
+    if len(args) < 1 and not options.display_info and not options.recover \
+            and not options.export:
         print(usage, file=sys.stderr)
         return 1
 
     try:
         if options.display_info:
             display_info(options)
+        elif options.export:
+            export_log(options)
+        elif options.merge:
+            merge_logs(args, options)
+        elif options.slice:
+            slice_log(args, options)
+        elif options.recover:
+            recover_log(options)
         elif options.play:
             play_log([path.cmd_path_to_full_path(p) for p in args],
                     options, tree)
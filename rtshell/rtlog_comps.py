@@ -24,11 +24,17 @@ import OpenRTM_aist
 import os.path
 import RTC
 import sys
+import threading
 import time
 import traceback
 
+from rtshell import async_log
 from rtshell import gen_comp
 from rtshell import ilog
+from rtshell import log_stats
+from rtshell import loop_log
+from rtshell import prefetch_log
+from rtshell import ring_log
 from rtshell import rts_exceptions
 
 
@@ -37,13 +43,21 @@ from rtshell import rts_exceptions
 
 class Recorder(gen_comp.GenComp):
     def __init__(self, mgr, port_specs, logger_type=None, filename='',
-            lims_are_ind=False, end=-1, verbose=False, *args, **kwargs):
+            lims_are_ind=False, end=-1, verbose=False, logger_opts={},
+            queue_size=0, overflow=async_log.BLOCK, policies={},
+            ring_duration=0, ring_size=0, post_trigger=0, triggers=[], *args,
+            **kwargs):
         if lims_are_ind:
             max = end
             self._end = -1
         else:
             max = -1
             self._end = end
+        # The end time as a timestamp, so it is not converted for every entry
+        if self._end > -1:
+            self._end_ts = ilog.EntryTS(time=self._end)
+        else:
+            self._end_ts = None
         try:
             del kwargs['max']
         except KeyError:
@@ -51,8 +65,21 @@ class Recorder(gen_comp.GenComp):
         gen_comp.GenComp.__init__(self, mgr, port_specs, max=max, *args,
                 **kwargs)
         self._logger_type = logger_type
+        self._logger_opts = logger_opts
+        self._queue_size = queue_size
+        self._overflow = overflow
         self._fn = filename
         self._verb = verbose
+        # Recording policies by port name; ports without one record every
+        # sample
+        self._policies = policies
+        # Flight recorder mode: keep entries in memory until triggered
+        self._ring_duration = ring_duration
+        self._ring_size = ring_size
+        self._post_trigger = post_trigger
+        self._triggers = triggers
+        self._ring = None
+        self._l = None
 
     def onActivated(self, ec_id):
         start = time.time()
@@ -63,24 +90,67 @@ class Recorder(gen_comp.GenComp):
         if not self._fn:
             self._fn = 'rtlog_{0}.rtlog'.format(int(start))
         # Create log, record meta data
-        self._l = self._logger_type(filename=self._fn, mode='w', meta=meta, verbose=self._verb)
+        if self._ring_duration or self._ring_size:
+            # Nothing is written to disk until a trigger
+            self._ring = ring_log.RingLog(self._logger_type, self._fn,
+                    meta=meta, duration=self._ring_duration,
+                    size=self._ring_size, post=self._post_trigger,
+                    conditions=self._triggers, logger_opts=self._logger_opts,
+                    verbose=self._verb)
+            self._l = self._ring
+        else:
+            self._l = self._logger_type(filename=self._fn, mode='w',
+                    meta=meta, verbose=self._verb, **self._logger_opts)
+        if self._queue_size > 0:
+            # Write from a background thread so disk stalls do not delay
+            # reading the ports
+            self._l = async_log.AsyncLog(self._l,
+                    queue_size=self._queue_size, overflow=self._overflow,
+                    verbose=self._verb)
         return RTC.RTC_OK
 
     def onFinalize(self):
         # Finalise and close log
+        if self._l is None:
+            return RTC.RTC_OK
         self._l.close()
+        if self._queue_size > 0:
+            print('{0}: {1} entries queued, {2} written, {3} dropped.'.format(
+                os.path.basename(sys.argv[0]), self._l.queued,
+                self._l.written, self._l.dropped), file=sys.stderr)
+        if self._ring is not None:
+            print('{0}: {1} entries written to {2} files, {3} '
+                    'discarded.'.format(os.path.basename(sys.argv[0]),
+                        self._ring.dumped, len(self._ring.dumps),
+                        self._ring.discarded), file=sys.stderr)
+        for name in sorted(self._policies.keys()):
+            p = self._policies[name]
+            print('{0}: {1} ({2}): {3} samples recorded, {4} skipped.'.format(
+                os.path.basename(sys.argv[0]), name, p, p.kept, p.skipped),
+                file=sys.stderr)
         return RTC.RTC_OK
 
+    def trigger(self, reason=''):
+        '''Write the entries held in memory in flight recorder mode to a
+        log.'''
+        if self._ring is not None:
+            self._ring.trigger(reason)
+
     def _behv(self, ec_id):
         execed = 0
         result = RTC.RTC_OK
         for name in self._ports:
             p = self._ports[name]
             if p.port.isNew():
-                execed += 1
                 p.read()
-                ts = self._log(p, name)
-                if self._end > -1 and ts >= self._end:
+                ts = self._timestamp(p)
+                # Skipped samples are dropped before being written, so cost
+                # no encoding or I/O
+                policy = self._policies.get(name)
+                if policy is None or policy.keep(ts, p.data):
+                    execed += 1
+                    self._l.write(ts, (name, p.data))
+                if self._end > -1 and ts >= self._end_ts:
                     # Reached the end time
                     self._set()
             if self._max > -1 and self._count >= self._max:
@@ -88,13 +158,10 @@ class Recorder(gen_comp.GenComp):
                 return result, execed
         return result, execed
 
-    def _log(self, port, port_name):
+    def _timestamp(self, port):
         if port.standard_type:
-            ts = ilog.EntryTS(sec=port.data.tm.sec, nsec=port.data.tm.nsec)
-        else:
-            ts = ilog.EntryTS(time=time.time())
-        self._l.write(ts, (port_name, port.data))
-        return ts
+            return ilog.EntryTS(sec=port.data.tm.sec, nsec=port.data.tm.nsec)
+        return ilog.EntryTS(time=time.time())
 
 
 ###############################################################################
@@ -103,7 +170,8 @@ class Recorder(gen_comp.GenComp):
 class Player(gen_comp.GenComp):
     def __init__(self, mgr, port_specs, logger_type=None, filename='',
             lims_are_ind=False, start=0, end=-1, scale_rate=1.0, abs_times=False,
-            ignore_times=False, verbose=False, *args, **kwargs):
+            ignore_times=False, verbose=False, logger_opts={}, prefetch=0,
+            prefetch_bytes=0, timed=False, loops=1, *args, **kwargs):
         if end >= 0:
             if lims_are_ind:
                 if start == 0:
@@ -119,6 +187,13 @@ class Player(gen_comp.GenComp):
             max = -1
         self._lims_ind = lims_are_ind
         self._start = start
+        # The index to start from when playing backwards
+        if lims_are_ind:
+            self._end_ind = end
+        else:
+            self._end_ind = -1
+        # The next entry to play backwards
+        self._back = None
         try:
             del kwargs['max']
         except KeyError:
@@ -126,16 +201,32 @@ class Player(gen_comp.GenComp):
         gen_comp.GenComp.__init__(self, mgr, port_specs, max=max, *args,
                 **kwargs)
         self._logger_type = logger_type
+        self._logger_opts = logger_opts
         self._fn = filename
         self._rate = scale_rate
         self._abs = abs_times
         self._ig_times = ignore_times
         self._verb = verbose
+        self._prefetch = prefetch
+        self._prefetch_bytes = prefetch_bytes
+        # Play the range this many times from memory; 0 for forever
+        self._loops = loops
+        # Publish from a thread at the entry times, rather than when executed
+        self._timed = timed and not ignore_times
+        self._timer = None
+        self._stop_timer = threading.Event()
+        self._lateness = log_stats.Lateness()
 
     def onActivated(self, ec_id):
         try:
+            if self._lims_ind:
+                # Entry limits count all entries, so can't skip any
+                channels = None
+            else:
+                channels = list(self._ports.keys())
             self._l = self._logger_type(filename=self._fn, mode='r',
-                    verbose=self._verb)
+                    verbose=self._verb, channels=channels,
+                    **self._logger_opts)
             # Read the metadata block
             start, log_port_specs = self._l.metadata
             self._vprint('Log started at {0}'.format(start))
@@ -167,10 +258,21 @@ class Player(gen_comp.GenComp):
                         file=sys.stderr)
 
             self._start_time = time.time()
+            if self._rate < 0:
+                # Playing backwards, so go to the end of the range instead
+                self._seek_end()
+                if self._back is None:
+                    print('ERROR: No entries to play before the specified '\
+                            'end.', file=sys.stderr)
+                    self._set()
+                    return RTC.RTC_ERROR
+                self._log_start = self._back[1].float
             # Fast-forward to the start time (with a sanity-check)
-            if self._start > 0: # If 0 index, already there; if 0 time... hmm
+            elif self._start > 0: # If 0 index, already there; if 0 time... hmm
+                # The end of a log read from a stream is not known yet
+                end_ind, end_ts = self._l.end
                 if self._lims_ind:
-                    if self._start > self._l.end[0]:
+                    if end_ind is not None and self._start > end_ind:
                         print('ERROR: Specified start index is '\
                                 'after the last entry index.', file=sys.stderr)
                         self._set()
@@ -178,7 +280,7 @@ class Player(gen_comp.GenComp):
                     self._l.seek(index=self._start)
                     self._log_start = self._l.pos[1].float
                 else:
-                    if self._start > self._l.end[1]:
+                    if end_ts is not None and self._start > end_ts:
                         print('ERROR: Specified start time is '\
                                 'after the last entry time.', file=sys.stderr)
                         self._set()
@@ -187,21 +289,76 @@ class Player(gen_comp.GenComp):
                     self._log_start = self._l.pos[1].float
             else:
                 self._log_start = start
+            if self._loops != 1:
+                # Load the range once and play it repeatedly from memory. The
+                # looping log stops at the end of the range itself.
+                if self._end >= 0:
+                    end = self._end
+                else:
+                    end = None
+                self._l = loop_log.LoopLog(self._l, loops=self._loops,
+                        end=end, count=self._max, verbose=self._verb)
+                self._end = -1
+                self._max = -1
+            if self._prefetch > 0 or self._prefetch_bytes > 0:
+                # Decode the entries ahead of time in a background thread
+                self._l = prefetch_log.PrefetchLog(self._l,
+                        buffer_size=self._prefetch,
+                        buffer_bytes=self._prefetch_bytes,
+                        reverse=self._rate < 0, verbose=self._verb)
+                # Filling the buffer takes time, so start the clock after it
+                self._start_time = time.time()
             self._offset = self._start_time - self._log_start
+            # Split the offset once rather than for every entry played
+            self._offset_sec = int(self._offset)
+            self._offset_nsec = int((self._offset % 1) * 1000000000)
+            self._offset_ns = ilog.ts_to_ns(self._start_time) - \
+                    ilog.ts_to_ns(self._log_start)
+            if self._end >= 0:
+                self._end_ts = ilog.EntryTS(time=self._end)
+            else:
+                self._end_ts = None
+            # Times played backwards are mirrored around the start times
+            self._mirror = ilog.ts_to_ns(self._start_time) + \
+                    ilog.ts_to_ns(self._log_start)
             self._vprint('Play start time is {0}, log start time is {1}'.format(
                 self._start_time, self._log_start))
             self._vprint('Time offset is {0}'.format(self._offset))
+            if self._timed:
+                self._stop_timer.clear()
+                self._timer = threading.Thread(target=self._play_timed,
+                        name='rtlog-timed-player')
+                self._timer.daemon = True
+                self._timer.start()
         except:
             traceback.print_exc()
             return RTC.RTC_ERROR
         return RTC.RTC_OK
 
     def onDeactivated(self, ec_id):
+        if self._timer is not None:
+            self._stop_timer.set()
+            self._timer.join()
+            self._timer = None
+            print('{0}: {1} entries played; lateness {2}.'.format(
+                os.path.basename(sys.argv[0]), self._lateness.count,
+                self._lateness), file=sys.stderr)
         # Close log
         self._l.close()
+        if isinstance(self._l, prefetch_log.PrefetchLog):
+            print('{0}: {1} entries decoded ahead, {2} played; {3} '\
+                    'underruns, {4:.3f} s waiting.'.format(
+                        os.path.basename(sys.argv[0]), self._l.decoded,
+                        self._l.taken, self._l.underruns, self._l.wait_time),
+                    file=sys.stderr)
         return RTC.RTC_OK
 
     def _behv(self, ec_id):
+        if self._timed:
+            # The entries are published by the timer thread
+            return RTC.RTC_OK, 0
+        if self._rate < 0:
+            return self._behv_reverse()
         execed = 0
         result = RTC.RTC_OK
         try:
@@ -221,12 +378,15 @@ class Player(gen_comp.GenComp):
                 # Calculate the current time in log-time
                 now = (((time.time() - self._start_time) * self._rate) +
                         self._log_start)
-                self._vprint('Current time in logspace is {0}'.format(now))
+                if self._verb:
+                    self._vprint('Current time in logspace is {0}'.format(now))
                 if self._end >= 0 and now > self._end:
                     self._vprint('Reached end time (current position: '\
                             '{0}).'.format(self._l.pos))
                     self._set()
                     return RTC.RTC_OK, 0
+                # Compare the entry timestamps with integer nanoseconds
+                now = ilog.EntryTS(time=now)
                 # Read until past it - read one at a time to avoid huge memory
                 # spikes if the log contains large-sized data
                 while self._l.pos[1] <= now:
@@ -235,7 +395,8 @@ class Player(gen_comp.GenComp):
                                 'Reached maximum number of results to play.')
                         self._set()
                         break
-                    if self._end >= 0 and self._l.pos[1] > self._end:
+                    if self._end_ts is not None and \
+                            self._l.pos[1] > self._end_ts:
                         self._vprint('Reached end time (current position: '\
                                 '{0}).'.format(self._l.pos))
                         self._set()
@@ -254,19 +415,150 @@ class Player(gen_comp.GenComp):
             return RTC.RTC_ERROR, 0
         return result, execed
 
+    def _behv_reverse(self):
+        '''Play the log backwards.'''
+        execed = 0
+        result = RTC.RTC_OK
+        try:
+            if self._ig_times:
+                limit = None
+            else:
+                # Calculate the current time in log-time, which goes backwards
+                now = (((time.time() - self._start_time) * self._rate) +
+                        self._log_start)
+                if self._verb:
+                    self._vprint('Current time in logspace is {0}'.format(now))
+                limit = ilog.EntryTS(time=max(now, 0))
+            while True:
+                if self._ig_times and execed >= int(-self._rate):
+                    break
+                if self._back is None:
+                    entries = self._l.read_reverse()
+                    if not entries:
+                        print('{0}: Start of log reached.'.format(
+                                os.path.basename(sys.argv[0])),
+                                file=sys.stderr)
+                        self._set()
+                        result = RTC.RTC_ERROR
+                        break
+                    self._back = entries[0]
+                index, ts, entry = self._back
+                if limit is not None and ts < limit:
+                    break
+                if self._max > -1 and execed >= self._max:
+                    self._vprint('Reached maximum number of results to play.')
+                    self._set()
+                    break
+                if (self._lims_ind and index < self._start) or \
+                        (not self._lims_ind and ts < self._start):
+                    self._vprint('Reached start (current position: '\
+                            '{0}).'.format(self._l.pos))
+                    self._set()
+                    break
+                self._publish(ts, entry)
+                self._back = None
+                execed += 1
+        except:
+            traceback.print_exc()
+            return RTC.RTC_ERROR, 0
+        return result, execed
+
+    def _play_timed(self):
+        '''Publish each entry when it is due.
+
+        The time an entry is due is its log time, scaled by the rate and
+        moved to the time playing started. The thread sleeps until then,
+        so entries are published at their own times rather than when the
+        component is executed.
+
+        '''
+        try:
+            while not self._stop_timer.is_set():
+                if self._rate < 0:
+                    if self._back is None:
+                        entries = self._l.read_reverse()
+                    else:
+                        entries = [self._back]
+                        self._back = None
+                else:
+                    entries = self._l.read()
+                if not entries:
+                    print('{0}: End of log reached.'.format(
+                            os.path.basename(sys.argv[0])), file=sys.stderr)
+                    break
+                index, ts, entry = entries[0]
+                if self._rate < 0:
+                    if (self._lims_ind and index < self._start) or \
+                            (not self._lims_ind and ts < self._start):
+                        self._vprint('Reached start.')
+                        break
+                elif self._end_ts is not None and ts > self._end_ts:
+                    self._vprint('Reached end time.')
+                    break
+                due = self._start_time + \
+                        (ts.float - self._log_start) / self._rate
+                # Sleep in short steps so that stopping is not delayed
+                wait = due - time.time()
+                while wait > 0 and not self._stop_timer.is_set():
+                    time.sleep(min(wait, 0.1))
+                    wait = due - time.time()
+                if self._stop_timer.is_set():
+                    return
+                self._publish(ts, entry)
+                self._lateness.add(int(-wait * 1e9))
+                if self._max > -1 and self._lateness.count >= self._max:
+                    self._vprint('Reached maximum number of results to play.')
+                    break
+        except:
+            traceback.print_exc()
+        self._set()
+
     def _pub_log_item(self):
         # Read an item from the log file
         entries = self._l.read()
         if len(entries) == 0:
             return False # End of file
         index, ts, entry = entries[0]
+        self._publish(ts, entry)
+        return True
+
+    def _publish(self, ts, entry):
         p_name, data = entry
         if p_name in self._ports:
             if not self._abs and self._ports[p_name].standard_type:
-                data.tm.sec += int(self._offset)
-                data.tm.nsec += int((self._offset % 1) * 1000000000)
+                if self._loops != 1:
+                    # The log time of a standard type is its recorded time,
+                    # moved forward for each loop
+                    ns = ilog.ts_to_ns(ts) + self._offset_ns
+                    data.tm.sec = ns // 1000000000
+                    data.tm.nsec = ns % 1000000000
+                elif self._rate < 0:
+                    # Keep the times increasing as the log is played backwards
+                    ns = self._mirror - data.tm.sec * 1000000000 - data.tm.nsec
+                    data.tm.sec = ns // 1000000000
+                    data.tm.nsec = ns % 1000000000
+                else:
+                    data.tm.sec += self._offset_sec
+                    data.tm.nsec += self._offset_nsec
             self._ports[p_name].port.write(data)
-        return True
+
+    def _seek_end(self):
+        '''Move to the end of the range to play, and read the last entry of
+        the range ready to play backwards.'''
+        if self._lims_ind and self._end_ind >= 0 and \
+                self._end_ind < self._l.end[0]:
+            self._l.seek(index=self._end_ind + 1)
+        elif not self._lims_ind and self._end >= 0:
+            self._l.seek(timestamp=self._end)
+            # Include the entries at exactly the end time
+            while not self._l.eof and self._l.pos[1] <= self._end:
+                self._l.read()
+        else:
+            self._l.seek(index=self._l.end[0])
+            self._l.read()
+        entries = self._l.read_reverse()
+        if entries:
+            self._back = entries[0]
 
     def _vprint(self, text):
         if self._verb:
@@ -566,6 +566,87 @@ class UnsupportedLogTypeError(RtShellError):
                 self._type, self._feature)
 
 
+class BadFsyncPolicyError(RtShellError):
+    '''An invalid fsync policy was given for a log.'''
+    def __init__(self, policy):
+        self._policy = policy
+
+    def __str__(self):
+        return 'Invalid fsync policy: {0}'.format(self._policy)
+
+
+class NotRtlogLogError(RtShellError):
+    '''A log was not recorded by rtlog.'''
+    def __init__(self, filename):
+        self._fn = filename
+
+    def __str__(self):
+        return 'Log {0} was not recorded by rtlog.'.format(self._fn)
+
+
+class BadPlaybackRateError(RtShellError):
+    '''A playback rate of zero was given.'''
+    def __init__(self, rate):
+        self._rate = rate
+
+    def __str__(self):
+        return 'Invalid playback rate: {0}'.format(self._rate)
+
+
+class BadLoopCountError(RtShellError):
+    '''An invalid number of loops was given.'''
+    def __init__(self, count):
+        self._count = count
+
+    def __str__(self):
+        return 'Invalid loop count: {0}'.format(self._count)
+
+
+class ReverseLoopError(RtShellError):
+    '''Looping playback was requested in reverse.'''
+    def __str__(self):
+        return 'Looping playback cannot be played in reverse.'
+
+
+class BadRecordPolicyError(RtShellError):
+    '''An invalid recording policy was given.'''
+    def __init__(self, policy):
+        self._policy = policy
+
+    def __str__(self):
+        return 'Invalid recording policy: {0}'.format(self._policy)
+
+
+class PolicyChannelError(RtShellError):
+    '''A recording policy was given for a channel that is not recorded, or
+    more than one was given for a channel.'''
+    def __init__(self, name):
+        self._name = name
+
+    def __str__(self):
+        return 'Recording policy for channel {0} does not match exactly one ' \
+                'recorded port.'.format(self._name)
+
+
+class BadTriggerError(RtShellError):
+    '''An invalid trigger condition was given.'''
+    def __init__(self, trigger):
+        self._trigger = trigger
+
+    def __str__(self):
+        return 'Invalid trigger condition: {0}'.format(self._trigger)
+
+
+class TriggerChannelError(RtShellError):
+    '''A trigger condition was given for a channel that is not recorded.'''
+    def __init__(self, name):
+        self._name = name
+
+    def __str__(self):
+        return 'Trigger condition for channel {0} does not match exactly ' \
+                'one recorded port.'.format(self._name)
+
+
 class NoLogFileNameError(RtShellError):
     '''An expected file name was not provided.'''
     def __str__(self):
@@ -0,0 +1,477 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Log split into segment files.
+
+'''
+
+
+import base64
+import bisect
+import json
+import os
+import os.path
+import pickle
+
+from rtshell import cdr_log
+from rtshell import chunked_log
+from rtshell import framed_log
+from rtshell import ilog
+from rtshell import simpkl_log
+
+
+###############################################################################
+## Segmented log format
+##
+## A segmented log is a set of ordinary log files (the segments) and a
+## manifest. The manifest is a JSON file with the log's own file name. It
+## records the type of log used for the segments, the pickled metadata, and
+## for each segment its file name (relative to the manifest), the index of its
+## first entry, its number of entries, the timestamps of its first and last
+## entries and its latest timestamp (in nanoseconds), and whether it has been
+## closed. Each segment's entries are indexed from zero; the manifest gives
+## their place in the whole log.
+##
+## The manifest is rewritten each time a new segment is started and when the
+## log is closed.
+
+FORMAT = 'rtlog-segments'
+VERSION = 1
+# The manifest's keys are sorted, so the format is near its start
+PREFIX_SIZE = 4096
+
+LOG_TYPES = {
+        'simpkl': simpkl_log.SimplePickleLog,
+        'framed': framed_log.FramedLog,
+        'cdr': cdr_log.CdrLog,
+        'chunked': chunked_log.ChunkedLog,
+        }
+
+
+def is_manifest(filename):
+    '''Check if a file is the manifest of a segmented log.'''
+    try:
+        with open(filename, 'rb') as f:
+            # Only read the whole file if it looks like a manifest, as other
+            # logs (JSON Lines text logs, for example) may be large
+            prefix = f.read(PREFIX_SIZE)
+            if not prefix.startswith(b'{') or \
+                    json.dumps(FORMAT).encode('utf-8') not in prefix:
+                return False
+            manifest = json.loads((prefix + f.read()).decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return False
+    return type(manifest) == dict and manifest.get('format') == FORMAT
+
+
+def segment_file_name(filename, number):
+    '''Get the file name of a segment of a log.
+
+    The segment number is placed before the extension, so segment 3 of
+    "day.rtlog" is "day.0003.rtlog".
+
+    '''
+    root, ext = os.path.splitext(filename)
+    return '{0}.{1:04d}{2}'.format(root, number, ext)
+
+
+###############################################################################
+## Segment information
+
+class Segment(object):
+    def __init__(self, filename, first_ind=0, count=0, first_ts=0, last_ts=0,
+            max_ts=0, complete=False):
+        super(Segment, self).__init__()
+        self.filename = filename
+        self.first_ind = first_ind
+        self.count = count
+        self.first_ts = first_ts
+        self.last_ts = last_ts
+        self.max_ts = max_ts
+        self.complete = complete
+
+    def __str__(self):
+        return 'Segment {0}: {1} entries from index {2}, time {3} to ' \
+                '{4}'.format(self.filename, self.count, self.first_ind,
+                        self.first_ts, self.last_ts)
+
+    @property
+    def end_ind(self):
+        '''The index after the last entry in the segment.'''
+        return self.first_ind + self.count
+
+    def to_dict(self):
+        return {'file': self.filename, 'first_index': self.first_ind,
+                'count': self.count, 'first_ts': self.first_ts,
+                'last_ts': self.last_ts, 'max_ts': self.max_ts,
+                'complete': self.complete}
+
+    @staticmethod
+    def from_dict(d):
+        return Segment(d['file'], d['first_index'], d['count'], d['first_ts'],
+                d['last_ts'], d['max_ts'], d['complete'])
+
+
+###############################################################################
+## Segmented log object.
+##
+## In write mode, a new segment is started when the current one reaches a
+## size or covers a duration of log time. In read mode, the segments are
+## read as one continuous log. A segment is only opened when an entry in it
+## is read, so seeking and reading part of a log do not touch the segments
+## outside that part.
+
+class SegmentedLog(ilog.Log):
+    def __init__(self, filename='', logger_type=simpkl_log.SimplePickleLog,
+            segment_size=0, segment_duration=0, mode='r', meta=None,
+            verbose=False, *args, **kwargs):
+        '''Constructor.
+
+        Other keyword arguments are passed to the log of each segment.
+
+        @param filename The name of the manifest file.
+        @param logger_type The log type used for the segments when writing.
+                           When reading, the type is read from the manifest.
+        @param segment_size Start a new segment when the current one reaches
+                            this many bytes. 0 for no limit.
+        @param segment_duration Start a new segment when the current one
+                                covers this many seconds of log time. 0 for
+                                no limit.
+
+        '''
+        self._is_open = False
+        if mode == 'w' and logger_type not in LOG_TYPES.values():
+            raise ValueError('Unsupported segment log type: {0}'.format(
+                logger_type))
+        self._fn = filename
+        self._dir = os.path.dirname(filename)
+        self._type = logger_type
+        self._seg_size = segment_size
+        self._seg_dur = int(segment_duration * 1000000000)
+        self._seg_opts = kwargs
+        self._segs = []
+        self._max_ts = []
+        self._seg_no = 0
+        self._seg = None
+        self._incomplete = []
+        self._write_ind = 0
+        super(SegmentedLog, self).__init__(mode=mode, meta=meta,
+                verbose=verbose, *args)
+
+    def __str__(self):
+        return 'SegmentedLog({0}, {1}) at position {2}.'.format(self._fn,
+                self._mode, self.pos)
+
+    @property
+    def segments(self):
+        '''The segments of the log.'''
+        return list(self._segs)
+
+    def recover(self):
+        '''Finish the manifest of a log whose recorder was not closed.
+
+        Segments that were not closed are repaired if their log type
+        supports it.
+
+        Returns True if the log needed repairing.
+
+        '''
+        if self._mode != 'r':
+            raise NotImplementedError
+        if not self._incomplete:
+            return False
+        for s in self._incomplete:
+            if s.count == 0:
+                # Not listed in the new manifest
+                continue
+            self._vb_print('Repairing segment {0}.'.format(s.filename))
+            log = self._open_log(s)
+            try:
+                if hasattr(log, 'recover'):
+                    log.recover()
+            finally:
+                log.close()
+            s.complete = True
+        self._incomplete = []
+        self._write_manifest()
+        return True
+
+    def read(self, timestamp=None, number=None):
+        if number is not None and number < 0:
+            raise ValueError
+        if timestamp is not None:
+            if timestamp < 0:
+                raise ValueError
+            limit = ilog.ts_to_ns(timestamp)
+        res = []
+        while self._seg_no < len(self._segs):
+            s = self._segs[self._seg_no]
+            if self._seg is None and timestamp is not None and \
+                    s.first_ts > limit:
+                # Do not open the next segment until it is needed
+                break
+            seg = self._open_segment()
+            if number is not None:
+                got = seg.read(number=number - len(res))
+            elif timestamp is not None:
+                got = seg.read(timestamp=timestamp)
+            else:
+                got = seg.read()
+            res += [(s.first_ind + i, ts, d) for i, ts, d in got]
+            if not seg.eof or not self._next_segment():
+                break
+            if number is not None and len(res) >= number:
+                break
+            if number is None and timestamp is None and res:
+                break
+        return res
+
+    def rewind(self):
+        self._vb_print('Rewinding log.')
+        self._move_to(0)
+
+    def seek(self, timestamp=None, index=None):
+        if not self._segs:
+            return
+        if index is not None:
+            if index < 0:
+                raise ilog.InvalidIndexError
+            if index >= self._segs[-1].end_ind:
+                self._seek_end()
+                return
+            n = bisect.bisect_right([s.first_ind for s in self._segs],
+                    index) - 1
+            self._move_to(n)
+            if index > self._segs[n].first_ind:
+                self._open_segment().seek(
+                        index=index - self._segs[n].first_ind)
+        elif timestamp is not None:
+            target = ilog.ts_to_ns(timestamp)
+            n = bisect.bisect_left(self._max_ts, target)
+            if n == len(self._segs):
+                self._seek_end()
+                return
+            self._move_to(n)
+            if target > self._segs[n].first_ts:
+                self._open_segment().seek(timestamp=timestamp)
+        self._vb_print('New current position: {0}.'.format(self.pos))
+
+    def write(self, timestamp, data):
+        ts = ilog.ts_to_ns(timestamp)
+        s = self._segs[-1]
+        if s.count > 0 and self._need_new_segment(s, ts):
+            self._new_segment()
+            s = self._segs[-1]
+        self._seg.write(timestamp, data)
+        if s.count == 0:
+            s.first_ts = ts
+            s.max_ts = ts
+        s.count += 1
+        s.last_ts = ts
+        if ts > s.max_ts:
+            s.max_ts = ts
+        self._write_ind += 1
+
+    def _add_segment(self, s):
+        self._segs.append(s)
+        if self._max_ts and self._max_ts[-1] > s.max_ts:
+            self._max_ts.append(self._max_ts[-1])
+        else:
+            self._max_ts.append(s.max_ts)
+
+    def _backup_one(self):
+        '''Reverses in the log one entry.'''
+        if self._seg is not None and self._seg.pos[0] > 0:
+            self._seg._backup_one()
+        elif self._seg_no > 0:
+            # Move to the last entry of the previous segment
+            self._move_to(self._seg_no - 1)
+            self._open_segment().seek(
+                    index=self._segs[self._seg_no].count - 1)
+        self._vb_print('New current position: {0}.'.format(self.pos))
+
+    def _close(self):
+        if not self._is_open:
+            return
+        if self._seg is not None:
+            self._seg.close()
+            self._seg = None
+        if self._mode == 'w':
+            self._segs[-1].complete = True
+            self._write_manifest()
+        self._is_open = False
+        self._vb_print('Closed log.')
+
+    def _eof(self):
+        if not self._segs:
+            return True
+        return self._seg_no == len(self._segs) - 1 and \
+                self._seg is not None and self._seg.eof
+
+    def _get_cur_pos(self):
+        if self._mode == 'w':
+            return self._write_ind, -1
+        if not self._segs:
+            return 0, None
+        s = self._segs[self._seg_no]
+        if self._seg is None:
+            return s.first_ind, self._ns_to_ts(s.first_ts)
+        index, ts = self._seg.pos
+        return s.first_ind + index, ts
+
+    def _get_end(self):
+        if not self._segs:
+            return -1, None
+        last = self._segs[-1]
+        return last.end_ind - 1, self._ns_to_ts(last.last_ts)
+
+    def _get_start(self):
+        if not self._segs:
+            return 0, None
+        return 0, self._ns_to_ts(self._segs[0].first_ts)
+
+    def _load_manifest(self):
+        with open(self._fn, 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+        if manifest.get('format') != FORMAT or \
+                manifest.get('version') != VERSION:
+            raise ValueError('Not a segmented log manifest: {0}'.format(
+                self._fn))
+        if manifest['logger'] not in LOG_TYPES:
+            raise ValueError('Unsupported segment log type: {0}'.format(
+                manifest['logger']))
+        self._type = LOG_TYPES[manifest['logger']]
+        self._meta = pickle.loads(base64.b64decode(
+            manifest['meta'].encode('ascii')))
+        self._incomplete = []
+        for d in manifest['segments']:
+            s = Segment.from_dict(d)
+            if not s.complete:
+                self._vb_print('Segment {0} was not closed.'.format(
+                    s.filename))
+                self._measure_segment(s)
+                self._incomplete.append(s)
+            if s.count > 0:
+                self._add_segment(s)
+        self._vb_print('Loaded manifest with {0} segments.'.format(
+            len(self._segs)))
+
+    def _measure_segment(self, s):
+        '''Get the entries of a segment that was not closed from the segment.
+
+        The latest timestamp is estimated from the first and last entries.
+
+        '''
+        try:
+            log = self._open_log(s)
+        except Exception:
+            self._vb_print('Could not open segment {0}.'.format(s.filename))
+            s.count = 0
+            return
+        try:
+            end_ind, end_ts = log.end
+            s.count = end_ind + 1
+            if s.count > 0:
+                s.first_ts = ilog.ts_to_ns(log.start[1])
+                s.last_ts = ilog.ts_to_ns(end_ts)
+                s.max_ts = max(s.first_ts, s.last_ts)
+        finally:
+            log.close()
+
+    def _move_to(self, n):
+        '''Move to the first entry of a segment.'''
+        if n == self._seg_no and self._seg is not None:
+            self._seg.rewind()
+            return
+        if self._seg is not None:
+            self._seg.close()
+            self._seg = None
+        self._seg_no = n
+
+    def _need_new_segment(self, s, ts):
+        if self._seg_size > 0 and self._seg._file.tell() >= self._seg_size:
+            return True
+        if self._seg_dur > 0 and ts - s.first_ts >= self._seg_dur:
+            return True
+        return False
+
+    def _new_segment(self):
+        if self._seg is not None:
+            self._seg.close()
+            self._segs[-1].complete = True
+        fn = segment_file_name(os.path.basename(self._fn), len(self._segs))
+        s = Segment(fn, first_ind=self._write_ind)
+        self._seg = self._open_log(s)
+        self._segs.append(s)
+        self._write_manifest()
+        self._vb_print('Started segment {0}.'.format(fn))
+
+    def _next_segment(self):
+        '''Move to the next segment, if there is one.'''
+        if self._seg_no >= len(self._segs) - 1:
+            return False
+        self._move_to(self._seg_no + 1)
+        return True
+
+    def _ns_to_ts(self, ns):
+        return ilog.EntryTS(sec=ns // 1000000000, nsec=ns % 1000000000)
+
+    def _open(self):
+        if self._is_open:
+            return
+        if self._mode == 'r':
+            self._load_manifest()
+        elif self._mode == 'w':
+            self._new_segment()
+        else:
+            raise NotImplementedError
+        self._is_open = True
+        self._vb_print('Opened log {0} in mode {1}.'.format(self._fn,
+            self._mode))
+
+    def _open_log(self, s):
+        return self._type(filename=os.path.join(self._dir, s.filename),
+                mode=self._mode, meta=self._meta, verbose=self._vb,
+                **self._seg_opts)
+
+    def _open_segment(self):
+        if self._seg is None:
+            self._seg = self._open_log(self._segs[self._seg_no])
+        return self._seg
+
+    def _seek_end(self):
+        self._move_to(len(self._segs) - 1)
+        self._open_segment().seek(index=self._segs[-1].count)
+
+    def _write_manifest(self):
+        names = dict([(v, k) for k, v in LOG_TYPES.items()])
+        manifest = {'format': FORMAT, 'version': VERSION,
+                'logger': names[self._type],
+                'meta': base64.b64encode(pickle.dumps(self._meta,
+                    pickle.HIGHEST_PROTOCOL)).decode('ascii'),
+                'segments': [s.to_dict() for s in self._segs]}
+        # Replace the manifest in one step so it is never partly written
+        tmp = self._fn + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        if hasattr(os, 'replace'):
+            os.replace(tmp, self._fn)
+        else:
+            if os.path.exists(self._fn) and os.name == 'nt':
+                os.remove(self._fn)
+            os.rename(tmp, self._fn)
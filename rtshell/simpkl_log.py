@@ -19,25 +19,42 @@ Pickle-based log.
 '''
 
 
+import bisect
 import copy
 import os
 import pickle
+import struct
+import time
 import traceback
 
 from rtshell import ilog
+from rtshell import log_index
+from rtshell import log_io
+from rtshell import record_policy
+
+
+# Seconds between checkpoints while recording
+DEFAULT_CHECKPOINT_INTERVAL = 1.0
 
 
 ###############################################################################
 ## Current position pointer
 
 class CurPos(object):
-    def __init__(self, index=0, timestamp=0, prev_pos=0, cache=0, file_pos=0):
+    # True if entries may be delta entries. Logs written before delta
+    # encoding was added do not store this.
+    delta = False
+
+    def __init__(self, index=0, timestamp=0, prev_pos=0, cache=0, file_pos=0,
+            delta=False):
         super(CurPos, self).__init__()
         self.index = index
         self.ts = timestamp
         self.prev = prev_pos
         self.cache = cache
         self.fp = file_pos
+        if delta:
+            self.delta = delta
 
     def __str__(self):
         return 'Index: {0}, timestamp: {1}, previous position: {2}, cache '\
@@ -45,6 +62,128 @@ class CurPos(object):
                         self.prev, self.cache, self.fp)
 
 
+class Checkpoint(CurPos):
+    '''An end position written while the log is still being recorded.'''
+    pass
+
+
+###############################################################################
+## Delta encoding
+##
+## When a keyframe interval is given, the data of each channel is stored in
+## full only once every keyframe-interval entries of the channel, or when it
+## changes too much. These entries are the channel's keyframes. The entries in
+## between are delta entries, which have a sixth field: the number of entries
+## back to the channel's last keyframe. In place of the data, a delta entry
+## stores a dictionary of the members of the data that differ from the
+## keyframe's, or None if the data is the same as the keyframe's. A value that
+## does not change therefore costs little more than the entry's index and time
+## stamp.
+##
+## An entry's data is rebuilt from its own changes and its keyframe only, so
+## seeking to any entry reads at most one other entry. The keyframes are found
+## using the index, or by stepping back through the entries if there is none.
+##
+## The channel of an entry is the port name when the data is a tuple of (port
+## name, value), as recorded by rtlog. For other data, the whole log is one
+## channel. Only the members of structures are compared; any other value is
+## stored in a delta entry only if it is the same as the keyframe's.
+
+def _channel_value(data):
+    '''Split the data of an entry into its channel and its value.'''
+    if type(data) is tuple and len(data) == 2 and isinstance(data[0], str):
+        return data[0], data[1]
+    return None, data
+
+
+###############################################################################
+## Rewriting of pickled entries
+##
+## When copying entries between logs, only the index, file position and
+## previous position fields of each entry change. Rather than unpickling and
+## pickling the whole entry, the opcodes of those integers are found in the
+## raw pickle and replaced with opcodes of the same length. The integers are
+## pickled (for protocol 2 and above) as one of BININT1 ('K'), BININT2 ('M'),
+## BININT ('J') or LONG1 ('\x8a'), and an entry is pickled as PROTO, an
+## optional FRAME, MARK, the five fields, TUPLE, a memo opcode and STOP. A
+## delta entry has a sixth field after the previous position.
+
+def _pickled_int(value):
+    '''Get the opcode pickle writes for an integer.'''
+    if 0 <= value <= 0xff:
+        return b'K' + struct.pack('<B', value)
+    elif 0 <= value <= 0xffff:
+        return b'M' + struct.pack('<H', value)
+    elif -0x80000000 <= value <= 0x7fffffff:
+        return b'J' + struct.pack('<i', value)
+    data = pickle.encode_long(value)
+    if len(data) < 256:
+        return b'\x8a' + struct.pack('<B', len(data)) + data
+    return b'\x8b' + struct.pack('<i', len(data)) + data
+
+
+def _pickled_int_as(value, length):
+    '''Get an opcode of a given length for an integer.
+
+    Returns None if the integer cannot be written in that length.
+
+    '''
+    if length == 2 and 0 <= value <= 0xff:
+        return b'K' + struct.pack('<B', value)
+    elif length == 3 and 0 <= value <= 0xffff:
+        return b'M' + struct.pack('<H', value)
+    elif length == 5 and -0x80000000 <= value <= 0x7fffffff:
+        return b'J' + struct.pack('<i', value)
+    elif 3 <= length < 258:
+        n = length - 2
+        if not -(1 << (8 * n - 1)) <= value < (1 << (8 * n - 1)):
+            return None
+        return b'\x8a' + struct.pack('<B', n) + bytes(bytearray(
+            [(value >> (8 * ii)) & 0xff for ii in range(n)]))
+    return None
+
+
+def _rewrite_entry(raw, old, new, back=None):
+    '''Replace the index, file position and previous position of a pickled
+    entry.
+
+    @param raw The pickled entry.
+    @param old The (index, file position, previous position) in the entry.
+    @param new The new (index, file position, previous position).
+    @param back The distance to the keyframe if the entry is a delta entry.
+    @return The rewritten entry, the same length as the original, or None
+            if the entry is not laid out as expected.
+
+    '''
+    if raw[0:1] != b'\x80':
+        return None
+    pos = 2
+    if raw[pos:pos + 1] == b'\x95': # FRAME
+        pos += 9
+    if raw[pos:pos + 1] != b'(': # MARK
+        return None
+    pos += 1
+    old_ind = _pickled_int(old[0])
+    if raw[pos:pos + len(old_ind)] != old_ind:
+        return None
+    old_tail = _pickled_int(old[1]) + _pickled_int(old[2])
+    end = b't'
+    if back is not None:
+        end = _pickled_int(back) + end
+    # TUPLE, the memo opcode (at most 5 bytes) and STOP follow the fields
+    tail = raw.rfind(old_tail + end,
+            max(pos, len(raw) - len(old_tail) - len(end) - 7))
+    if tail < 0:
+        return None
+    new_ind = _pickled_int_as(new[0], len(old_ind))
+    new_fp = _pickled_int_as(new[1], len(_pickled_int(old[1])))
+    new_prev = _pickled_int_as(new[2], len(_pickled_int(old[2])))
+    if new_ind is None or new_fp is None or new_prev is None:
+        return None
+    return raw[:pos] + new_ind + raw[pos + len(old_ind):tail] + new_fp + \
+            new_prev + raw[tail + len(old_tail):]
+
+
 ###############################################################################
 ## Simple pickle-based log object. Its support for the full log interface
 ## is rudimentary and slow (although writing and simple reading should be fast
@@ -53,6 +192,22 @@ class CurPos(object):
 ## The simple pickle-based format is as follows (each entry is serialised):
 ## Port specification (in the metadata block)
 ## [Data entries: (Index, Time stamp, Data)]
+##
+## An index of the file offset of each entry is written alongside the log (see
+## log_index). If it is missing or out of date when the log is read, it is
+## rebuilt the first time it is needed.
+##
+## While recording, the position of the last entry is periodically written
+## into the space reserved for the end position as a Checkpoint. If the
+## recorder does not close the log, readers find the real end by scanning
+## forward from the checkpoint, and recover() can repair the file.
+##
+## In read mode the log can optionally be memory-mapped. Entries are then
+## unpickled directly from the mapped file, using the index to find where each
+## one ends, and every log object reading the same file shares one map.
+##
+## If the log is written with a keyframe interval, entries may be delta
+## entries (see above). Their data is rebuilt when it is read.
 
 class SimplePickleLog(ilog.Log):
     # Indices in data entries for bits of data
@@ -61,12 +216,38 @@ class SimplePickleLog(ilog.Log):
     DATA = 2
     FP = 3
     PREV = 4
+    BACK = 5
     # Spare space at the start for pointers
     BUFFER_SIZE = 256
 
-    def __init__(self, filename='', *args, **kwargs):
+    def __init__(self, filename='', index=True, mmap=False,
+            buffer_size=log_io.DEFAULT_BUFFER_SIZE, flush_interval=None,
+            fsync=log_io.FSYNC_NEVER,
+            checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+            keyframe_interval=0, *args, **kwargs):
         self._is_open = False
+        if keyframe_interval < 0:
+            raise ValueError('Keyframe interval must not be negative')
+        self._keyframe_interval = keyframe_interval
+        # Per channel, [index, entries since, value] of the last keyframe
+        self._keyframes = {}
+        # Pickled data of the last keyframe read of each channel
+        self._key_cache = {}
+        self._key_chans = {}
+        self._policy = log_io.WritePolicy(buffer_size=buffer_size,
+                flush_interval=flush_interval, fsync=fsync)
+        self._cp_interval = checkpoint_interval
+        self._last_cp = 0
+        self._recovered = False
+        self._data_end = None
+        self._tail = None
         self._fn = filename
+        self._use_index = index
+        self._index = None
+        self._idx_writer = None
+        self._use_mmap = mmap
+        self._data_start = None
+        self._next_rec = 0
         self._cur_pos = CurPos()
         self._start = None
         self._end = None
@@ -79,14 +260,33 @@ class SimplePickleLog(ilog.Log):
         return 'SimplePickleLog({0}, {1}) at position {2}.'.format(self._fn,
                 self._mode, self._cur_pos)
 
+    @property
+    def keyframe_interval(self):
+        '''The number of entries of each channel between keyframes. 0 if the
+        data of every entry is stored in full.'''
+        return self._keyframe_interval
+
+    @property
+    def recovered(self):
+        '''True if the log was not closed and its end had to be found.'''
+        return self._recovered
+
     def write(self, timestamp, data):
+        back = None
+        if self._keyframe_interval:
+            data, back = self._encode(data)
         val = (self._write_ind, timestamp, data, self._file.tell(), self._prev_pos)
+        if back is not None:
+            val += (back,)
         # Track the start of the last entry for later writing at the file start
         self._cur_pos.ts = timestamp
         self._end = copy.copy(self._cur_pos)
         # Record the new "previous" position before writing
         self._prev_pos = self._file.tell()
         self._write(val)
+        if self._idx_writer:
+            self._idx_writer.append(val[self.INDEX], ilog.ts_to_ns(timestamp),
+                    val[self.FP])
         # Update the current position to after the new final record
         self._cur_pos.index = val[self.INDEX] + 1
         self._cur_pos.ts = -1
@@ -94,8 +294,15 @@ class SimplePickleLog(ilog.Log):
         self._cur_pos.cache = self._prev_pos
         self._cur_pos.fp = self._file.tell()
         self._write_ind += 1
-        self._vb_print('Wrote entry at ({0}, {1}, {2}, {3}).'.format(
-            val[self.INDEX], val[self.TS], val[self.FP], val[self.PREV]))
+        if self._cp_interval:
+            now = time.time()
+            if now - self._last_cp >= self._cp_interval:
+                self._write_checkpoint()
+                self._last_cp = now
+        self._policy.entry_written(self._file)
+        if self._vb:
+            self._vb_print('Wrote entry at ({0}, {1}, {2}, {3}).'.format(
+                val[self.INDEX], val[self.TS], val[self.FP], val[self.PREV]))
 
     def read(self, timestamp=None, number=None):
         if number is not None:
@@ -105,6 +312,91 @@ class SimplePickleLog(ilog.Log):
         else:
             return self._read_single_entry()
 
+    def read_reverse(self, number=1):
+        '''Read entries backwards from the current position.
+
+        Each entry stores the file position of the entry before it, so
+        stepping back one entry unpickles only that entry, the same as
+        stepping forward.
+
+        '''
+        self._vb_print('Reading {0} entries in reverse.'.format(number))
+        res = []
+        for ii in range(number):
+            if self._cur_pos.index == 0:
+                self._vb_print('Reverse reading reached the start.')
+                break
+            fp = self._cur_pos.prev
+            self._file.seek(fp)
+            self._next = self._read()
+            res.append((self._next[self.INDEX], self._next[self.TS],
+                self._data(self._next)))
+            self._cur_pos = CurPos(self._next[self.INDEX],
+                    self._next[self.TS], self._next[self.PREV], fp,
+                    self._file.tell())
+        if self._vb:
+            self._vb_print('Finished reading in reverse; current position '
+                    'is {0}.'.format(self._cur_pos))
+        return res
+
+    def rebuild_index(self):
+        '''Rebuild the entry index by reading through the log once.
+
+        The new index is saved alongside the log if possible.
+
+        '''
+        self._vb_print('Rebuilding index of log {0}.'.format(self._fn))
+        index = log_index.LogIndex()
+        current = self._file.tell()
+        self._file.seek(self._data_start)
+        while True:
+            offset = self._file.tell()
+            try:
+                entry = self._read()
+            except ilog.EndOfLogError:
+                break
+            index.append(entry[self.INDEX], ilog.ts_to_ns(entry[self.TS]),
+                    offset)
+        self._file.seek(current)
+        try:
+            index.save(log_index.index_file_name(self._fn))
+        except (IOError, OSError):
+            self._vb_print('Could not save the rebuilt index.')
+        self._index = index
+        return index
+
+    def recover(self):
+        '''Repair a log that was not closed, so it can be read normally.
+
+        Any incomplete entry after the last complete entry is removed, the
+        end position is written, and the index is brought up to date. The log
+        stays open for reading.
+
+        Returns True if the log needed repairing.
+
+        '''
+        if self._mode != 'r':
+            raise NotImplementedError
+        if not self._recovered:
+            return False
+        self._vb_print('Repairing log {0}.'.format(self._fn))
+        index = self._get_index()
+        with open(self._fn, 'r+b') as f:
+            f.truncate(self._data_end)
+            f.seek(self._buf_start)
+            pickle.dump(self._end, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        self._vb_print('Wrote end pointer: {0}'.format(self._end))
+        if index is not None:
+            try:
+                index.save(log_index.index_file_name(self._fn))
+            except (IOError, OSError):
+                self._vb_print('Could not save the index.')
+        self._recovered = False
+        self._tail = None
+        return True
+
     def rewind(self):
         self._vb_print('Rewinding log from position {0}.'.format(
                 self._cur_pos))
@@ -124,6 +416,114 @@ class SimplePickleLog(ilog.Log):
         # Do nothing if neither is set
         self._vb_print('New current position: {0}.'.format(self._cur_pos))
 
+    def slice(self, filename, start=None, end=None, index=False):
+        '''Copy a range of entries to a new log.
+
+        The entries are copied without being unpickled. Only the index and
+        position fields of each entry are rewritten, so copying runs at close
+        to the speed of the disk. An entry that cannot be rewritten in place
+        is unpickled and pickled again. An index is written for the new log.
+
+        If the log is delta encoded, the entries are unpickled to find those
+        whose keyframes are before the first entry copied. Their data is
+        rebuilt and stored in full.
+
+        @param filename The name of the new log file.
+        @param start The time or entry index of the first entry to copy. None
+                     to copy from the first entry.
+        @param end The time or entry index of the last entry to copy. None to
+                   copy to the last entry.
+        @param index Treat start and end as entry indices.
+        @return The number of entries copied.
+
+        '''
+        if self._mode != 'r':
+            raise NotImplementedError
+        idx = self._get_index()
+        if idx is None:
+            idx = self.rebuild_index()
+        if start is None:
+            first = 0
+        elif index:
+            first = idx.find_index(start)
+        else:
+            first = idx.find_timestamp(ilog.ts_to_ns(start))
+        if first is None:
+            first = len(idx)
+        if end is None:
+            last = len(idx) - 1
+        else:
+            if index:
+                after = idx.find_index(end + 1)
+            else:
+                after = idx.find_timestamp(ilog.ts_to_ns(end) + 1)
+            last = (len(idx) if after is None else after) - 1
+        self._vb_print('Copying entries {0} to {1} of {2} to {3}.'.format(
+            first, last, self._fn, filename))
+        if self._data_end is not None:
+            data_end = self._data_end
+        else:
+            data_end = os.path.getsize(self._fn)
+        result = None
+        rewritten = 0
+        rebuilt = 0
+        with open(self._fn, 'rb') as src:
+            with open(filename, 'wb') as dst:
+                with log_index.IndexWriter(
+                        log_index.index_file_name(filename)) as idx_writer:
+                    # The metadata is copied as is
+                    dst.write(src.read(self._buf_start))
+                    dst.write(b''.ljust(self.BUFFER_SIZE))
+                    prev = 0
+                    for pos in range(first, last + 1):
+                        old_ind, ts_ns, old_fp = idx.entry(pos)
+                        if pos + 1 < len(idx):
+                            length = idx.offset(pos + 1) - old_fp
+                        else:
+                            length = data_end - old_fp
+                        src.seek(old_fp)
+                        raw = src.read(length)
+                        fp = dst.tell()
+                        new = (pos - first, fp, prev)
+                        old_prev = idx.offset(pos - 1) if pos > 0 else 0
+                        entry = None
+                        back = None
+                        if self._end.delta:
+                            entry = pickle.loads(raw)
+                            if len(entry) > self.BACK:
+                                back = entry[self.BACK]
+                        if back is not None and back > pos - first:
+                            # The keyframe is not being copied
+                            entry = entry[:2] + (self._data(entry),) + \
+                                    entry[3:self.BACK]
+                            data = None
+                            rebuilt += 1
+                        else:
+                            data = _rewrite_entry(raw,
+                                    (old_ind, old_fp, old_prev), new, back)
+                        if data is None or pos == last:
+                            if entry is None:
+                                entry = pickle.loads(raw)
+                            result = CurPos(new[0], entry[self.TS], prev,
+                                    prev, fp, delta=self._end.delta)
+                        if data is None:
+                            data = pickle.dumps(new[:1] + entry[1:3] +
+                                    new[1:] + entry[self.BACK:],
+                                    pickle.HIGHEST_PROTOCOL)
+                        else:
+                            rewritten += 1
+                        dst.write(data)
+                        idx_writer.append(new[0], ts_ns, fp)
+                        prev = fp
+                    if result is None:
+                        result = CurPos(delta=self._end.delta)
+                    dst.seek(self._buf_start)
+                    pickle.dump(result, dst, pickle.HIGHEST_PROTOCOL)
+        count = max(last - first + 1, 0)
+        self._vb_print('Copied {0} entries; {1} rewritten in place, {2} '
+                'rebuilt from keyframes.'.format(count, rewritten, rebuilt))
+        return count
+
     def _backup_one(self):
         '''Reverses in the log one entry.'''
         self._vb_print('Backing up one entry from {0}.'.format(self._cur_pos))
@@ -138,7 +538,10 @@ class SimplePickleLog(ilog.Log):
             self._file.seek(target)
             # Update the next pointer
             self._next = self._read()
-            self._update_cur_pos(self._next)
+            # The cached entry starts at the target, not the old position
+            self._cur_pos = CurPos(self._next[self.INDEX],
+                    self._next[self.TS], self._next[self.PREV], target,
+                    self._file.tell())
         self._vb_print('New current position: {0}.'.format(self._cur_pos))
 
     def _close(self):
@@ -150,27 +553,137 @@ class SimplePickleLog(ilog.Log):
             self._file.seek(self._buf_start) # Skip the meta data
             self._write(self._end)
             self._vb_print('Wrote end pointer: {0}'.format(self._end))
+            if self._idx_writer:
+                self._idx_writer.close()
+                self._idx_writer = None
+            self._policy.closing(self._file)
             self._file.close()
             self._is_open = False
             self._start = None
             self._end = None
             self._vb_print('Closed file.')
+        else:
+            self._file.close()
+            self._is_open = False
+            self._vb_print('Closed file.')
+
+    def _data(self, entry):
+        '''Get the data of an entry, rebuilding it if it is a delta entry.'''
+        if len(entry) == self.BACK:
+            if self._key_chans:
+                # The log is delta encoded, so this is a keyframe
+                self._remember_keyframe(entry[self.INDEX], entry[self.DATA])
+            return entry[self.DATA]
+        key = self._keyframe(entry[self.INDEX] - entry[self.BACK], entry)
+        if entry[self.DATA]:
+            _channel_value(key)[1].__dict__.update(entry[self.DATA])
+        return key
+
+    def _encode(self, data):
+        '''Get what to store for the data of an entry being written.
+
+        @return A tuple of the data to store and the number of entries back
+                to the keyframe, or None if the entry is a keyframe.
+
+        '''
+        chan, value = _channel_value(data)
+        key = self._keyframes.get(chan)
+        if key is not None and key[1] < self._keyframe_interval:
+            if hasattr(value, '__dict__'):
+                names = record_policy.changed_members(value, key[2])
+                # Store the whole value if all of it has changed
+                if names is not None and len(names) < len(value.__dict__):
+                    key[1] += 1
+                    return dict([(n, value.__dict__[n]) for n in names]) or \
+                            None, self._write_ind - key[0]
+            elif record_policy.same_data(value, key[2]):
+                key[1] += 1
+                return None, self._write_ind - key[0]
+        self._keyframes[chan] = [self._write_ind, 1, copy.deepcopy(value)]
+        return data, None
 
     def _eof(self):
         return self._next is None
 
     def _get_cur_pos(self):
-        self._vb_print('Current position: {0}'.format(self._cur_pos))
+        if self._vb:
+            # Formatting the position is slow; this is called for every entry
+            self._vb_print('Current position: {0}'.format(self._cur_pos))
         return self._cur_pos.index, self._cur_pos.ts
 
     def _get_start(self):
         if self._start is None:
             self._set_start()
-        self._vb_print('Start position: {0}'.format(self._start))
+        if self._vb:
+            self._vb_print('Start position: {0}'.format(self._start))
         return (self._start.index, self._start.ts)
 
+    def _get_index(self):
+        '''Get the entry index, loading or rebuilding it if necessary.
+
+        Returns None if the index is disabled.
+
+        '''
+        if self._index is None and self._use_index and self._mode == 'r':
+            self._index = self._load_index()
+            if self._index is None:
+                self.rebuild_index()
+        return self._index
+
+    def _find_end(self, checkpoint):
+        '''Find the last complete entry of a log that was not closed.
+
+        Scanning starts from the checkpoint if it is valid, otherwise from
+        the first entry.
+
+        '''
+        start = self._data_start
+        delta = False
+        if isinstance(checkpoint, Checkpoint):
+            delta = checkpoint.delta
+            try:
+                self._file.seek(checkpoint.fp)
+                entry = self._read()
+                if entry[self.INDEX] == checkpoint.index and \
+                        entry[self.FP] == checkpoint.fp:
+                    start = checkpoint.fp
+            except Exception:
+                self._vb_print('Checkpoint {0} is not valid.'.format(
+                    checkpoint))
+        self._vb_print('Scanning for the end of the log from {0}.'.format(
+            start))
+        self._file.seek(start)
+        self._tail = []
+        self._tail_prev = None
+        data_end = start
+        end = None
+        while True:
+            offset = self._file.tell()
+            try:
+                entry = self._read()
+                if type(entry) != tuple or len(entry) not in (5, 6) or \
+                        entry[self.FP] != offset:
+                    break
+            except Exception:
+                # Reached an incomplete entry or the end of the file
+                break
+            if self._tail_prev is None:
+                self._tail_prev = entry[self.PREV]
+            if len(entry) > self.BACK:
+                delta = True
+            self._tail.append((entry[self.INDEX],
+                ilog.ts_to_ns(entry[self.TS]), offset))
+            end = CurPos(entry[self.INDEX], entry[self.TS], entry[self.PREV],
+                    entry[self.PREV], offset, delta=delta)
+            data_end = self._file.tell()
+        self._data_end = data_end
+        self._vb_print('Found {0} entries after the checkpoint; end position '
+                'is {1}.'.format(len(self._tail), end))
+        return end
+
     def _get_end(self):
-        self._vb_print('End position: {0}'.format(self._end))
+        if self._vb:
+            self._vb_print('End position: {0}'.format(self._end))
         return (self._end.index, self._end.ts)
 
     def _init_log(self):
@@ -179,11 +692,27 @@ class SimplePickleLog(ilog.Log):
             # Read out the metadata
             self._meta = self._read()
             pos = self._file.tell()
+            self._buf_start = pos
             # Read the end marker
-            self._end = self._read()
+            try:
+                end = self._read()
+            except Exception:
+                # Not written yet, or only partially written
+                end = None
             # Skip to the start of the data
-            self._file.seek(pos + self.BUFFER_SIZE)
+            self._data_start = pos + self.BUFFER_SIZE
+            if isinstance(end, CurPos) and not isinstance(end, Checkpoint):
+                self._end = end
+            else:
+                self._vb_print('Log was not closed; last checkpoint is '
+                        '{0}.'.format(end))
+                self._end = self._find_end(end)
+                self._recovered = True
+            self._file.seek(self._data_start)
             self._vb_print('Read end position: {0}'.format(self._end))
+            if self._use_mmap:
+                # The index gives the end of each entry in the map
+                self._get_index()
             # Grab the position of the first entry and make it the current
             self._set_start()
             self._cur_pos = copy.copy(self._start)
@@ -197,15 +726,121 @@ class SimplePickleLog(ilog.Log):
                 self._file.tell()))
             self._buf_start = self._file.tell()
             # Put some blank space to write the end marker
-            self._file.write(''.ljust(self.BUFFER_SIZE))
+            self._file.write(b''.ljust(self.BUFFER_SIZE))
             self._vb_print('Wrote buffer of length {0} at position {1}'.format(
                 self.BUFFER_SIZE, self._buf_start))
             self._write_ind = 0
             self._prev_pos = 0
-            self._cur_pos = CurPos(file_pos=self._file.tell())
+            self._last_cp = time.time()
+            self._cur_pos = CurPos(file_pos=self._file.tell(),
+                    delta=self._keyframe_interval > 0)
+            self._keyframes = {}
+            if self._use_index:
+                if self._idx_writer:
+                    self._idx_writer.close()
+                self._idx_writer = log_index.IndexWriter(
+                        log_index.index_file_name(self._fn))
             self._vb_print('First entry will be written at {0}'.format(
                 self._cur_pos))
 
+    def _jump_to(self, index, pos):
+        '''Moves directly to the entry at a position in the index.
+
+        If the position is None, the log is moved to the end.
+
+        '''
+        if pos is None:
+            if len(index) == 0:
+                return
+            self._jump_to(index, len(index) - 1)
+            self._read_single_entry()
+            return
+        offset = index.offset(pos)
+        self._file.seek(offset)
+        self._next = self._read()
+        self._cur_pos = CurPos(self._next[self.INDEX], self._next[self.TS],
+                self._next[self.PREV], offset, self._file.tell())
+
+    def _keyframe(self, ind, entry):
+        '''Get the data of the keyframe at an entry index.
+
+        The keyframe is taken from the cache if it was read recently. Otherwise
+        it is found using the index, or by stepping back through the log from
+        an entry after it.
+
+        @param ind The index of the keyframe.
+        @param entry An entry after the keyframe.
+        @return A new copy of the keyframe's data.
+
+        '''
+        if ind in self._key_cache:
+            return pickle.loads(self._key_cache[ind])
+        if self._vb:
+            self._vb_print('Loading keyframe {0} for entry {1}.'.format(ind,
+                entry[self.INDEX]))
+        current = self._file.tell()
+        try:
+            index = self._get_index()
+            if index is not None:
+                pos = index.find_index(ind)
+                if pos is None:
+                    raise ilog.InvalidIndexError
+                self._file.seek(index.offset(pos))
+                key = self._read()
+            else:
+                key = entry
+                while key[self.INDEX] > ind and key[self.INDEX] > 0:
+                    self._file.seek(key[self.PREV])
+                    key = self._read()
+        finally:
+            self._file.seek(current)
+        if key[self.INDEX] != ind or len(key) > self.BACK:
+            raise ilog.InvalidIndexError
+        self._remember_keyframe(ind, key[self.DATA])
+        return key[self.DATA]
+
+    def _load_index(self):
+        '''Load the index file of the log, if it exists and is up to date.'''
+        fn = log_index.index_file_name(self._fn)
+        if not os.path.isfile(fn):
+            self._vb_print('No index file found.')
+            return None
+        index = log_index.LogIndex()
+        try:
+            index.load(fn)
+        except (IOError, OSError, ValueError):
+            self._vb_print('Could not read index file {0}.'.format(fn))
+            return None
+        if self._tail is not None and not self._extend_index(index):
+            self._vb_print('Index file {0} does not match the log.'.format(fn))
+            return None
+        if len(index) != self._end.index + 1 or \
+                index.entry(len(index) - 1)[2] != self._end.fp:
+            self._vb_print('Index file {0} is out of date.'.format(fn))
+            return None
+        self._vb_print('Loaded index file {0}.'.format(fn))
+        return index
+
+    def _extend_index(self, index):
+        '''Add the entries found by scanning the tail of the log to an index.
+
+        The index written while recording may be missing entries at the end,
+        or have entries for entries that were not completely written.
+
+        Returns False if the index does not match the log.
+
+        '''
+        first = self._tail[0][0] if self._tail else 0
+        if len(index) < first:
+            return False
+        if self._tail and first > 0 and \
+                index.entry(first - 1)[2] != self._tail_prev:
+            return False
+        index.truncate(first)
+        for entry in self._tail:
+            index.append(*entry)
+        return True
+
     def _open(self):
         if self._is_open:
             return
@@ -215,7 +850,12 @@ class SimplePickleLog(ilog.Log):
             flags = 'wb'
         else:
             raise NotImplementedError
-        self._file = open(self._fn, flags)
+        if self._mode == 'r' and self._use_mmap:
+            self._file = log_io.MappedFile(self._fn)
+        elif self._mode == 'w':
+            self._file = self._policy.open(self._fn, flags)
+        else:
+            self._file = open(self._fn, flags)
         self._init_log()
         self._is_open = True
         self._vb_print('Opened file {0} in mode {1}.'.format(self._fn,
@@ -223,8 +863,16 @@ class SimplePickleLog(ilog.Log):
 
     def _read(self):
         '''Read a single entry from the log.'''
-        self._vb_print('Reading one data block at {0}.'.format(
-            self._file.tell()))
+        if self._vb:
+            self._vb_print('Reading one data block at {0}.'.format(
+                self._file.tell()))
+        if self._data_end is not None and \
+                self._file.tell() >= self._data_end:
+            # The rest of the file is an incomplete entry
+            self._vb_print('End of log reached.')
+            raise ilog.EndOfLogError
+        if self._use_mmap and self._index is not None:
+            return self._read_mapped()
         try:
             data = pickle.load(self._file)
         except EOFError:
@@ -232,6 +880,31 @@ class SimplePickleLog(ilog.Log):
             raise ilog.EndOfLogError
         return data
 
+    def _read_mapped(self):
+        '''Unpickle a single entry from a slice of the memory map.'''
+        start = self._file.tell()
+        if start >= self._file.size:
+            self._vb_print('End of log reached.')
+            raise ilog.EndOfLogError
+        offsets = self._index.offsets
+        # Usually reading sequentially, so try the entry after the last first
+        rec = self._next_rec
+        if rec >= len(offsets) or offsets[rec] != start:
+            rec = bisect.bisect_left(offsets, start)
+            if rec == len(offsets) or offsets[rec] != start:
+                # Not the start of an entry (e.g. the metadata)
+                return pickle.load(self._file)
+        if rec + 1 < len(offsets):
+            end = offsets[rec + 1]
+        elif self._data_end is not None:
+            end = self._data_end
+        else:
+            end = self._file.size
+        data = pickle.loads(self._file.view[start:end])
+        self._file.seek(end)
+        self._next_rec = rec + 1
+        return data
+
     def _read_number(self, number):
         self._vb_print('Reading {0} entries.'.format(number))
         res = []
@@ -243,7 +916,7 @@ class SimplePickleLog(ilog.Log):
         try:
             for ii in range(number):
                 res.append((self._next[self.INDEX], self._next[self.TS],
-                    self._next[self.DATA]))
+                    self._data(self._next)))
                 self._next = self._read()
                 if not self._next:
                     self._set_eof_pos()
@@ -251,8 +924,10 @@ class SimplePickleLog(ilog.Log):
                             'position is {1}.'.format(self._cur_pos))
                     break
                 self._update_cur_pos(self._next)
-                self._vb_print('Read entry {0} of {1}, current position '\
-                        'is {2}.'.format(ii + 1, number, self._cur_pos))
+                if self._vb:
+                    self._vb_print('Read entry {0} of {1}, current '\
+                            'position is {2}.'.format(ii + 1, number,
+                                self._cur_pos))
         except ilog.EndOfLogError:
             self._set_eof_pos()
             self._next = None
@@ -270,14 +945,16 @@ class SimplePickleLog(ilog.Log):
         if not self._next:
             self._vb_print('End of log before reading.')
             return []
-        if self._cur_pos.ts > timestamp:
+        # Compare the entries' timestamps as integers
+        limit = ilog.EntryTS(ns=ilog.ts_to_ns(timestamp))
+        if self._cur_pos.ts > limit:
             # The time limit is before the next item - nothing to read
             self._vb_print('Current position is beyond the time limit.')
             return []
         try:
-            while self._next[self.TS] <= timestamp:
+            while self._next[self.TS] <= limit:
                 res.append((self._next[self.INDEX], self._next[self.TS],
-                    self._next[self.DATA]))
+                    self._data(self._next)))
                 self._next = self._read()
                 if not self._next:
                     self._set_eof_pos()
@@ -285,8 +962,10 @@ class SimplePickleLog(ilog.Log):
                             'position is {1}.'.format(self._cur_pos))
                     break
                 self._update_cur_pos(self._next)
-                self._vb_print('Read entry at time index {0}, current '\
-                        'position is {1}.'.format(res[-1][1], self._cur_pos))
+                if self._vb:
+                    self._vb_print('Read entry at time index {0}, current '\
+                            'position is {1}.'.format(res[-1][1],
+                                self._cur_pos))
         except ilog.EndOfLogError:
             self._set_eof_pos()
             self._next = None
@@ -303,7 +982,7 @@ class SimplePickleLog(ilog.Log):
             return []
         else:
             res = [(self._next[self.INDEX], self._next[self.TS],
-                self._next[self.DATA])]
+                self._data(self._next))]
             try:
                 self._next = self._read()
             except ilog.EndOfLogError:
@@ -314,11 +993,23 @@ class SimplePickleLog(ilog.Log):
                         'position is {0}.'.format(self._cur_pos))
             else:
                 self._update_cur_pos(self._next)
-                self._vb_print('Read entry, current position is ' \
-                        '{0}.'.format(self._cur_pos))
-            self._vb_print('Cached next entry is {0}'.format(self._next))
+                if self._vb:
+                    self._vb_print('Read entry, current position is ' \
+                            '{0}.'.format(self._cur_pos))
+            if self._vb:
+                # Formatting the entry's data can be very slow
+                self._vb_print('Cached next entry is {0}'.format(self._next))
             return res
 
+    def _remember_keyframe(self, ind, data):
+        '''Cache a keyframe, replacing the last keyframe of its channel.'''
+        chan = _channel_value(data)[0]
+        old = self._key_chans.get(chan)
+        if old is not None and old != ind:
+            del self._key_cache[old]
+        self._key_cache[ind] = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        self._key_chans[chan] = ind
+
     def _seek_to_index(self, ind):
         '''Seeks forward or backward in the log to find the given index.'''
         if ind == self._cur_pos.index:
@@ -326,6 +1017,10 @@ class SimplePickleLog(ilog.Log):
             return
         if ind < 0:
             raise ilog.InvalidIndexError
+        index = self._get_index()
+        if index is not None:
+            self._vb_print('Jumping to index {0}.'.format(ind))
+            self._jump_to(index, index.find_index(ind))
         elif ind < self._cur_pos.index:
             # Rewind
             # TODO: Rewinding may be more efficient in many cases if done by
@@ -347,6 +1042,10 @@ class SimplePickleLog(ilog.Log):
         if ts == self._cur_pos.ts and not self.eof:
             self._vb_print('Seek by timestamp: already at destination.')
             return
+        index = self._get_index()
+        if index is not None:
+            self._vb_print('Jumping to timestamp {0}.'.format(ts))
+            self._jump_to(index, index.find_timestamp(ilog.ts_to_ns(ts)))
         elif ts < self._cur_pos.ts or self.eof:
             # Rewind
             self._vb_print('Rewinding to timestamp {0}.'.format(ts))
@@ -399,6 +1098,15 @@ class SimplePickleLog(ilog.Log):
         self._cur_pos.cache = self._cur_pos.fp
         self._cur_pos.fp = self._file.tell()
 
+    def _write_checkpoint(self):
+        '''Write the current end position into the end position space.'''
+        pos = self._file.tell()
+        self._file.seek(self._buf_start)
+        self._write(Checkpoint(self._end.index, self._end.ts, self._end.prev,
+            self._end.cache, self._end.fp, self._end.delta))
+        self._file.seek(pos)
+        self._vb_print('Wrote checkpoint: {0}'.format(self._end))
+
     def _write(self, data):
         '''Pickle some data and write it to the file.'''
         self._vb_print('Writing one data block.')
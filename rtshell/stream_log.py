@@ -0,0 +1,302 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Pickle-based log that can be written to and read from a pipe.
+
+'''
+
+
+import io
+import pickle
+import sys
+
+from rtshell import ilog
+from rtshell import log_io
+
+
+# The file name of standard output when writing, and standard input when
+# reading
+STDIO = '-'
+
+MAGIC = 'rtlog-stream'
+VERSION = 1
+
+
+def stdio_logger(filename, logger):
+    '''Get the type of logger to use for a log file.
+
+    Only the stream logger can be written to and read from a pipe, so it is
+    used for standard input and output unless another logger was chosen.
+
+    @param filename The name of the log file.
+    @param logger The name of the type of logger chosen.
+    @return The name of the type of logger to use, or None if the chosen
+            logger cannot use the file.
+
+    '''
+    if filename != STDIO:
+        return logger
+    if logger in ['simpkl', 'stream']:
+        return 'stream'
+    return None
+
+
+###############################################################################
+## Trailer
+
+class Trailer(object):
+    '''The record written after the last entry of a stream log.'''
+    def __init__(self, count=0, start=None, end=None):
+        '''Constructor.
+
+        @param count The number of entries in the log.
+        @param start The time stamp of the first entry.
+        @param end The time stamp of the last entry.
+
+        '''
+        super(Trailer, self).__init__()
+        self.count = count
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return '{0} entries from {1} to {2}'.format(self.count, self.start,
+                self.end)
+
+
+###############################################################################
+## Stream log
+##
+## The log is written strictly in order and never seeks, so it can be written
+## to a pipe and read from one; for example, compressed on the fly or sent to
+## another machine without a temporary file.
+##
+## The format is a sequence of pickled records:
+## Header: (MAGIC, VERSION, metadata)
+## [Data entries: (Index, Time stamp, Data)]
+## Trailer
+##
+## The trailer takes the place of the end pointer that other logs write back
+## into the start of the file when they are closed. A log that ends without a
+## trailer (because the recorder was stopped without closing it, or the pipe
+## was broken) is read up to its last complete entry.
+##
+## Reading only goes forwards: the end of the log is not known until it has
+## been reached, and rewinding, seeking backwards and reading backwards are not
+## supported.
+
+class StreamLog(ilog.Log):
+    '''A sequential pickle-based log for pipes.
+
+    Give the file name "-" to write to standard output or read from standard
+    input.
+
+    '''
+    def __init__(self, filename='', buffer_size=log_io.DEFAULT_BUFFER_SIZE,
+            flush_interval=None, fsync=log_io.FSYNC_NEVER, *args, **kwargs):
+        self._is_open = False
+        if filename == STDIO:
+            # A pipe cannot be synced
+            fsync = log_io.FSYNC_NEVER
+        self._policy = log_io.WritePolicy(buffer_size=buffer_size,
+                flush_interval=flush_interval, fsync=fsync)
+        self._fn = filename
+        self._count = 0
+        self._first = None
+        self._last = None
+        self._next = None
+        self._trailer = None
+        super(StreamLog, self).__init__(*args, **kwargs)
+
+    def __str__(self):
+        return 'StreamLog({0}, {1}) at position {2}.'.format(self._fn,
+                self._mode, self.pos)
+
+    @property
+    def complete(self):
+        '''True if the log's trailer has been read or written.
+
+        A log being read is only known to be complete once its end has been
+        reached.
+
+        '''
+        return self._trailer is not None
+
+    def write(self, timestamp, data):
+        if self._first is None:
+            self._first = timestamp
+        self._last = timestamp
+        pickle.dump((self._count, timestamp, data), self._file,
+                pickle.HIGHEST_PROTOCOL)
+        self._count += 1
+        self._policy.entry_written(self._file)
+        if self._vb:
+            self._vb_print('Wrote entry at ({0}, {1}).'.format(
+                self._count - 1, timestamp))
+
+    def read(self, timestamp=None, number=None):
+        if number is not None:
+            if number < 0:
+                raise ValueError
+        elif timestamp is None:
+            number = 1
+        else:
+            if timestamp < 0:
+                raise ValueError
+            # Compare the entries' timestamps as integers
+            limit = ilog.EntryTS(ns=ilog.ts_to_ns(timestamp))
+        res = []
+        while self._next is not None and (number is None or
+                len(res) < number):
+            if number is None and self._next[1] > limit:
+                break
+            res.append(self._next)
+            self._read_ahead()
+        return res
+
+    def rewind(self):
+        raise NotImplementedError('A stream log cannot be rewound')
+
+    def seek(self, timestamp=None, index=None):
+        '''Fast-forward the log.
+
+        Only seeking forwards is supported.
+
+        '''
+        self._vb_print('Seeking log from position {0}.'.format(self.pos))
+        if index is not None:
+            if index < 0:
+                raise ilog.InvalidIndexError
+            if index < self.pos[0]:
+                raise NotImplementedError('A stream log cannot be rewound')
+            while self._next is not None and self._next[0] < index:
+                self._read_ahead()
+        elif timestamp is not None:
+            target = ilog.EntryTS(ns=ilog.ts_to_ns(timestamp))
+            # Entries already read may be at or after the target
+            if self._last is not None and self._last >= target:
+                raise NotImplementedError('A stream log cannot be rewound')
+            while self._next is not None and self._next[1] < target:
+                self._read_ahead()
+        self._vb_print('New current position: {0}.'.format(self.pos))
+
+    def _backup_one(self):
+        raise NotImplementedError('A stream log cannot be read backwards')
+
+    def _close(self):
+        if not self._is_open:
+            return
+        if self._mode == 'w':
+            self._trailer = Trailer(self._count, self._first, self._last)
+            pickle.dump(self._trailer, self._file, pickle.HIGHEST_PROTOCOL)
+            self._vb_print('Wrote trailer: {0}'.format(self._trailer))
+            self._policy.closing(self._file)
+        self._file.close()
+        self._is_open = False
+        self._vb_print('Closed {0}.'.format(self._fn))
+
+    def _eof(self):
+        return self._next is None
+
+    def _get_cur_pos(self):
+        if self._mode == 'w':
+            return self._count, self._last
+        if self._next is None:
+            return self._get_end()[0] + 1, self._get_end()[1]
+        return self._next[0], self._next[1]
+
+    def _get_start(self):
+        return 0, self._first
+
+    def _get_end(self):
+        '''The last entry of the log.
+
+        When reading, the end is (None, None) until the end of the log has
+        been reached.
+
+        '''
+        if self._mode == 'w':
+            return self._count - 1, self._last
+        if self._trailer is not None:
+            return self._trailer.count - 1, self._trailer.end
+        if self._next is None:
+            return self._count - 1, self._last
+        return None, None
+
+    def _open(self):
+        if self._mode == 'w':
+            if self._fn == STDIO:
+                sys.stdout.flush()
+                self._file = io.open(sys.stdout.fileno(), 'wb',
+                        self._policy.buffer_size, closefd=False)
+            else:
+                self._file = self._policy.open(self._fn, 'wb')
+            pickle.dump((MAGIC, VERSION, self._meta), self._file,
+                    pickle.HIGHEST_PROTOCOL)
+            # Get the header to a reader waiting on the other end of a pipe
+            self._file.flush()
+            self._is_open = True
+            self._vb_print('Opened {0} for writing.'.format(self._fn))
+        elif self._mode == 'r':
+            if self._fn == STDIO:
+                self._file = io.open(sys.stdin.fileno(), 'rb', closefd=False)
+            else:
+                self._file = open(self._fn, 'rb')
+            self._is_open = True
+            try:
+                header = pickle.load(self._file)
+            except Exception:
+                header = None
+            if type(header) is not tuple or len(header) != 3 or \
+                    header[0] != MAGIC:
+                self._close()
+                raise ValueError('{0} is not a stream log'.format(self._fn))
+            if header[1] > VERSION:
+                self._close()
+                raise ValueError('{0} is a newer version of stream log '
+                        '({1})'.format(self._fn, header[1]))
+            self._meta = header[2]
+            self._vb_print('Opened {0} for reading.'.format(self._fn))
+            self._read_ahead()
+            if self._next is not None:
+                self._first = self._next[1]
+        else:
+            raise NotImplementedError
+
+    def _read_ahead(self):
+        '''Read the entry after the current one into self._next.'''
+        if self._next is not None:
+            self._count += 1
+            self._last = self._next[1]
+        self._next = None
+        if self._trailer is not None:
+            return
+        try:
+            rec = pickle.load(self._file)
+        except EOFError:
+            self._vb_print('End of {0} without a trailer.'.format(self._fn))
+            return
+        except Exception:
+            # A partly-written entry at the end of the log
+            self._vb_print('Incomplete entry at the end of {0}.'.format(
+                self._fn))
+            return
+        if isinstance(rec, Trailer):
+            self._trailer = rec
+            self._vb_print('Read trailer: {0}'.format(rec))
+            return
+        self._next = rec
+
@@ -14,63 +14,660 @@ Copyright (C) 2009-2015
 Licensed under the GNU Lesser General Public License version 3.
 http://www.gnu.org/licenses/lgpl-3.0.en.html
 
-Text-based log.
+Structured text log.
 
 '''
 
 
+import array
+import base64
 import copy
-import os
+import csv
+import json
+import operator
+import pickle
+import sys
 
 from rtshell import ilog
+from rtshell import log_index
+from rtshell import log_io
 
 
 ###############################################################################
-## Text-based log object. It only supports writing log files. It relies on
-## the data types having suitable __repr__ methods.
+## Text log formats
+##
+## The log is UTF-8 text with one entry per line, in either CSV or JSON Lines
+## format:
+##
+## CSV:
+##   #rtlog-text,csv,<version>,<metadata>
+##   #schema,<schema ID>,<channel>,<type>,<prototype>,<column>,<column>,...
+##   <timestamp>,<channel>,<value>,<value>,...
+##
+## JSON Lines:
+##   {"rtlog-text":"jsonl","version":<version>,"meta":<metadata>}
+##   {"schema":<schema ID>,"channel":<channel>,"type":<type>,
+##    "prototype":<prototype>,"columns":[<column>,...]}
+##   {"t":<timestamp>,"channel":<channel>,"<column>":<value>,...}
+##
+## Timestamps are seconds with nine decimal places. They are read back
+## exactly. The metadata and prototypes are pickled and base64-encoded.
+##
+## The value of each (channel name, value) entry written by rtlog is flattened
+## into columns. Each field of a struct is a column named by its path, e.g.
+## 'tm.sec'. A value that is not a struct is a single column, 'value'.
+## Numbers, booleans and strings are written as they are, enums as their
+## integer value and bytes in base64. Any other value, such as a sequence, is
+## written as JSON, with structs as objects. Entries that are not (channel
+## name, value) tuples have an empty channel name.
+##
+## A schema line comes before the first entry of each channel, and again
+## whenever a channel's values change type. It gives the columns and a
+## prototype: the channel's first value of that type. Entries are read by
+## filling a copy of the prototype from the columns, so they have the same
+## types as when they were written. The elements of a sequence of structs are
+## copied from the first element of that sequence in the prototype; if it was
+## empty, they are read as dictionaries.
+
+VERSION = 1
+CSV = 'csv'
+JSONL = 'jsonl'
+FORMATS = [CSV, JSONL]
+
+CSV_HEADER = '#rtlog-text'
+CSV_SCHEMA = '#schema'
+JSONL_HEADER = '{"rtlog-text"'
+JSONL_SCHEMA = '{"schema"'
+
+if sys.version_info[0] >= 3:
+    _INT_TYPES = (int,)
+    _TEXT_TYPES = (str,)
+    _BYTES_TYPES = (bytes,)
+else:
+    _INT_TYPES = (int, long)
+    _TEXT_TYPES = (str, unicode)
+    _BYTES_TYPES = ()
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+###############################################################################
+## Conversion of values to and from columns
+
+def _is_enum(value):
+    return hasattr(value, '_v') and hasattr(value, '_n')
+
+
+def _fields(value):
+    return sorted([f for f in getattr(value, '__dict__', {}).keys()
+        if not f.startswith('_')])
+
+
+def _is_struct(value):
+    return not _is_enum(value) and bool(_fields(value))
+
+
+def _kind(value):
+    '''Get the kind of column a value is written as.'''
+    if isinstance(value, bool):
+        return 'b'
+    elif isinstance(value, _INT_TYPES):
+        return 'i'
+    elif isinstance(value, float):
+        return 'f'
+    elif isinstance(value, _TEXT_TYPES):
+        return 's'
+    elif isinstance(value, _BYTES_TYPES):
+        return 'y'
+    elif _is_enum(value):
+        return 'e'
+    return 'j'
+
+
+def _to_json(value):
+    '''Convert a value to something that can be written as JSON.'''
+    if isinstance(value, (list, tuple)):
+        return [_to_json(v) for v in value]
+    elif _is_enum(value):
+        return value._v
+    elif isinstance(value, _BYTES_TYPES):
+        return base64.b64encode(value).decode('ascii')
+    elif _is_struct(value):
+        return dict([(f, _to_json(getattr(value, f)))
+            for f in _fields(value)])
+    return value
+
+
+def _from_json(value, proto):
+    '''Convert a value read from JSON to the type of a prototype value.'''
+    if isinstance(proto, (list, tuple)):
+        if proto:
+            elem = proto[0]
+        else:
+            elem = None
+        res = [_from_json(v, elem) for v in value]
+        if isinstance(proto, tuple):
+            return tuple(res)
+        return res
+    elif _is_enum(proto):
+        return _enum(proto, value)
+    elif isinstance(proto, _BYTES_TYPES):
+        return base64.b64decode(value.encode('ascii'))
+    elif isinstance(proto, float):
+        return float(value)
+    elif _is_struct(proto) and isinstance(value, dict):
+        res = copy.copy(proto)
+        for f in _fields(proto):
+            setattr(res, f, _from_json(value.get(f), getattr(proto, f)))
+        return res
+    return value
+
+
+def _enum(proto, value):
+    '''Get the item of the same enum as a prototype that has a value.'''
+    if value == proto._v:
+        return proto
+    try:
+        import omniORB
+        return omniORB.findType(proto._parent_id)[3][value]
+    except (ImportError, AttributeError, IndexError, TypeError):
+        return value
+
+
+def _csv_cell(text):
+    if ',' in text or '"' in text or '\n' in text or '\r' in text:
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+class _Flattener(object):
+    '''Converts the values of one type to and from rows of columns.
+
+    The columns are found from a prototype value of the type. A flattener is
+    made once for each type of value in a log.
+
+    '''
+    def __init__(self, proto):
+        super(_Flattener, self).__init__()
+        self.proto = proto
+        self.columns = []
+        self._getters = []
+        self._kinds = []
+        self._protos = []
+        # The getter, type and fields of each struct in the value
+        self._structs = []
+        self._tree = self._walk(proto, [])
+        self._json_keys = [_encoder.encode(c) + ':' for c in self.columns]
+
+    def _walk(self, value, path):
+        '''Find the columns of a value. Returns a tree of the structs, with
+        the column number at each leaf.'''
+        if _is_struct(value):
+            if path:
+                get = operator.attrgetter('.'.join(path))
+            else:
+                get = lambda v: v
+            self._structs.append((get, type(value), _fields(value)))
+            return (value, [(f, self._walk(getattr(value, f), path + [f]))
+                for f in _fields(value)])
+        if path:
+            self.columns.append('.'.join(path))
+            self._getters.append(operator.attrgetter('.'.join(path)))
+        else:
+            self.columns.append('value')
+            self._getters.append(lambda v: v)
+        self._kinds.append(_kind(value))
+        self._protos.append(value)
+        return len(self.columns) - 1
+
+    def _build(self, node, cells):
+        if type(node) is int:
+            return cells[node]
+        res = copy.copy(node[0])
+        for f, child in node[1]:
+            setattr(res, f, self._build(child, cells))
+        return res
+
+    def matches(self, value):
+        '''Check if a value has the same shape as the prototype, so it can
+        be written in the same columns.'''
+        try:
+            for get, t, fields in self._structs:
+                v = get(value)
+                if type(v) is not t or _fields(v) != fields:
+                    return False
+            for get, kind, proto in zip(self._getters, self._kinds,
+                    self._protos):
+                v = get(value)
+                if _kind(v) != kind:
+                    return False
+                if (kind == 'e' or kind == 'j') and \
+                        type(v) is not type(proto):
+                    return False
+        except AttributeError:
+            return False
+        return True
+
+    def to_csv(self, value):
+        '''Get the CSV cells of a value.'''
+        res = []
+        for get, kind in zip(self._getters, self._kinds):
+            v = get(value)
+            if kind == 'i':
+                res.append(str(v))
+            elif kind == 'f':
+                res.append(repr(float(v)))
+            elif kind == 'b':
+                res.append('true' if v else 'false')
+            elif kind == 's':
+                res.append(_csv_cell(v))
+            elif kind == 'y':
+                res.append(base64.b64encode(v).decode('ascii'))
+            elif kind == 'e':
+                res.append(str(v._v))
+            else:
+                res.append(_csv_cell(_encoder.encode(_to_json(v))))
+        return res
+
+    def from_csv(self, cells):
+        '''Rebuild a value from its CSV cells.'''
+        res = []
+        for c, kind, proto in zip(cells, self._kinds, self._protos):
+            if kind == 'i':
+                res.append(int(c))
+            elif kind == 'f':
+                res.append(float(c))
+            elif kind == 'b':
+                res.append(c == 'true')
+            elif kind == 's':
+                res.append(c)
+            elif kind == 'y':
+                res.append(base64.b64decode(c.encode('ascii')))
+            elif kind == 'e':
+                res.append(_enum(proto, int(c)))
+            else:
+                res.append(_from_json(json.loads(c), proto))
+        return self._build(self._tree, res)
+
+    def to_jsonl(self, value):
+        '''Get the JSON members of a value, as "name":value strings.'''
+        res = []
+        for key, get, kind in zip(self._json_keys, self._getters,
+                self._kinds):
+            v = get(value)
+            if kind == 'y':
+                v = base64.b64encode(v).decode('ascii')
+            elif kind == 'e':
+                v = v._v
+            elif kind == 'j':
+                v = _to_json(v)
+            res.append(key + _encoder.encode(v))
+        return res
+
+    def from_jsonl(self, obj):
+        '''Rebuild a value from a JSON object.'''
+        res = []
+        for c, kind, proto in zip(self.columns, self._kinds, self._protos):
+            v = obj.get(c)
+            if kind == 's' or kind == 'i' or kind == 'b':
+                res.append(v)
+            elif kind == 'f':
+                res.append(float(v))
+            else:
+                res.append(_from_json(v, proto))
+        return self._build(self._tree, res)
+
+
+def _format_ts(ns):
+    '''Write a timestamp in nanoseconds as seconds with nine decimal
+    places.'''
+    if ns < 0:
+        return '-' + _format_ts(-ns)
+    return '{0}.{1:09}'.format(ns // 1000000000, ns % 1000000000)
+
+
+def _parse_ts(text):
+    '''Parse a timestamp written as seconds with decimal places into
+    nanoseconds.'''
+    text = text.strip()
+    # The sign applies to the whole value, not just the seconds
+    neg = text.startswith('-')
+    if neg or text.startswith('+'):
+        text = text[1:]
+    sec, _, frac = text.partition('.')
+    ns = int(sec or '0') * 1000000000 + int((frac + '000000000')[:9])
+    if neg:
+        return -ns
+    return ns
+
+
+def _pickle_b64(value):
+    return base64.b64encode(pickle.dumps(value, 2)).decode('ascii')
+
+
+def _unpickle_b64(text):
+    return pickle.loads(base64.b64decode(text.encode('ascii')))
+
+
+###############################################################################
+## Text log object
 
 class TextLog(ilog.Log):
-    def __init__(self, filename='', *args, **kwargs):
+    '''A log written as structured text.
+
+    Each entry is one line of CSV or JSON Lines, so the log can be searched
+    with text tools and loaded by other programs. It can also be read back,
+    and played, like the other logs. When reading, the whole file is scanned
+    once on opening to find the entries.
+
+    '''
+    def __init__(self, filename='', text_format=CSV, mmap=False,
+            buffer_size=log_io.DEFAULT_BUFFER_SIZE, flush_interval=None,
+            fsync=log_io.FSYNC_NEVER, *args, **kwargs):
+        '''Constructor.
+
+        @param filename The name of the log file.
+        @param text_format When writing, the format to write: 'csv' or
+                           'jsonl'. When reading, the format is found from
+                           the file.
+        @param mmap When reading, memory-map the file rather than reading it.
+        @param buffer_size The size in bytes of the write buffer.
+        @param flush_interval When writing, flush the write buffer if this many
+                              seconds have passed since the last flush. None
+                              to only flush when the buffer is full.
+        @param fsync When to sync the log to the storage device when writing.
+                     See log_io.parse_fsync_policy.
+
+        '''
         self._is_open = False
+        if text_format not in FORMATS:
+            raise ValueError('Unknown text log format: {0}'.format(
+                text_format))
         self._fn = filename
+        self._format = text_format
+        self._mmap = mmap
+        self._policy = log_io.WritePolicy(buffer_size=buffer_size,
+                flush_interval=flush_interval, fsync=fsync)
         super(TextLog, self).__init__(*args, **kwargs)
 
     def __str__(self):
         if self._is_open:
-            return 'TextLog({0}, {1}) at position {2}.'.format(self._fn,
-                    self._mode, self._file.tell())
+            return 'TextLog({0}, {1}, {2}) at position {3}.'.format(self._fn,
+                    self._mode, self._format, self.pos)
         else:
-            return 'TextLog({0}, {1}).'.format(self._fn, self._mode)
+            return 'TextLog({0}, {1}, {2}).'.format(self._fn, self._mode,
+                    self._format)
+
+    @property
+    def text_format(self):
+        '''The format of the log: 'csv' or 'jsonl'.'''
+        return self._format
 
     def write(self, timestamp, data):
-        pos = self._file.tell()
-        self._file.write('{0}\t{1}\n'.format(timestamp, data))
-        self._vb_print('Wrote entry at {0}.'.format(pos))
+        if type(data) == tuple and len(data) == 2 and \
+                isinstance(data[0], _TEXT_TYPES):
+            name, value = data
+        else:
+            name, value = '', data
+        chan = self._chans.get(name)
+        if chan is None or chan[0] is not type(value) or \
+                not chan[1].matches(value):
+            chan = self._add_schema(name, value)
+        ts = _format_ts(ilog.ts_to_ns(timestamp))
+        if self._format == CSV:
+            line = ','.join([ts, _csv_cell(name)] + chan[1].to_csv(value))
+        else:
+            line = '{' + ','.join(['"t":' + ts,
+                '"channel":' + _encoder.encode(name)] +
+                chan[1].to_jsonl(value)) + '}'
+        self._file.write((line + '\n').encode('utf-8'))
+        self._policy.entry_written(self._file)
+        self._write_ind += 1
+        if self._vb:
+            self._vb_print('Wrote entry {0} at {1}.'.format(
+                self._write_ind - 1, timestamp))
+
+    def read(self, timestamp=None, number=None):
+        if number is not None:
+            if number < 0:
+                raise ValueError
+        elif timestamp is None:
+            number = 1
+        else:
+            if timestamp < 0:
+                raise ValueError
+            limit = ilog.ts_to_ns(timestamp)
+        res = []
+        while self._next < len(self._index) and \
+                (number is None or len(res) < number):
+            if number is None and self._index.entry(self._next)[1] > limit:
+                break
+            res.append(self._read_entry(self._next))
+            self._next += 1
+        return res
+
+    def read_reverse(self, number=1):
+        res = []
+        while self._next > 0 and len(res) < number:
+            self._next -= 1
+            res.append(self._read_entry(self._next))
+        return res
+
+    def rewind(self):
+        self._vb_print('Rewinding log.')
+        if self._mode == 'r':
+            self._next = 0
+        else:
+            self._file.seek(0)
+            self._file.truncate()
+            self._init_log()
+
+    def seek(self, timestamp=None, index=None):
+        if index is not None:
+            if index < 0:
+                raise ilog.InvalidIndexError
+            pos = self._index.find_index(index)
+        elif timestamp is not None:
+            pos = self._index.find_timestamp(ilog.ts_to_ns(timestamp))
+        else:
+            return
+        if pos is None:
+            pos = len(self._index)
+        self._next = pos
+        self._vb_print('New current position: {0}.'.format(self.pos))
+
+    def _add_schema(self, name, value):
+        '''Write the schema of a channel, and make the flattener for the
+        type of its values if there is not one already.'''
+        t = type(value)
+        flat = self._flatteners.get(t)
+        if flat is None or not flat.matches(value):
+            # Values of the same type may have a different shape, such as a
+            # member holding another type
+            flat = _Flattener(value)
+            self._flatteners[t] = flat
+        schema = len(self._chans_written)
+        type_name = '{0}.{1}'.format(t.__module__, t.__name__)
+        proto = _pickle_b64(flat.proto)
+        if self._format == CSV:
+            line = ','.join([CSV_SCHEMA, str(schema), _csv_cell(name),
+                type_name, proto] + [_csv_cell(c) for c in flat.columns])
+        else:
+            line = _encoder.encode({'schema': schema, 'channel': name,
+                'type': type_name, 'prototype': proto,
+                'columns': flat.columns})
+        self._file.write((line + '\n').encode('utf-8'))
+        self._chans_written.append(name)
+        self._chans[name] = (t, flat)
+        self._vb_print('Wrote schema {0} for channel "{1}" of type {2}.'.format(
+            schema, name, type_name))
+        return self._chans[name]
+
+    def _backup_one(self):
+        if self._next > 0:
+            self._next -= 1
 
     def _close(self):
         if not self._is_open:
             return
+        if self._mode == 'w':
+            self._policy.closing(self._file)
         self._file.close()
         self._is_open = False
         self._vb_print('Closed file.')
 
+    def _eof(self):
+        if self._mode != 'r':
+            return True
+        return self._next >= len(self._index)
+
     def _get_cur_pos(self):
-        if self._is_open:
-            self._vb_print('Current position: {0}'.format(self._file.tell()))
-            return self._file.tell()
+        if self._mode == 'w':
+            return self._write_ind, -1
+        if self._next < len(self._index):
+            return self._next, self._ns_to_ts(self._index.entry(self._next)[1])
+        return self._get_end()[0] + 1, self._get_end()[1]
+
+    def _get_end(self):
+        if not len(self._index):
+            return -1, None
+        return len(self._index) - 1, self._ns_to_ts(
+                self._index.entry(len(self._index) - 1)[1])
+
+    def _get_start(self):
+        if not len(self._index):
+            return 0, None
+        return 0, self._ns_to_ts(self._index.entry(0)[1])
+
+    def _init_log(self):
+        if self._mode == 'r':
+            self._scan()
         else:
-            self._vb_print('Current position: file closed.')
-            return 0
+            self._flatteners = {}
+            self._chans = {}
+            self._chans_written = []
+            self._write_ind = 0
+            meta = _pickle_b64(self._meta)
+            if self._format == CSV:
+                line = ','.join([CSV_HEADER, CSV, str(VERSION), meta])
+            else:
+                line = _encoder.encode({'rtlog-text': JSONL,
+                    'version': VERSION, 'meta': meta})
+            self._file.write((line + '\n').encode('utf-8'))
+
+    def _ns_to_ts(self, ns):
+        return ilog.EntryTS(ns=ns)
 
     def _open(self):
         if self._is_open:
             return
-        if self._mode == 'w':
-            flags = 'w'
+        if self._mode == 'r':
+            if self._mmap:
+                self._file = log_io.MappedFile(self._fn)
+            else:
+                self._file = open(self._fn, 'rb')
+        elif self._mode == 'w':
+            self._file = self._policy.open(self._fn, 'wb')
         else:
             raise NotImplementedError
-        self._file = open(self._fn, flags)
+        self._init_log()
         self._is_open = True
         self._vb_print('Opened file {0} in mode {1}.'.format(self._fn,
             self._mode))
 
+    def _parse_line(self, line):
+        '''Split an entry line into its timestamp, channel and the rest.'''
+        if self._format == CSV:
+            ts, name, rest = (line.rstrip('\r\n') + ',').split(',', 2)
+            if name.startswith('"'):
+                # A channel name with special characters; rare enough to
+                # parse the whole line for
+                fields = next(csv.reader([line]))
+                name = fields[1]
+            return ts, name
+        d = json.JSONDecoder()
+        ts, end = d.raw_decode(line, 5) # Skip '{"t":'
+        ts = line[5:end]
+        # Skip ',"channel":'
+        name, end = d.raw_decode(line, end + 11)
+        return ts, name
+
+    def _read_entry(self, pos):
+        '''Read and rebuild the entry at a position.'''
+        index, ts, offset = self._index.entry(pos)
+        self._file.seek(offset)
+        line = self._read_line()
+        flat = self._schemas[self._schema_ids[pos]][1]
+        if self._format == CSV:
+            fields = next(csv.reader([line]))
+            name = fields[1]
+            value = flat.from_csv(fields[2:])
+        else:
+            obj = json.loads(line)
+            name = obj['channel']
+            value = flat.from_jsonl(obj)
+        if self._vb:
+            self._vb_print('Read entry {0} at {1}.'.format(index, offset))
+        if name:
+            value = (name, value)
+        return index, self._ns_to_ts(ts), value
+
+    def _read_line(self):
+        '''Read the next line, and any following lines that belong to the same
+        CSV record. Returns an empty string at the end of the file.'''
+        line = self._file.readline()
+        if self._format == CSV:
+            # A quoted cell may contain line breaks
+            while line.count(b'"') % 2:
+                more = self._file.readline()
+                if not more:
+                    break
+                line += more
+        return line.decode('utf-8')
+
+    def _scan(self):
+        '''Read the header, the schemas and the position of each entry.'''
+        line = self._read_line()
+        if line.startswith(CSV_HEADER + ','):
+            header = next(csv.reader([line]))
+            self._format = CSV
+            version = int(header[2])
+            self._meta = _unpickle_b64(header[3])
+        elif line.startswith(JSONL_HEADER):
+            header = json.loads(line)
+            self._format = JSONL
+            version = header['version']
+            self._meta = _unpickle_b64(header['meta'])
+        else:
+            raise ValueError('{0} is not a text log'.format(self._fn))
+        if version != VERSION:
+            raise ValueError('{0} is not a text log'.format(self._fn))
+        self._index = log_index.LogIndex()
+        self._schemas = {}
+        self._schema_ids = array.array('i')
+        current = {}
+        while True:
+            offset = self._file.tell()
+            line = self._read_line()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            if line.startswith(CSV_SCHEMA + ',') and self._format == CSV:
+                fields = next(csv.reader([line]))
+                schema, name, proto = int(fields[1]), fields[2], fields[4]
+            elif line.startswith(JSONL_SCHEMA) and self._format == JSONL:
+                obj = json.loads(line)
+                schema, name, proto = obj['schema'], obj['channel'], \
+                        obj['prototype']
+            else:
+                ts, name = self._parse_line(line)
+                self._index.append(len(self._index), _parse_ts(ts), offset)
+                self._schema_ids.append(current[name])
+                continue
+            self._schemas[schema] = (name, _Flattener(_unpickle_b64(proto)))
+            current[name] = schema
+        self._next = 0
+        self._vb_print('Scanned log {0}: {1} entries in {2} channels.'.format(
+            self._fn, len(self._index), len(current)))
+
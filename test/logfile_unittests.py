@@ -20,13 +20,42 @@ Unit tests for the log classes
 
 from __future__ import print_function
 
+import json
 import os
 import os.path
+import pickle
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
 import unittest
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import rtshell
+import rtshell.async_log
+import rtshell.cdr_log
+import rtshell.chunked_log
+import rtshell.framed_log
 import rtshell.ilog
+import rtshell.log_export
+import rtshell.log_index
+import rtshell.log_io
+import rtshell.log_merge
+import rtshell.log_stats
+import rtshell.loop_log
+import rtshell.parallel_scan
+import rtshell.prefetch_log
+import rtshell.record_policy
+import rtshell.ring_log
+import rtshell.segmented_log
 import rtshell.simpkl_log
+import rtshell.stream_log
+import rtshell.text_log
 
 
 METADATA=[1, 'lot', 'of', ('meta', 'data')]
@@ -35,9 +64,25 @@ DATA=['Val1', 'Value2', 'Entry 3', 'Data block 4', 'Value 5', 'Entry6',
         'Data 7', 'Val8', 'Entry 9', 'Val 10']
 
 
+CHANNELS=['chan_a', 'chan_b']
+
+
 VERBOSITY=False
 
 
+def remove_test_log(name='test.log'):
+    for fn in (name, rtshell.log_index.index_file_name(name)):
+        # Not only regular files; some tests make a FIFO
+        if os.path.lexists(os.path.join(os.getcwd(), fn)):
+            os.remove(os.path.join(os.getcwd(), fn))
+
+
+def remove_segmented_log(name='test.log', segments=len(DATA)):
+    remove_test_log(name)
+    for ii in range(segments):
+        remove_test_log(rtshell.segmented_log.segment_file_name(name, ii))
+
+
 #class WriteBase(unittest.TestCase):
 class WriteBase():
     def setUp(self):
@@ -46,8 +91,7 @@ class WriteBase():
 
     def tearDown(self):
         self.log.close()
-        if os.path.isfile(os.path.join(os.getcwd(), 'test.log')):
-            os.remove(os.path.join(os.getcwd(), 'test.log'))
+        remove_test_log()
 
 
 class ReadBase(unittest.TestCase):
@@ -58,8 +102,7 @@ class ReadBase(unittest.TestCase):
 
     def tearDown(self):
         self.log.close()
-        if os.path.isfile(os.path.join(os.getcwd(), 'test.log')):
-            os.remove(os.path.join(os.getcwd(), 'test.log'))
+        remove_test_log()
 
     def write_test_log(self):
         log = rtshell.simpkl_log.SimplePickleLog(filename='test.log', mode='w',
@@ -564,6 +607,38 @@ class ReadTests(ReadBase):
         if VERBOSITY:
             print('===== ===== =====', file=sys.stderr)
 
+    def test_read_reverse_start(self):
+        self.assertEqual(self.log.read_reverse(), [])
+        self.assertEqual(self.log.pos, (0, TIMESTAMPS[0]))
+        self.assertEqual(self.log.read()[0][2], DATA[0])
+
+    def test_read_reverse_mid(self):
+        self.log.read(number=5)
+        entries = self.log.read_reverse(number=3)
+        self.assertEqual([e[0] for e in entries], [4, 3, 2])
+        self.assertEqual([e[1] for e in entries], TIMESTAMPS[4:1:-1])
+        self.assertEqual([e[2] for e in entries], DATA[4:1:-1])
+        self.assertEqual(self.log.pos, (2, TIMESTAMPS[2]))
+        self.assertEqual(self.log.read()[0][2], DATA[2])
+        entries = self.log.read_reverse(number=5)
+        self.assertEqual([e[2] for e in entries], DATA[2::-1])
+        self.assertEqual(self.log.pos, (0, TIMESTAMPS[0]))
+
+    def test_read_reverse_eof(self):
+        self.log.read(number=10)
+        self.assert_(self.log.eof)
+        entries = []
+        while True:
+            e = self.log.read_reverse()
+            if not e:
+                break
+            entries += e
+        self.assertEqual([e[0] for e in entries], list(range(9, -1, -1)))
+        self.assertEqual([e[2] for e in entries], DATA[::-1])
+        self.assert_(not self.log.eof)
+        self.assertEqual(self.log.read(number=10)[9][2], DATA[9])
+        self.assert_(self.log.eof)
+
     def test_rewind_at_start(self):
         if VERBOSITY:
             print('===== rewind_at_start =====', file=sys.stderr)
@@ -1309,13 +1384,2105 @@ class ReadTests(ReadBase):
 
 
 
+class NoIndexReadTests(ReadTests):
+    def setUp(self):
+        self.write_test_log()
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', meta=METADATA, verbose=VERBOSITY, index=False)
+
+
+class RebuiltIndexReadTests(ReadTests):
+    def setUp(self):
+        self.write_test_log()
+        os.remove(rtshell.log_index.index_file_name('test.log'))
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', meta=METADATA, verbose=VERBOSITY)
+
+
+class IndexTests(ReadBase):
+    def test_index_written(self):
+        index = rtshell.log_index.LogIndex()
+        index.load(rtshell.log_index.index_file_name('test.log'))
+        self.assertEqual(len(index), len(TIMESTAMPS))
+        for ii, t in enumerate(TIMESTAMPS):
+            ind, ts, offset = index.entry(ii)
+            self.assertEqual(ind, ii)
+            self.assertEqual(ts, rtshell.ilog.ts_to_ns(t))
+
+    def test_index_offsets(self):
+        index = self.log._get_index()
+        for ii in reversed(range(len(TIMESTAMPS))):
+            self.log._jump_to(index, ii)
+            self.assertEqual(self.log.pos, (ii, TIMESTAMPS[ii]))
+            ind, ts, d = self.log.read()[0]
+            self.assertEqual(d, DATA[ii])
+
+    def test_rebuild_saves_index(self):
+        self.log.close()
+        fn = rtshell.log_index.index_file_name('test.log')
+        os.remove(fn)
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+        self.assert_(not os.path.isfile(fn))
+        self.log.seek(index=5)
+        self.assert_(os.path.isfile(fn))
+        self.assertEqual(self.log.pos, (5, TIMESTAMPS[5]))
+
+    def test_stale_index_ignored(self):
+        self.log.close()
+        fn = rtshell.log_index.index_file_name('test.log')
+        index = rtshell.log_index.LogIndex()
+        index.load(fn)
+        stale = rtshell.log_index.LogIndex()
+        for ii in range(len(index) - 1):
+            stale.append(*index.entry(ii))
+        stale.save(fn)
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+        self.log.seek(timestamp=TIMESTAMPS[-1])
+        self.assertEqual(self.log.pos, (9, TIMESTAMPS[-1]))
+        self.assertEqual(len(self.log._get_index()), len(TIMESTAMPS))
+
+    def test_unordered_timestamps(self):
+        self.log.close()
+        remove_test_log()
+        stamps = [1, 3, 2, 4, 3.5, 5]
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY)
+        for ii, t in enumerate(stamps):
+            log.write(t, ii)
+        log.close()
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+        self.log.seek(timestamp=2.5)
+        self.assertEqual(self.log.pos, (1, 3))
+        self.log.seek(timestamp=3.7)
+        self.assertEqual(self.log.pos, (3, 4))
+
+
+class MmapReadTests(ReadTests):
+    def setUp(self):
+        self.write_test_log()
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', meta=METADATA, verbose=VERBOSITY, mmap=True)
+
+
+class MmapTests(ReadBase):
+    def test_shared_map(self):
+        self.log.close()
+        logs = [rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+            mode='r', verbose=VERBOSITY, mmap=True) for ii in range(3)]
+        self.assertEqual(rtshell.log_io.shared_map_users('test.log'), 3)
+        logs[0].seek(index=4)
+        self.assertEqual(logs[1].read()[0][2], DATA[0])
+        self.assertEqual(logs[0].read()[0][2], DATA[4])
+        self.assertEqual(logs[2].read(number=3)[-1][2], DATA[2])
+        for l in logs:
+            l.close()
+        self.assertEqual(rtshell.log_io.shared_map_users('test.log'), 0)
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY, mmap=True)
+
+    def test_no_index(self):
+        self.log.close()
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY, mmap=True, index=False)
+        self.assertEqual([e[2] for e in self.log], DATA)
+
+
+class DeltaData(object):
+    def __init__(self, sec, value):
+        self.tm = ExportTime(sec, 0)
+        self.value = value
+        self.data = list(range(20))
+
+
+class DeltaTests(unittest.TestCase):
+    # Channel a changes its value every 10 entries; channel b never changes
+    COUNT = 40
+    INTERVAL = 4
+
+    def setUp(self):
+        self.write_log('test.log', self.INTERVAL)
+
+    def tearDown(self):
+        remove_test_log()
+        remove_test_log('test2.log')
+
+    def write_log(self, fn, interval, **kwargs):
+        log = rtshell.simpkl_log.SimplePickleLog(filename=fn, mode='w',
+                meta=METADATA, verbose=VERBOSITY, keyframe_interval=interval,
+                **kwargs)
+        for ii in range(self.COUNT):
+            log.write(ii, ('a', DeltaData(ii, ii // 10)))
+            log.write(ii + 0.5, ('b', 'off'))
+        return log
+
+    def check_entry(self, entry, ind):
+        self.assertEqual(entry[0], ind)
+        if ind % 2:
+            self.assertEqual(entry[2], ('b', 'off'))
+        else:
+            self.assertEqual(entry[2][0], 'a')
+            self.assertEqual(entry[2][1].tm.sec, ind // 2)
+            self.assertEqual(entry[2][1].value, ind // 20)
+            self.assertEqual(entry[2][1].data, list(range(20)))
+
+    def check_log(self, fn='test.log', **kwargs):
+        with rtshell.simpkl_log.SimplePickleLog(filename=fn, mode='r',
+                verbose=VERBOSITY, **kwargs) as log:
+            entries = [e for e in log]
+            self.assertEqual(len(entries), self.COUNT * 2)
+            for ii, e in enumerate(entries):
+                self.check_entry(e, ii)
+            for ii in (37, 62, 3, 79, 0):
+                log.seek(index=ii)
+                self.check_entry(log.read()[0], ii)
+            log.seek(index=50)
+            for ii, e in zip(range(49, 40, -1), log.read_reverse(9)):
+                self.check_entry(e, ii)
+
+    def raw_entries(self, fn='test.log', count=COUNT * 2):
+        with rtshell.simpkl_log.SimplePickleLog(filename=fn, mode='r',
+                verbose=VERBOSITY) as log:
+            log._file.seek(log._data_start)
+            return [log._read() for ii in range(count)]
+
+    def test_read(self):
+        self.check_log()
+
+    def test_no_index(self):
+        self.check_log(index=False)
+
+    def test_mmap(self):
+        self.check_log(mmap=True)
+
+    def test_keyframes(self):
+        entries = self.raw_entries()
+        keys = [e[0] for e in entries if len(e) == 5]
+        # Every fourth entry of each channel
+        self.assertEqual(keys, [ii for ii in range(self.COUNT * 2)
+            if ii % 8 < 2])
+        # Only the time changed
+        self.assertEqual(list(entries[2][2].keys()), ['tm'])
+        self.assertEqual(entries[2][5], 2)
+        self.assertEqual(entries[3][2], None)
+        self.assertEqual(entries[3][5], 2)
+        # The value changed after the keyframe
+        self.assertEqual(sorted(entries[20][2].keys()), ['tm', 'value'])
+        self.assertEqual(entries[20][5], 4)
+
+    def test_all_changed(self):
+        with rtshell.simpkl_log.SimplePickleLog(filename='test2.log',
+                mode='w', verbose=VERBOSITY, keyframe_interval=10) as log:
+            # Data that is not a (port name, value) tuple is all one channel
+            for ii in range(3):
+                log.write(ii, ExportTime(ii, ii))
+            for ii in range(3):
+                log.write(ii + 3, 'same')
+        entries = [len(e) for e in self.raw_entries('test2.log', 6)]
+        self.assertEqual(entries, [5, 5, 5, 5, 6, 6])
+
+    def test_smaller(self):
+        self.write_log('test2.log', 0).close()
+        self.assert_(os.path.getsize('test.log') <
+                os.path.getsize('test2.log') * 0.7)
+        self.assertEqual(len(self.raw_entries('test2.log')[3]), 5)
+
+    def test_slice(self):
+        with rtshell.simpkl_log.SimplePickleLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            self.assertEqual(log.slice('test2.log', start=13, index=True),
+                    self.COUNT * 2 - 13)
+        with rtshell.simpkl_log.SimplePickleLog(filename='test2.log',
+                mode='r', verbose=VERBOSITY) as log:
+            for ii, e in enumerate(log):
+                self.check_entry((e[0] + 13,) + e[1:], ii + 13)
+            log.seek(index=10)
+            e = log.read()[0]
+            self.check_entry((e[0] + 13,) + e[1:], 23)
+
+    def test_recovery(self):
+        log = self.write_log('test2.log', self.INTERVAL,
+                checkpoint_interval=0)
+        log._file.flush()
+        shutil.copy('test2.log', 'test3.log')
+        log.close()
+        try:
+            with rtshell.simpkl_log.SimplePickleLog(filename='test3.log',
+                    mode='r', verbose=VERBOSITY, index=False) as log:
+                self.assert_(log.recovered)
+                self.assert_(log._end.delta)
+                log.seek(index=self.COUNT * 2 - 1)
+                self.check_entry(log.read()[0], self.COUNT * 2 - 1)
+                log.seek(index=30)
+                self.check_entry(log.read()[0], 30)
+        finally:
+            remove_test_log('test3.log')
+
+    def test_changed_members(self):
+        changed = rtshell.record_policy.changed_members
+        self.assertEqual(changed(DeltaData(1, 2), DeltaData(1, 2)), [])
+        self.assertEqual(sorted(changed(DeltaData(1, 3), DeltaData(2, 2))),
+                ['tm', 'value'])
+        self.assertEqual(changed(DeltaData(1, 2), ExportTime(1, 2)), None)
+        self.assertEqual(changed(1, 1), None)
+
+    def test_bad_interval(self):
+        self.assertRaises(ValueError, rtshell.simpkl_log.SimplePickleLog,
+                filename='test2.log', mode='w', keyframe_interval=-1)
+
+
+class FramedReadTests(ReadTests):
+    def setUp(self):
+        self.write_test_log()
+        self.log = rtshell.framed_log.FramedLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+
+    def write_test_log(self):
+        log = rtshell.framed_log.FramedLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        log.close()
+
+
+class FramedTests(unittest.TestCase):
+    def setUp(self):
+        log = rtshell.framed_log.FramedLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for ii, (t, d) in enumerate(zip(TIMESTAMPS, DATA)):
+            log.write(t, (CHANNELS[ii % 2], d))
+        log.close()
+
+    def tearDown(self):
+        remove_test_log()
+
+    def test_metadata(self):
+        with rtshell.framed_log.FramedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            self.assertEqual(log.metadata, METADATA)
+            self.assertEqual(sorted(log.channels.values()), sorted(CHANNELS))
+            self.assertEqual(log.end, (9, TIMESTAMPS[-1]))
+
+    def test_channels(self):
+        with rtshell.framed_log.FramedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            for ii, entry in enumerate(log):
+                ind, ts, (name, d) = entry
+                self.assertEqual(ind, ii)
+                self.assertEqual(name, CHANNELS[ii % 2])
+                self.assertEqual(d, DATA[ii])
+
+    def test_filter(self):
+        with rtshell.framed_log.FramedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY, channels=[CHANNELS[1]]) as log:
+            self.assertEqual(log.pos, (1, TIMESTAMPS[1]))
+            entries = [e for e in log]
+            self.assertEqual([e[0] for e in entries], [1, 3, 5, 7, 9])
+            self.assertEqual([e[2] for e in entries],
+                    [(CHANNELS[1], d) for d in DATA[1::2]])
+            log.seek(timestamp=TIMESTAMPS[4])
+            self.assertEqual(log.read()[0][0], 5)
+
+    def test_headers_not_decoded(self):
+        with rtshell.framed_log.FramedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            log._decode_payload = None
+            recs = [r for r in log.read_headers()]
+            self.assertEqual([r.index for r in recs], list(range(10)))
+            self.assertEqual([r.ts for r in recs],
+                    [rtshell.ilog.ts_to_ns(t) for t in TIMESTAMPS])
+            self.assert_(log.eof)
+
+    def test_unclosed(self):
+        log = rtshell.framed_log.FramedLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for ii, (t, d) in enumerate(zip(TIMESTAMPS, DATA)):
+            log.write(t, (CHANNELS[ii % 2], d))
+        log._file.flush()
+        with rtshell.framed_log.FramedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as r:
+            self.assertEqual(r.end, (9, TIMESTAMPS[-1]))
+            self.assertEqual(len([e for e in r]), 10)
+        log.close()
+
+
+class CdrReadTests(ReadTests):
+    def setUp(self):
+        self.write_test_log()
+        self.log = rtshell.cdr_log.CdrLog(filename='test.log', mode='r',
+                verbose=VERBOSITY)
+
+    def write_test_log(self):
+        log = rtshell.cdr_log.CdrLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        log.close()
+
+
+class CdrTests(unittest.TestCase):
+    TYPE_ID = 'IDL:RTC/TimedLong:1.0'
+
+    def setUp(self):
+        log = rtshell.cdr_log.CdrLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        # Give the first channel a CDR type; values not of that type are
+        # pickled
+        log._channel_id(CHANNELS[0], self.TYPE_ID)
+        for ii, (t, d) in enumerate(zip(TIMESTAMPS, DATA)):
+            log.write(t, (CHANNELS[ii % 2], d))
+        self.log = log
+
+    def tearDown(self):
+        self.log.close()
+        remove_test_log()
+
+    def check_types(self, log):
+        self.assertEqual(sorted(log.channels.values()), sorted(CHANNELS))
+        self.assertEqual(log.channel_types, {1: self.TYPE_ID})
+        self.assertEqual([e[2] for e in log],
+                [(CHANNELS[ii % 2], d) for ii, d in enumerate(DATA)])
+
+    def test_channel_types(self):
+        self.log.close()
+        # From the trailer
+        with rtshell.cdr_log.CdrLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            self.check_types(log)
+        # From the channel definitions
+        with rtshell.framed_log.FramedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY, channels=[CHANNELS[0]]) as log:
+            log.rebuild_index()
+            log.rewind()
+            self.assertEqual(log.channel_types, {1: self.TYPE_ID})
+            self.assertEqual(log.read()[0][2], (CHANNELS[0], DATA[0]))
+
+    def test_unclosed(self):
+        self.log._file.flush()
+        with rtshell.cdr_log.CdrLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            self.check_types(log)
+
+    @unittest.skipIf(rtshell.framed_log.omniORB is not None,
+            'omniORB is available')
+    def test_needs_omniorb(self):
+        self.log._write_record(0, 1, rtshell.framed_log.FLAG_CDR, b'\0' * 8)
+        self.log.close()
+        with rtshell.cdr_log.CdrLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            log.seek(index=10)
+            self.assertRaises(ImportError, log.read)
+
+
+class ChunkedReadTests(ReadTests):
+    def setUp(self):
+        self.write_test_log()
+        self.log = rtshell.chunked_log.ChunkedLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+
+    def write_test_log(self):
+        # Small chunks so that reading crosses chunk boundaries
+        log = rtshell.chunked_log.ChunkedLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY, chunk_size=60)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        log.close()
+
+
+class ChunkedTests(unittest.TestCase):
+    def tearDown(self):
+        remove_test_log()
+
+    def write_log(self, codec='zlib', chunk_size=60, close=True):
+        log = rtshell.chunked_log.ChunkedLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY, codec=codec,
+                chunk_size=chunk_size)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        if close:
+            log.close()
+        return log
+
+    def test_codecs(self):
+        for codec in ['zlib', 'bz2', 'lzma']:
+            self.write_log(codec=codec)
+            with rtshell.chunked_log.ChunkedLog(filename='test.log',
+                    mode='r', verbose=VERBOSITY) as log:
+                self.assertEqual(log.codec, codec)
+                self.assertEqual(log.metadata, METADATA)
+                self.assertEqual([e[2] for e in log], DATA)
+
+    def test_bad_codec(self):
+        self.assertRaises(ValueError, rtshell.chunked_log.ChunkedLog,
+                filename='test.log', mode='w', codec='blurg')
+
+    def test_chunk_directory(self):
+        self.write_log()
+        with rtshell.chunked_log.ChunkedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            chunks = log.chunks
+            self.assert_(len(chunks) > 1)
+            self.assertEqual(sum([c.count for c in chunks]), len(DATA))
+            log.seek(index=7)
+            self.assertEqual(log._chunk_no, [ii for ii, c in enumerate(chunks)
+                if c.first_ind <= 7 < c.first_ind + c.count][0])
+            self.assertEqual(log.read()[0][2], DATA[7])
+
+    def test_compresses(self):
+        log = rtshell.chunked_log.ChunkedLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for ii in range(1000):
+            log.write(ii, 'The same data again')
+        log.close()
+        with rtshell.chunked_log.ChunkedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            self.assertEqual(log.end[0], 999)
+            self.assert_(os.path.getsize('test.log') <
+                    log.chunks[0].length / 5)
+
+    def test_unclosed(self):
+        log = self.write_log(chunk_size=100, close=False)
+        log._file.flush()
+        with rtshell.chunked_log.ChunkedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as r:
+            # The final, unwritten chunk is lost
+            end = r.end[0]
+            self.assert_(0 < end < 9)
+            self.assertEqual([e[2] for e in r], DATA[:end + 1])
+        log.close()
+
+
+class SegmentedReadTests(ReadTests):
+    def setUp(self):
+        self.write_test_log()
+        self.log = rtshell.segmented_log.SegmentedLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+
+    def tearDown(self):
+        self.log.close()
+        remove_segmented_log()
+
+    def write_test_log(self):
+        log = rtshell.segmented_log.SegmentedLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY,
+                segment_duration=1)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        log.close()
+
+
+class SegmentedTests(unittest.TestCase):
+    def tearDown(self):
+        remove_segmented_log()
+
+    def write_log(self, close=True, **kwargs):
+        log = rtshell.segmented_log.SegmentedLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY, **kwargs)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        if close:
+            log.close()
+        return log
+
+    def open_log(self, **kwargs):
+        return rtshell.segmented_log.SegmentedLog(filename='test.log',
+                mode='r', verbose=VERBOSITY, **kwargs)
+
+    def test_not_manifest(self):
+        # A multi-line JSON Lines file is not a manifest, even if it mentions
+        # the manifest format after its start
+        with open('test.log', 'w') as f:
+            for ii in range(1000):
+                f.write(json.dumps({'format': 'x', 'value': ii}) + '\n')
+            f.write(json.dumps({'format': rtshell.segmented_log.FORMAT}) +
+                    '\n')
+        self.assertFalse(rtshell.segmented_log.is_manifest('test.log'))
+        with open('test.log', 'w') as f:
+            f.write(json.dumps({'format': rtshell.segmented_log.FORMAT}) +
+                    '\n{}\n')
+        self.assertFalse(rtshell.segmented_log.is_manifest('test.log'))
+
+    def test_rotate_by_duration(self):
+        self.write_log(segment_duration=1)
+        self.assert_(rtshell.segmented_log.is_manifest('test.log'))
+        self.assertFalse(rtshell.segmented_log.is_manifest(
+            rtshell.segmented_log.segment_file_name('test.log', 0)))
+        with self.open_log() as log:
+            segs = log.segments
+            self.assertEqual([s.filename for s in segs], ['test.0000.log',
+                'test.0001.log', 'test.0002.log', 'test.0003.log'])
+            self.assertEqual([s.first_ind for s in segs], [0, 3, 6, 9])
+            self.assertEqual([s.count for s in segs], [3, 3, 3, 1])
+            self.assert_(all([s.complete for s in segs]))
+            self.assertEqual(log.metadata, METADATA)
+            self.assertEqual(log.start, (0, TIMESTAMPS[0]))
+            self.assertEqual(log.end, (9, TIMESTAMPS[9]))
+            self.assertEqual([e[2] for e in log], DATA)
+        # Each segment is an ordinary log
+        with rtshell.simpkl_log.SimplePickleLog(filename='test.0001.log',
+                mode='r', verbose=VERBOSITY) as seg:
+            self.assertEqual(seg.metadata, METADATA)
+            self.assertEqual([e[2] for e in seg], DATA[3:6])
+
+    def test_rotate_by_size(self):
+        self.write_log(segment_size=400)
+        with self.open_log() as log:
+            self.assert_(len(log.segments) > 1)
+            self.assertEqual([e[2] for e in log], DATA)
+
+    def test_segments_not_touched(self):
+        self.write_log(segment_duration=1)
+        os.remove('test.0000.log')
+        os.remove('test.0001.log')
+        with self.open_log() as log:
+            self.assertEqual(log.end, (9, TIMESTAMPS[9]))
+            log.seek(timestamp=3.3)
+            self.assertEqual(log.pos, (7, TIMESTAMPS[7]))
+            self.assertEqual([e[2] for e in log], DATA[7:])
+            log.seek(index=6)
+            self.assertEqual(log.pos, (6, TIMESTAMPS[6]))
+            self.assertEqual(log._seg, None)
+            self.assertEqual(log.read(timestamp=3.3)[-1][2], DATA[7])
+            # The next segment is not opened until it is reached
+            log.seek(index=8)
+            self.assertEqual(log.read(timestamp=4)[-1][2], DATA[8])
+            self.assertEqual(log._seg_no, 3)
+            self.assertEqual(log._seg, None)
+
+    def test_framed_segments(self):
+        log = rtshell.segmented_log.SegmentedLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY,
+                logger_type=rtshell.framed_log.FramedLog, segment_duration=1)
+        for ii, (t, d) in enumerate(zip(TIMESTAMPS, DATA)):
+            log.write(t, (CHANNELS[ii % 2], d))
+        log.close()
+        with self.open_log(channels=[CHANNELS[1]]) as log:
+            self.assertEqual([e[2] for e in log],
+                    [(CHANNELS[1], d) for d in DATA[1::2]])
+
+    def test_bad_type(self):
+        self.assertRaises(ValueError, rtshell.segmented_log.SegmentedLog,
+                filename='test.log', mode='w', logger_type=object)
+
+    def test_unclosed(self):
+        writer = self.write_log(close=False, segment_duration=1,
+                checkpoint_interval=0)
+        writer._seg._file.flush()
+        with self.open_log() as log:
+            self.assertFalse(log.segments[-1].complete)
+            self.assertEqual(log.end, (9, TIMESTAMPS[9]))
+            self.assertEqual([e[2] for e in log], DATA)
+            self.assert_(log.recover())
+        with self.open_log() as log:
+            self.assert_(log.segments[-1].complete)
+            self.assertFalse(log.recover())
+            self.assertEqual([e[2] for e in log], DATA)
+        writer.close()
+
+
+class TextReadTests(ReadTests):
+    FORMAT = rtshell.text_log.CSV
+
+    def setUp(self):
+        self.write_test_log()
+        self.log = rtshell.text_log.TextLog(filename='test.log', mode='r',
+                verbose=VERBOSITY)
+
+    def write_test_log(self):
+        log = rtshell.text_log.TextLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY, text_format=self.FORMAT)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        log.close()
+
+
+class JsonlReadTests(TextReadTests):
+    FORMAT = rtshell.text_log.JSONL
+
+
+class TextEnum(object):
+    def __init__(self, n, v):
+        self._n = n
+        self._v = v
+
+
+class TextData(object):
+    def __init__(self, ii):
+        self.tm = ExportTime(ii, 500000001)
+        self.data = [float(x) / 3 for x in range(ii % 3)]
+        self.label = DATA[ii % len(DATA)]
+        self.flag = ii % 2 == 0
+        self.kind = TextEnum('A', 0)
+        self.points = [ExportTime(ii, x) for x in range(ii % 2 + 1)]
+
+
+class TextTests(unittest.TestCase):
+    def tearDown(self):
+        remove_test_log()
+
+    def write_log(self, text_format, entries):
+        log = rtshell.text_log.TextLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY, text_format=text_format)
+        for t, d in entries:
+            log.write(t, d)
+        log.close()
+
+    def check_structs(self, text_format):
+        entries = [(rtshell.ilog.EntryTS(sec=1000000000 + ii, nsec=ii),
+            (CHANNELS[ii % 2], TextData(ii))) for ii in range(6)]
+        self.write_log(text_format, entries)
+        with rtshell.text_log.TextLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            self.assertEqual(log.text_format, text_format)
+            self.assertEqual(log.metadata, METADATA)
+            read = log.read(number=10)
+            self.assert_(log.eof)
+        self.assertEqual(len(read), len(entries))
+        for ii, ((t, (name, d)), (index, ts, (r_name, r))) in \
+                enumerate(zip(entries, read)):
+            self.assertEqual(index, ii)
+            self.assertEqual(ts.ns, t.ns)
+            self.assertEqual(r_name, name)
+            self.assert_(type(r) is TextData)
+            self.assert_(type(r.tm) is ExportTime)
+            self.assertEqual((r.tm.sec, r.tm.nsec), (d.tm.sec, d.tm.nsec))
+            self.assertEqual(r.data, d.data)
+            self.assertEqual(r.label, d.label)
+            self.assertEqual(r.flag, d.flag)
+            self.assert_(r.kind is not None and r.kind._v == 0)
+            self.assertEqual([(p.sec, p.nsec) for p in r.points],
+                    [(p.sec, p.nsec) for p in d.points])
+            self.assert_(all([type(p) is ExportTime for p in r.points]))
+        # Values are new objects
+        self.assertFalse(read[0][2][1].tm is read[2][2][1].tm)
+
+    def test_csv_structs(self):
+        self.check_structs(rtshell.text_log.CSV)
+
+    def test_jsonl_structs(self):
+        self.check_structs(rtshell.text_log.JSONL)
+
+    def test_csv_columns(self):
+        self.write_log(rtshell.text_log.CSV,
+                [(1.5, ('chan_a', TextData(1)))])
+        with open('test.log', 'r') as f:
+            lines = f.read().splitlines()
+        self.assert_(lines[0].startswith('#rtlog-text,csv,1,'))
+        schema = lines[1].split(',')
+        self.assertEqual(schema[:4], ['#schema', '0', 'chan_a',
+            TextData.__module__ + '.TextData'])
+        self.assertEqual(schema[5:], ['data', 'flag', 'kind', 'label',
+            'points', 'tm.nsec', 'tm.sec'])
+        self.assertEqual(lines[2], '1.500000000,chan_a,[0.0],false,0,Value2,'
+                '"[{""nsec"":0,""sec"":1},{""nsec"":1,""sec"":1}]",'
+                '500000001,1')
+
+    def test_jsonl_columns(self):
+        self.write_log(rtshell.text_log.JSONL,
+                [(1.5, ('chan_a', TextData(1)))])
+        with open('test.log', 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(json.loads(lines[1])['columns'], ['data', 'flag',
+            'kind', 'label', 'points', 'tm.nsec', 'tm.sec'])
+        self.assertEqual(json.loads(lines[2]), {'t': 1.5,
+            'channel': 'chan_a', 'data': [0.0], 'flag': False, 'kind': 0,
+            'label': 'Value2', 'points': [{'sec': 1, 'nsec': 0},
+                {'sec': 1, 'nsec': 1}], 'tm.nsec': 500000001, 'tm.sec': 1})
+
+    def test_special_values(self):
+        values = ['comma, "quote"\nline', 42, u'\u30c6\u30ad\u30b9\u30c8',
+                ['a', 'b'], None]
+        for text_format in rtshell.text_log.FORMATS:
+            # Each change of type starts a new schema for the channel
+            self.write_log(text_format, [(ii, ('chan_a', v))
+                for ii, v in enumerate(values)] + [(5, 'unnamed')])
+            with rtshell.text_log.TextLog(filename='test.log', mode='r',
+                    verbose=VERBOSITY) as log:
+                self.assertEqual([e[2] for e in log],
+                        [('chan_a', v) for v in values] + ['unnamed'])
+                log.seek(index=2)
+                self.assertEqual(log.read_reverse(2),
+                        [(1, rtshell.ilog.EntryTS(sec=1), ('chan_a', 42)),
+                            (0, rtshell.ilog.EntryTS(sec=0),
+                                ('chan_a', values[0]))])
+
+    def test_negative_timestamps(self):
+        self.assertEqual(rtshell.text_log._parse_ts('-1.5'), -1500000000)
+        self.assertEqual(rtshell.text_log._parse_ts('-.25'), -250000000)
+        self.assertEqual(rtshell.text_log._parse_ts('+2'), 2000000000)
+        times = [rtshell.ilog.EntryTS(ns=ns) for ns in
+                [-1500000000, -1, 0, 250000000]]
+        for text_format in rtshell.text_log.FORMATS:
+            self.write_log(text_format, [(t, ('chan_a', ii))
+                for ii, t in enumerate(times)])
+            with rtshell.text_log.TextLog(filename='test.log', mode='r',
+                    verbose=VERBOSITY) as log:
+                self.assertEqual([e[1].ns for e in log],
+                        [t.ns for t in times])
+
+    def test_shape_change(self):
+        first = ExportTime(1, 2)
+        # The same type with members of other types
+        second = ExportTime(1.5, 'a')
+        third = ExportTime(ExportTime(3, 4), None)
+        for text_format in rtshell.text_log.FORMATS:
+            self.write_log(text_format, [(0, ('chan_a', first)),
+                (1, ('chan_a', second)), (2, ('chan_a', third)),
+                (3, ('chan_a', first))])
+            with rtshell.text_log.TextLog(filename='test.log', mode='r',
+                    verbose=VERBOSITY) as log:
+                read = [e[2][1] for e in log]
+            self.assertTrue(all([type(r) is ExportTime for r in read]))
+            self.assertEqual([(r.sec, r.nsec) for r in read[:2]],
+                    [(1, 2), (1.5, 'a')])
+            self.assertTrue(type(read[2].sec) is ExportTime)
+            self.assertEqual((read[2].sec.sec, read[2].sec.nsec,
+                read[2].nsec), (3, 4, None))
+            self.assertEqual((read[3].sec, read[3].nsec), (1, 2))
+
+    def test_not_text_log(self):
+        with open('test.log', 'w') as f:
+            f.write('0.2\tVal1\n')
+        self.assertRaises(ValueError, rtshell.text_log.TextLog,
+                filename='test.log', mode='r')
+        self.assertRaises(ValueError, rtshell.text_log.TextLog,
+                filename='test.log', mode='w', text_format='xml')
+
+
+class RecoveryTests(unittest.TestCase):
+    def tearDown(self):
+        remove_test_log()
+        remove_test_log('crash.log')
+
+    def crash(self, checkpoint_interval=1e-9, checkpoint_at=None, cut=0):
+        '''Write a log and copy it as it would be if the recorder died.'''
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY,
+                checkpoint_interval=checkpoint_interval)
+        for ii, (t, d) in enumerate(zip(TIMESTAMPS, DATA)):
+            log.write(t, d)
+            if ii == checkpoint_at:
+                log._write_checkpoint()
+        log._file.flush()
+        log._idx_writer.flush()
+        shutil.copy('test.log', 'crash.log')
+        shutil.copy(rtshell.log_index.index_file_name('test.log'),
+                rtshell.log_index.index_file_name('crash.log'))
+        log.close()
+        if cut:
+            with open('crash.log', 'r+b') as f:
+                f.truncate(os.path.getsize('crash.log') - cut)
+
+    def open_crashed(self, **kwargs):
+        return rtshell.simpkl_log.SimplePickleLog(filename='crash.log',
+                mode='r', verbose=VERBOSITY, **kwargs)
+
+    def test_closed_log(self):
+        self.crash()
+        with rtshell.simpkl_log.SimplePickleLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            self.assertFalse(log.recovered)
+            self.assertFalse(log.recover())
+
+    def test_checkpoint(self):
+        self.crash()
+        with self.open_crashed() as log:
+            self.assert_(log.recovered)
+            # Only the final entry needs to be scanned
+            self.assertEqual(len(log._tail), 1)
+            self.assertEqual(log.end, (9, TIMESTAMPS[9]))
+            self.assertEqual(log.metadata, METADATA)
+            self.assertEqual([e[2] for e in log], DATA)
+
+    def test_tail_scan(self):
+        self.crash(checkpoint_interval=1000, checkpoint_at=4)
+        with self.open_crashed() as log:
+            self.assertEqual(log._tail[0][0], 4)
+            self.assertEqual(len(log._tail), 6)
+            self.assertEqual(log.end, (9, TIMESTAMPS[9]))
+
+    def test_no_checkpoint(self):
+        self.crash(checkpoint_interval=0)
+        with self.open_crashed() as log:
+            self.assert_(log.recovered)
+            self.assertEqual(len(log._tail), 10)
+            self.assertEqual([e[2] for e in log], DATA)
+
+    def test_incomplete_entry(self):
+        self.crash(cut=3)
+        with self.open_crashed() as log:
+            self.assertEqual(log.end, (8, TIMESTAMPS[8]))
+            self.assertEqual([e[2] for e in log], DATA[:9])
+            self.assert_(log.eof)
+
+    def test_seek(self):
+        self.crash(checkpoint_interval=1000, checkpoint_at=4, cut=3)
+        with self.open_crashed() as log:
+            log.seek(index=6)
+            self.assertEqual(log.read()[0][2], DATA[6])
+            log.seek(timestamp=3.3)
+            self.assertEqual(log.read()[0][2], DATA[7])
+            # The index written while recording was extended, not rebuilt
+            self.assertEqual(len(log._index), 9)
+
+    def test_mmap(self):
+        self.crash(cut=3)
+        with self.open_crashed(mmap=True) as log:
+            self.assertEqual([e[2] for e in log], DATA[:9])
+
+    def test_recover(self):
+        self.crash(cut=3)
+        with self.open_crashed() as log:
+            self.assert_(log.recover())
+            self.assertFalse(log.recovered)
+            end = log._data_end
+        self.assertEqual(os.path.getsize('crash.log'), end)
+        with self.open_crashed() as log:
+            self.assertFalse(log.recovered)
+            self.assertFalse(log.recover())
+            self.assertEqual(log.end, (8, TIMESTAMPS[8]))
+            self.assertNotEqual(log._load_index(), None)
+            self.assertEqual([e[2] for e in log], DATA[:9])
+
+
+class WritePolicyTests(unittest.TestCase):
+    def tearDown(self):
+        remove_test_log()
+
+    def test_parse_fsync_policy(self):
+        parse = rtshell.log_io.parse_fsync_policy
+        self.assertEqual(parse('never'), (None, None, False))
+        self.assertEqual(parse('close'), (None, None, True))
+        self.assertEqual(parse('100'), (100, None, True))
+        self.assertEqual(parse('0.5s'), (None, 0.5, True))
+        for bad in ['', 'always', '0', '-1', '0s', 'xs']:
+            self.assertRaises(ValueError, parse, bad)
+
+    def test_sync_every_n(self):
+        policy = rtshell.log_io.WritePolicy(fsync='3')
+        with policy.open('test.log') as f:
+            for ii in range(10):
+                f.write(b'entry')
+                policy.entry_written(f)
+            self.assertEqual(policy.syncs, 3)
+            policy.closing(f)
+            self.assertEqual(policy.syncs, 4)
+
+    def test_sync_interval(self):
+        policy = rtshell.log_io.WritePolicy(fsync='0.01s')
+        with policy.open('test.log') as f:
+            f.write(b'entry')
+            policy.entry_written(f)
+            self.assertEqual(policy.syncs, 0)
+            policy._last_sync -= 1
+            policy.entry_written(f)
+            self.assertEqual(policy.syncs, 1)
+
+    def test_flush_interval(self):
+        policy = rtshell.log_io.WritePolicy(flush_interval=0.01)
+        with policy.open('test.log') as f:
+            f.write(b'entry')
+            policy.entry_written(f)
+            self.assertEqual(os.path.getsize('test.log'), 0)
+            policy._last_flush -= 1
+            policy.entry_written(f)
+            self.assertEqual(os.path.getsize('test.log'), 5)
+            self.assertEqual(policy.syncs, 0)
+            policy.closing(f)
+            self.assertEqual(policy.syncs, 0)
+
+    def test_buffered_until_full(self):
+        policy = rtshell.log_io.WritePolicy(buffer_size=100)
+        with policy.open('test.log') as f:
+            for ii in range(10):
+                f.write(b'entry')
+                policy.entry_written(f)
+            self.assertEqual(os.path.getsize('test.log'), 0)
+            f.write(b'x' * 60)
+            self.assert_(os.path.getsize('test.log') > 0)
+        self.assertEqual(policy.flushes, 0)
+
+    def test_bad_options(self):
+        self.assertRaises(ValueError, rtshell.log_io.WritePolicy,
+                buffer_size=0)
+        for log_type in [rtshell.simpkl_log.SimplePickleLog,
+                rtshell.framed_log.FramedLog, rtshell.chunked_log.ChunkedLog,
+                rtshell.text_log.TextLog]:
+            self.assertRaises(ValueError, log_type, filename='test.log',
+                    mode='w', fsync='sometimes')
+
+    def test_logs(self):
+        for log_type in [rtshell.simpkl_log.SimplePickleLog,
+                rtshell.framed_log.FramedLog, rtshell.chunked_log.ChunkedLog,
+                rtshell.text_log.TextLog]:
+            log = log_type(filename='test.log', mode='w', meta=METADATA,
+                    verbose=VERBOSITY, buffer_size=64, flush_interval=0.5,
+                    fsync='2')
+            for t, d in zip(TIMESTAMPS, DATA):
+                log.write(t, d)
+            log.close()
+            self.assert_(log._policy.syncs > 0)
+            with log_type(filename='test.log', mode='r',
+                    verbose=VERBOSITY) as r:
+                self.assertEqual(r.metadata, METADATA)
+                self.assertEqual([e[2] for e in r], DATA)
+            remove_test_log()
+
+
+class GatedLog(rtshell.ilog.Log):
+    '''A write-only log that stalls each write until released.'''
+    def __init__(self, fail=False, *args, **kwargs):
+        self.entries = []
+        self.closed = False
+        self.gate = threading.Event()
+        self.fail = fail
+        super(GatedLog, self).__init__(mode='w', *args, **kwargs)
+
+    def write(self, timestamp, data):
+        self.gate.wait()
+        if self.fail:
+            raise IOError('Disk full')
+        self.entries.append((timestamp, data))
+
+    def _close(self):
+        self.closed = True
+
+    def _open(self):
+        pass
+
+
+class AsyncTests(unittest.TestCase):
+    def setUp(self):
+        self.target = GatedLog(meta=METADATA)
+
+    def fill(self, log):
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+
+    def test_writes_in_order(self):
+        log = rtshell.async_log.AsyncLog(self.target, queue_size=100,
+                verbose=VERBOSITY)
+        self.assertEqual(log.metadata, METADATA)
+        self.fill(log)
+        self.target.gate.set()
+        log.close()
+        self.assert_(self.target.closed)
+        self.assertEqual(self.target.entries, list(zip(TIMESTAMPS, DATA)))
+        self.assertEqual(log.queued, len(DATA))
+        self.assertEqual(log.written, len(DATA))
+        self.assertEqual(log.dropped, 0)
+
+    def test_flush(self):
+        log = rtshell.async_log.AsyncLog(self.target, queue_size=100,
+                verbose=VERBOSITY)
+        self.fill(log)
+        self.target.gate.set()
+        log.flush()
+        self.assertEqual(len(self.target.entries), len(DATA))
+        self.assertFalse(self.target.closed)
+        log.close()
+
+    def test_drop_newest(self):
+        log = rtshell.async_log.AsyncLog(self.target, queue_size=3,
+                overflow='drop-newest', verbose=VERBOSITY)
+        log.write(TIMESTAMPS[0], DATA[0])
+        # Wait for the writer thread to take the first entry
+        while log._queue:
+            pass
+        for t, d in zip(TIMESTAMPS[1:], DATA[1:]):
+            log.write(t, d)
+        self.assertEqual(log.high_water, 3)
+        self.target.gate.set()
+        log.close()
+        self.assertEqual([e[1] for e in self.target.entries], DATA[:4])
+        self.assertEqual(log.dropped, len(DATA) - 4)
+        self.assertEqual(log.written + log.dropped, log.queued)
+
+    def test_drop_oldest(self):
+        log = rtshell.async_log.AsyncLog(self.target, queue_size=3,
+                overflow='drop-oldest', verbose=VERBOSITY)
+        log.write(TIMESTAMPS[0], DATA[0])
+        while log._queue:
+            pass
+        for t, d in zip(TIMESTAMPS[1:], DATA[1:]):
+            log.write(t, d)
+        self.target.gate.set()
+        log.close()
+        self.assertEqual([e[1] for e in self.target.entries],
+                DATA[:1] + DATA[-3:])
+        self.assertEqual(log.dropped, len(DATA) - 4)
+
+    def test_block(self):
+        log = rtshell.async_log.AsyncLog(self.target, queue_size=2,
+                verbose=VERBOSITY)
+        writer = threading.Thread(target=self.fill, args=(log,))
+        writer.start()
+        writer.join(0.1)
+        # The queue is full, so the writer is still waiting
+        self.assert_(writer.is_alive())
+        self.target.gate.set()
+        writer.join()
+        log.close()
+        self.assertEqual([e[1] for e in self.target.entries], DATA)
+        self.assertEqual(log.dropped, 0)
+
+    def test_write_error(self):
+        self.target.fail = True
+        self.target.gate.set()
+        log = rtshell.async_log.AsyncLog(self.target, queue_size=100,
+                verbose=VERBOSITY)
+        log.write(TIMESTAMPS[0], DATA[0])
+        self.assertRaises(IOError, log.flush)
+        self.assertEqual(log.dropped, 1)
+        log.close()
+        self.assert_(self.target.closed)
+
+    def test_write_after_error(self):
+        log = rtshell.async_log.AsyncLog(self.target, queue_size=1,
+                overflow=rtshell.async_log.BLOCK, verbose=VERBOSITY)
+        # One entry held by the writer thread and one filling the queue
+        log.write(TIMESTAMPS[0], DATA[0])
+        log.write(TIMESTAMPS[1], DATA[1])
+        self.target.fail = True
+        self.target.gate.set()
+        errors = []
+        def write_more():
+            for t, d in zip(TIMESTAMPS, DATA):
+                try:
+                    log.write(t, d)
+                except IOError:
+                    errors.append(t)
+            try:
+                log.flush()
+            except IOError:
+                errors.append(None)
+        t = threading.Thread(target=write_more)
+        t.daemon = True
+        t.start()
+        t.join(10)
+        # Every later call fails rather than waiting for the dead thread
+        self.assertFalse(t.is_alive())
+        self.assertEqual(len(errors), len(DATA) + 1)
+        log.close()
+        self.assertTrue(self.target.closed)
+
+    def test_bad_options(self):
+        self.assertRaises(ValueError, rtshell.async_log.AsyncLog,
+                self.target, overflow='blurg')
+        self.assertRaises(ValueError, rtshell.async_log.AsyncLog,
+                self.target, queue_size=0)
+
+    def test_with_log_file(self):
+        log = rtshell.async_log.AsyncLog(rtshell.simpkl_log.SimplePickleLog(
+            filename='test.log', mode='w', meta=METADATA, verbose=VERBOSITY),
+            verbose=VERBOSITY)
+        self.fill(log)
+        log.close()
+        with rtshell.simpkl_log.SimplePickleLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as r:
+            self.assertEqual(r.metadata, METADATA)
+            self.assertEqual([e[2] for e in r], DATA)
+        remove_test_log()
+
+
+class ExportTime(object):
+    def __init__(self, sec, nsec):
+        self.sec = sec
+        self.nsec = nsec
+
+
+class GatedReadLog(rtshell.ilog.Log):
+    '''A read-only log of the test data that stalls reading from an entry
+    until released.'''
+    def __init__(self, gate_at=len(DATA), *args, **kwargs):
+        self.gate = threading.Event()
+        self.gate_at = gate_at
+        self.next = 0
+        self.closed = False
+        super(GatedReadLog, self).__init__(mode='r', *args, **kwargs)
+
+    def read(self, timestamp=None, number=None):
+        if self.next >= len(DATA):
+            return []
+        if self.next >= self.gate_at:
+            self.gate.wait()
+        self.next += 1
+        return [(self.next - 1, TIMESTAMPS[self.next - 1],
+            DATA[self.next - 1])]
+
+    def _close(self):
+        self.closed = True
+
+    def _get_cur_pos(self):
+        return self.next, TIMESTAMPS[min(self.next, len(DATA) - 1)]
+
+    def _get_start(self):
+        return 0, TIMESTAMPS[0]
+
+    def _get_end(self):
+        return len(DATA) - 1, TIMESTAMPS[-1]
+
+    def _open(self):
+        pass
+
+
+class PrefetchTests(unittest.TestCase):
+    def setUp(self):
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(t, d)
+        log.close()
+
+    def tearDown(self):
+        remove_test_log()
+
+    def open(self, **kwargs):
+        return rtshell.prefetch_log.PrefetchLog(
+                rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                    mode='r', verbose=VERBOSITY), verbose=VERBOSITY, **kwargs)
+
+    def test_read(self):
+        log = self.open(buffer_size=3)
+        self.assertEqual(log.metadata, METADATA)
+        self.assertEqual(log.start, (0, TIMESTAMPS[0]))
+        self.assertEqual(log.end, (9, TIMESTAMPS[-1]))
+        entries = []
+        while not log.eof:
+            self.assertEqual(log.pos, (len(entries), TIMESTAMPS[len(entries)]))
+            entries += log.read()
+        self.assertEqual([e[0] for e in entries], list(range(len(DATA))))
+        self.assertEqual([e[1] for e in entries], TIMESTAMPS)
+        self.assertEqual([e[2] for e in entries], DATA)
+        self.assertEqual(log.read(), [])
+        self.assertEqual(log.pos, (10, TIMESTAMPS[-1]))
+        self.assertEqual(log.decoded, len(DATA))
+        self.assertEqual(log.taken, len(DATA))
+        log.close()
+
+    def test_read_limits(self):
+        log = self.open(buffer_size=4)
+        self.assertEqual([e[2] for e in log.read(number=3)], DATA[:3])
+        self.assertEqual([e[2] for e in log.read(timestamp=2.001)],
+                DATA[3:6])
+        self.assertEqual([e[2] for e in log.read(number=10)], DATA[6:])
+        self.assert_(log.eof)
+        log.close()
+
+    def test_bounded(self):
+        log = self.open(buffer_size=3)
+        self.assertEqual(log.decoded, 3)
+        log.read()
+        while log.decoded < 4:
+            pass
+        self.assertEqual(len(log._buffer), 3)
+        log.close()
+        log = self.open(buffer_size=0, buffer_bytes=1)
+        self.assertEqual(log.decoded, 1)
+        self.assertEqual([e[2] for e in log.read(number=10)], DATA)
+        log.close()
+        self.assertRaises(ValueError, rtshell.prefetch_log.PrefetchLog,
+                GatedReadLog(), buffer_size=0, buffer_bytes=0)
+
+    def test_reverse(self):
+        target = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+        target.read(number=7)
+        log = rtshell.prefetch_log.PrefetchLog(target, buffer_size=3,
+                reverse=True, verbose=VERBOSITY)
+        self.assertEqual([e[2] for e in log.read_reverse(number=10)],
+                DATA[6::-1])
+        self.assertEqual(log.read_reverse(), [])
+        self.assertRaises(ValueError, log.read)
+        log.close()
+
+    def test_underrun(self):
+        target = GatedReadLog(gate_at=5)
+        log = rtshell.prefetch_log.PrefetchLog(target, buffer_size=5,
+                verbose=VERBOSITY)
+        self.assertEqual(log.decoded, 5)
+        self.assertEqual([e[2] for e in log.read(number=5)], DATA[:5])
+        self.assertEqual(log.underruns, 0)
+        timer = threading.Timer(0.05, target.gate.set)
+        timer.start()
+        self.assertEqual([e[2] for e in log.read()], DATA[5:6])
+        self.assertEqual(log.underruns, 1)
+        self.assert_(log.wait_time > 0)
+        log.close()
+        self.assert_(target.closed)
+
+
+class LoopTests(unittest.TestCase):
+    def setUp(self):
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log', mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(rtshell.ilog.EntryTS(time=t), d)
+        log.close()
+        self.target = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+
+    def tearDown(self):
+        self.target.close()
+        remove_test_log()
+
+    def test_loops(self):
+        log = rtshell.loop_log.LoopLog(self.target, loops=3,
+                verbose=VERBOSITY)
+        self.assertEqual(log.metadata, METADATA)
+        # 5.1s from the first entry to the last, 10 entries
+        self.assertEqual(log.period, 5100000000 + 5100000000 // 9)
+        entries = log.read(number=100)
+        self.assert_(log.eof)
+        self.assertEqual(log.read(), [])
+        self.assertEqual([e[0] for e in entries], list(range(30)))
+        self.assertEqual([e[2] for e in entries], DATA * 3)
+        for ii, e in enumerate(entries):
+            self.assertEqual(e[1].ns, rtshell.ilog.EntryTS(
+                time=TIMESTAMPS[ii % 10]).ns + ii // 10 * log.period)
+        self.assertEqual(log.end, (29, entries[-1][1]))
+        self.assertEqual(log.pos, (30, entries[-1][1]))
+        log.rewind()
+        self.assertEqual(log.pos, (0, entries[0][1]))
+        log.close()
+
+    def test_range(self):
+        self.target.read(number=2)
+        log = rtshell.loop_log.LoopLog(self.target, loops=2, end=3.3,
+                verbose=VERBOSITY)
+        self.assertEqual(log.start, (2, rtshell.ilog.EntryTS(time=1)))
+        self.assertEqual([e[2] for e in log.read(number=100)], DATA[2:8] * 2)
+        log.close()
+        self.assert_(self.target._file.closed)
+        self.target = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+        log = rtshell.loop_log.LoopLog(self.target, loops=2, count=3,
+                verbose=VERBOSITY)
+        self.assertEqual([e[2] for e in log.read(timestamp=2)],
+                DATA[:3] + DATA[:2])
+        self.assertEqual(log.loop, 1)
+        log.close()
+
+    def test_forever(self):
+        log = rtshell.loop_log.LoopLog(self.target, loops=0,
+                verbose=VERBOSITY)
+        entries = log.read(number=1000)
+        self.assertEqual(len(entries), 1000)
+        self.assertEqual(entries[-1][2], DATA[-1])
+        self.assertFalse(log.eof)
+        # The copies of the data are independent
+        self.assertFalse(entries[0][2] is entries[10][2])
+        log.close()
+
+
+class RingTests(unittest.TestCase):
+    # One entry every 100ms
+    STEP = 100000000
+
+    def tearDown(self):
+        for ii in range(3):
+            remove_test_log(rtshell.ring_log.dump_file_name('test.log', ii))
+
+    def make_ring(self, **kwargs):
+        return rtshell.ring_log.RingLog(rtshell.simpkl_log.SimplePickleLog,
+                'test.log', meta=METADATA, verbose=VERBOSITY, **kwargs)
+
+    def write(self, log, first, last):
+        for ii in range(first, last + 1):
+            log.write(rtshell.ilog.EntryTS(ns=ii * self.STEP),
+                    ('a', ExportTime(ii, 0)))
+
+    def read_dump(self, number):
+        fn = rtshell.ring_log.dump_file_name('test.log', number)
+        with rtshell.simpkl_log.SimplePickleLog(filename=fn, mode='r',
+                verbose=VERBOSITY) as log:
+            self.assertEqual(log.metadata, METADATA)
+            return [(e[1].ns // self.STEP, e[2][1].sec) for e in log]
+
+    def test_no_trigger(self):
+        log = self.make_ring(duration=0.5)
+        self.write(log, 0, 19)
+        self.assertEqual(log.buffered, 6)
+        self.assertEqual(log.discarded, 14)
+        log.close()
+        self.assertEqual(log.dumps, [])
+        self.assertFalse(os.path.exists(
+            rtshell.ring_log.dump_file_name('test.log', 0)))
+
+    def test_trigger(self):
+        log = self.make_ring(duration=0.5, post=0.3)
+        self.write(log, 0, 10)
+        log.trigger()
+        self.assert_(log.triggered)
+        self.write(log, 11, 19)
+        self.assertFalse(log.triggered)
+        # The ring starts again after the post-trigger window
+        self.assertEqual(log.buffered, 6)
+        log.close()
+        self.assertEqual(log.dumps,
+                [rtshell.ring_log.dump_file_name('test.log', 0)])
+        self.assertEqual(log.dumped, 9)
+        self.assertEqual(self.read_dump(0), [(ii, ii) for ii in range(5, 14)])
+
+    def test_extend(self):
+        log = self.make_ring(duration=0.2, post=0.3)
+        self.write(log, 0, 5)
+        log.trigger()
+        self.write(log, 6, 7)
+        log.trigger()
+        self.write(log, 8, 19)
+        log.close()
+        self.assertEqual(self.read_dump(0), [(ii, ii) for ii in range(3, 11)])
+
+    def test_size(self):
+        size = len(pickle.dumps(('a', ExportTime(1, 0)),
+            pickle.HIGHEST_PROTOCOL))
+        log = self.make_ring(size=size * 4)
+        self.write(log, 0, 9)
+        self.assertEqual(log.buffered, 4)
+        log.trigger('test')
+        log.close()
+        self.assertEqual(self.read_dump(0), [(ii, ii) for ii in range(6, 10)])
+
+    def test_condition(self):
+        cond = rtshell.ring_log.parse_trigger('a:sec>=5')
+        log = self.make_ring(duration=0.2, conditions=[cond])
+        self.write(log, 0, 9)
+        # Only becoming true triggers
+        self.assertEqual(len(log.dumps), 1)
+        self.write(log, 0, 6)
+        self.assertEqual(len(log.dumps), 2)
+        log.close()
+        self.assertEqual(self.read_dump(0), [(3, 3), (4, 4), (5, 5)])
+        self.assertEqual(self.read_dump(1), [(3, 3), (4, 4), (5, 5)])
+
+    def test_parse_trigger(self):
+        parse = rtshell.ring_log.parse_trigger
+        c = parse('pose: position.x <= -1.5')
+        self.assertEqual(c.channel, 'pose')
+        self.assertEqual(str(c), 'pose:position.x<=-1.5')
+        self.assertEqual(str(parse('mode:data==idle')), 'mode:data==idle')
+        for t in ['pose', 'pose:x', ':x<1', 'pose:<1', 'pose:x<']:
+            self.assertRaises(ValueError, parse, t)
+        c = parse('a:data.value!=3')
+        self.assertFalse(c.test(ExportTime(1, 2)))
+        self.assertRaises(ValueError, rtshell.ring_log.Condition, 'a', 'x',
+                '=>', 1)
+
+    def test_empty_trigger(self):
+        log = self.make_ring(duration=0.5)
+        log.trigger('test')
+        self.assertFalse(log.triggered)
+        self.assertEqual(log.dumps, [])
+        self.write(log, 0, 2)
+        log.close()
+        self.assertEqual(log.dumps, [])
+        self.assertFalse(os.path.exists(
+            rtshell.ring_log.dump_file_name('test.log', 0)))
+        # No entries arrive in the post-trigger window before closing
+        log = self.make_ring(duration=0.5, post=1)
+        log.trigger('test')
+        self.assertTrue(log.triggered)
+        log.close()
+        self.assertEqual(log.dumps, [])
+        self.assertFalse(os.path.exists(
+            rtshell.ring_log.dump_file_name('test.log', 0)))
+
+    def test_background_dump(self):
+        threads = []
+        class ThreadLog(GatedLog):
+            def __init__(self, filename, mode, *args, **kwargs):
+                super(ThreadLog, self).__init__(*args, **kwargs)
+
+            def write(self, timestamp, data):
+                threads.append(threading.current_thread())
+        log = rtshell.ring_log.RingLog(ThreadLog, 'test.log', meta=METADATA,
+                duration=0.5, verbose=VERBOSITY)
+        self.write(log, 0, 9)
+        log.trigger('test')
+        log.close()
+        self.assertEqual(log.dumped, 6)
+        self.assertEqual(len(threads), 6)
+        self.assertFalse(threading.current_thread() in threads)
+
+    def test_bad_limits(self):
+        self.assertRaises(ValueError, self.make_ring)
+        self.assertRaises(ValueError, self.make_ring, duration=1, post=-1)
+
+
+class StreamTests(unittest.TestCase):
+    def tearDown(self):
+        remove_test_log()
+
+    def write_log(self, fn='test.log'):
+        log = rtshell.stream_log.StreamLog(filename=fn, mode='w',
+                meta=METADATA, verbose=VERBOSITY)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(rtshell.ilog.EntryTS(time=t), d)
+        log.close()
+        return log
+
+    def open_log(self, fn='test.log'):
+        return rtshell.stream_log.StreamLog(filename=fn, mode='r',
+                verbose=VERBOSITY)
+
+    def test_write(self):
+        log = self.write_log()
+        self.assertTrue(log.complete)
+        self.assertEqual(log.end, (9, rtshell.ilog.EntryTS(time=5.3)))
+
+    def test_read(self):
+        self.write_log()
+        log = self.open_log()
+        self.assertEqual(log.metadata, METADATA)
+        self.assertEqual(log.start, (0, rtshell.ilog.EntryTS(time=0.2)))
+        # The end is not known until it is reached
+        self.assertEqual(log.end, (None, None))
+        entries = log.read(number=100)
+        self.assertEqual([e[0] for e in entries], list(range(10)))
+        self.assertEqual([e[1] for e in entries],
+                [rtshell.ilog.EntryTS(time=t) for t in TIMESTAMPS])
+        self.assertEqual([e[2] for e in entries], DATA)
+        self.assertTrue(log.eof)
+        self.assertTrue(log.complete)
+        self.assertEqual(log.end, (9, rtshell.ilog.EntryTS(time=5.3)))
+        self.assertEqual(log.pos, (10, rtshell.ilog.EntryTS(time=5.3)))
+        log.close()
+
+    def test_read_timestamp(self):
+        self.write_log()
+        log = self.open_log()
+        self.assertEqual([e[0] for e in log.read(timestamp=1)], [0, 1, 2])
+        self.assertEqual(log.read(timestamp=1), [])
+        self.assertEqual(log.pos, (3, rtshell.ilog.EntryTS(time=1.3)))
+        log.close()
+
+    def test_seek(self):
+        self.write_log()
+        log = self.open_log()
+        log.seek(timestamp=0)
+        self.assertEqual(log.pos[0], 0)
+        log.seek(timestamp=2)
+        self.assertEqual(log.pos, (5, rtshell.ilog.EntryTS(time=2.001)))
+        log.seek(index=7)
+        self.assertEqual(log.read()[0][2], DATA[7])
+        self.assertRaises(NotImplementedError, log.seek, index=2)
+        self.assertRaises(NotImplementedError, log.seek, timestamp=1)
+        self.assertRaises(NotImplementedError, log.rewind)
+        self.assertRaises(NotImplementedError, log.read_reverse)
+        log.close()
+
+    def test_pipe(self):
+        d = tempfile.mkdtemp()
+        fn = os.path.join(d, 'test.log')
+        try:
+            os.mkfifo(fn)
+            t = threading.Thread(target=self.write_log, args=(fn,))
+            t.daemon = True
+            t.start()
+            log = self.open_log(fn)
+            self.assertEqual([e[2] for e in log], DATA)
+            self.assertTrue(log.complete)
+            log.close()
+            t.join(10)
+            self.assertFalse(t.is_alive())
+        finally:
+            shutil.rmtree(d)
+
+    def test_stdio(self):
+        # Record to standard output and play back from standard input
+        code = 'import sys; from rtshell import ilog, stream_log\n' \
+                'if sys.argv[1] == "w":\n' \
+                '    l = stream_log.StreamLog(filename="-", mode="w", ' \
+                'meta=3)\n' \
+                '    for ii in range(5): l.write(ilog.EntryTS(time=ii), ii)\n' \
+                '    l.close()\n' \
+                'else:\n' \
+                '    l = stream_log.StreamLog(filename="-", mode="r")\n' \
+                '    print(l.metadata, [e[2] for e in l], l.end[0])\n'
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+            os.path.abspath(rtshell.__file__)))
+        writer = subprocess.Popen([sys.executable, '-c', code, 'w'],
+                stdout=subprocess.PIPE, env=env)
+        out = subprocess.check_output([sys.executable, '-c', code, 'r'],
+                stdin=writer.stdout, env=env)
+        writer.stdout.close()
+        self.assertEqual(writer.wait(), 0)
+        self.assertEqual(out.decode().strip(), '3 [0, 1, 2, 3, 4] 4')
+
+    def test_stdio_logger(self):
+        self.assertEqual(rtshell.stream_log.stdio_logger('-', 'simpkl'),
+                'stream')
+        self.assertEqual(rtshell.stream_log.stdio_logger('-', 'stream'),
+                'stream')
+        self.assertEqual(rtshell.stream_log.stdio_logger('-', 'framed'),
+                None)
+        self.assertEqual(rtshell.stream_log.stdio_logger('a.log', 'framed'),
+                'framed')
+
+    def test_no_trailer(self):
+        self.write_log()
+        with open('test.log', 'rb') as f:
+            data = f.read()
+        # Cut the trailer and part of the last entry
+        end = data.rfind(DATA[-1].encode())
+        with open('test.log', 'wb') as f:
+            f.write(data[:end])
+        log = self.open_log()
+        self.assertEqual([e[2] for e in log], DATA[:-1])
+        self.assertFalse(log.complete)
+        self.assertEqual(log.end, (8, rtshell.ilog.EntryTS(time=3.4)))
+        log.close()
+
+    def test_not_stream(self):
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY)
+        log.close()
+        self.assertRaises(ValueError, self.open_log)
+
+
+class PolicyData(object):
+    def __init__(self, sec, value, points):
+        self.tm = ExportTime(sec, 0)
+        self.value = value
+        self.points = [ExportTime(p, 0) for p in points]
+
+
+class RecordPolicyTests(unittest.TestCase):
+    def keep(self, policy, samples):
+        return [policy.keep(rtshell.ilog.EntryTS(time=t), d)
+                for t, d in samples]
+
+    def test_every(self):
+        name, policy = rtshell.record_policy.parse_policy('laser:every=3')
+        self.assertEqual(name, 'laser')
+        self.assertEqual(policy.every, 3)
+        self.assertEqual(self.keep(policy, [(t, 1) for t in range(7)]),
+                [True, False, False, True, False, False, True])
+        self.assertEqual(policy.kept, 3)
+        self.assertEqual(policy.skipped, 4)
+
+    def test_rate(self):
+        name, policy = rtshell.record_policy.parse_policy('imu: rate=10 ')
+        self.assertEqual(policy.rate, 10)
+        # Samples at 40 Hz, then the clock going back
+        times = [ii * 0.025 for ii in range(9)] + [0.05, 0.1]
+        self.assertEqual(self.keep(policy, [(t, 1) for t in times]),
+                [True, False, False, False, True, False, False, False,
+                    True, True, False])
+
+    def test_changed(self):
+        name, policy = rtshell.record_policy.parse_policy('pose:changed')
+        self.assert_(policy.changed)
+        samples = [(1, PolicyData(1, 5, [1, 2])),
+                # Only the time has changed
+                (2, PolicyData(2, 5, [1, 2])),
+                (3, PolicyData(3, 6, [1, 2])),
+                (4, PolicyData(4, 6, [1, 3])),
+                (5, PolicyData(5, 6, [1, 3, 4])),
+                (6, PolicyData(6, 6, [1, 3, 4]))]
+        self.assertEqual(self.keep(policy, samples),
+                [True, False, True, True, True, False])
+        name, policy = rtshell.record_policy.parse_policy('count:changed')
+        self.assertEqual(self.keep(policy, [(0, 1), (1, 1), (2, 2.0),
+            (3, [1, 2]), (4, [1, 2])]), [True, False, True, True, False])
+
+    def test_combined(self):
+        name, policy = rtshell.record_policy.parse_policy(
+                'pose:every=2,changed')
+        self.assertEqual(str(policy), 'every=2,changed')
+        self.assertEqual(self.keep(policy, [(0, 1), (1, 2), (2, 1), (3, 2),
+            (4, 3)]), [True, False, False, False, True])
+
+    def test_bad(self):
+        for text in ['laser', 'laser:', ':every=2', 'laser:every',
+                'laser:every=0', 'laser:every=x', 'laser:rate=-1',
+                'laser:changed=1', 'laser:often', 'laser:every=2,every=3']:
+            self.assertRaises(ValueError,
+                    rtshell.record_policy.parse_policy, text)
+
+    def test_load(self):
+        with open('test.policies', 'w') as f:
+            f.write('# Policies\nlaser:every=3\n\n  imu:rate=100\n')
+        try:
+            self.assertEqual(rtshell.record_policy.load_policies(
+                'test.policies'), ['laser:every=3', 'imu:rate=100'])
+        finally:
+            os.remove('test.policies')
+
+
+class ExportData(object):
+    def __init__(self, ii):
+        self.tm = ExportTime(ii, 500000000)
+        self.data = [float(x) for x in range(ii % 3)]
+        self.label = DATA[ii]
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not available')
+class ExportTests(unittest.TestCase):
+    def setUp(self):
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY)
+        for ii, t in enumerate(TIMESTAMPS):
+            log.write(t, (CHANNELS[ii % 2], ExportData(ii)))
+        log.close()
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+
+    def tearDown(self):
+        self.log.close()
+        remove_test_log()
+        for c in CHANNELS:
+            fn = rtshell.log_export.channel_file_name('test', c)
+            if os.path.isfile(fn):
+                os.remove(fn)
+
+    def export(self, ragged=False):
+        files = rtshell.log_export.export_npz(self.log, 'test', ragged=ragged,
+                batch_size=2, verbose=VERBOSITY)
+        self.assertEqual(sorted(files.keys()), CHANNELS)
+        result = {}
+        for c in CHANNELS:
+            self.assertEqual(files[c],
+                    rtshell.log_export.channel_file_name('test', c))
+            with numpy.load(files[c]) as f:
+                result[c] = dict([(n, f[n]) for n in f.files])
+        return result
+
+    def test_channels(self):
+        result = self.export()
+        for jj, c in enumerate(CHANNELS):
+            indices = list(range(jj, len(DATA), 2))
+            self.assertEqual(result[c]['index'].tolist(), indices)
+            self.assertEqual(result[c]['timestamp_ns'].tolist(),
+                    [rtshell.ilog.ts_to_ns(TIMESTAMPS[ii]) for ii in indices])
+            self.assertEqual(result[c]['timestamp'].tolist(),
+                    [rtshell.ilog.ts_to_ns(TIMESTAMPS[ii]) / 1e9
+                        for ii in indices])
+            self.assertEqual(result[c]['tm'].tolist(),
+                    [ii + 0.5 for ii in indices])
+            self.assertEqual(result[c]['label'].tolist(),
+                    [DATA[ii] for ii in indices])
+
+    def test_padded(self):
+        data = self.export()[CHANNELS[0]]
+        lengths = [ii % 3 for ii in range(0, len(DATA), 2)]
+        self.assertEqual(data['data.length'].tolist(), lengths)
+        self.assertEqual(data['data'].shape, (len(lengths), 2))
+        for row, l in zip(data['data'], lengths):
+            self.assertEqual(row[:l].tolist(), list(range(l)))
+            self.assert_(numpy.isnan(row[l:]).all())
+
+    def test_ragged(self):
+        data = self.export(ragged=True)[CHANNELS[0]]
+        lengths = [ii % 3 for ii in range(0, len(DATA), 2)]
+        offsets = data['data.offsets'].tolist()
+        self.assertEqual(len(offsets), len(lengths) + 1)
+        for ii, l in enumerate(lengths):
+            values = data['data'][offsets[ii]:offsets[ii + 1]]
+            self.assertEqual(values.tolist(), list(range(l)))
+        labels = data['label'].tobytes()
+        offsets = data['label.offsets'].tolist()
+        self.assertEqual([labels[offsets[ii]:offsets[ii + 1]].decode('utf-8')
+            for ii in range(len(lengths))], DATA[0::2])
+
+    def test_plain_entries(self):
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test2.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY)
+        for t in TIMESTAMPS:
+            log.write(t, t * 2)
+        log.close()
+        with rtshell.simpkl_log.SimplePickleLog(filename='test2.log',
+                mode='r', verbose=VERBOSITY) as log:
+            files = rtshell.log_export.export_npz(log, 'test',
+                    verbose=VERBOSITY)
+        remove_test_log('test2.log')
+        with numpy.load(files['data']) as f:
+            self.assertEqual(f['value'].tolist(), [t * 2 for t in TIMESTAMPS])
+        os.remove(files['data'])
+
+    def test_file_name(self):
+        self.assertEqual(rtshell.log_export.channel_file_name('a/log',
+            'x y:z'), 'a/log_x_y_z.npz')
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not available')
+class ReadChannelTests(unittest.TestCase):
+    def setUp(self):
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY)
+        for ii, t in enumerate(TIMESTAMPS):
+            log.write(t, (CHANNELS[ii % 2], ExportData(ii)))
+        log.close()
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+
+    def tearDown(self):
+        self.log.close()
+        remove_test_log()
+
+    def test_batches(self):
+        batches = list(self.log.read_channel(CHANNELS[1], batch=2))
+        self.assertEqual([len(b['index']) for b in batches], [2, 2, 1])
+        index = numpy.concatenate([b['index'] for b in batches])
+        self.assertEqual(index.tolist(), list(range(1, len(DATA), 2)))
+        ts = numpy.concatenate([b['timestamp_ns'] for b in batches])
+        self.assertEqual(ts.dtype, numpy.int64)
+        self.assertEqual(ts.tolist(), [rtshell.ilog.ts_to_ns(t)
+            for t in TIMESTAMPS[1::2]])
+        self.assertEqual(batches[0]['label'].tolist(), DATA[1:4:2])
+        self.assertEqual(batches[0]['tm'].tolist(), [1.5, 3.5])
+
+    def test_padded(self):
+        b = next(self.log.read_channel(CHANNELS[0], batch=3))
+        self.assertEqual(b['data.length'].tolist(), [0, 2, 1])
+        self.assertEqual(b['data'][1].tolist(), [0.0, 1.0])
+        self.assertEqual(b['data'][2][0], 0.0)
+        self.assert_(numpy.isnan(b['data'][0]).all())
+
+    def test_time_range(self):
+        batches = list(self.log.read_channel(CHANNELS[0], start=1, end=3.2))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0]['index'].tolist(), [2, 4, 6])
+
+    def test_index_range(self):
+        batches = list(self.log.read_channel(CHANNELS[1], start=3, end=7,
+            index=True))
+        self.assertEqual(batches[0]['index'].tolist(), [3, 5, 7])
+
+    def test_no_entries(self):
+        self.assertEqual(list(self.log.read_channel('blag')), [])
+        self.assertRaises(ValueError, list,
+                self.log.read_channel(CHANNELS[0], batch=0))
+
+
+def scan_indices(log, first, last):
+    return [e[0] for e in rtshell.parallel_scan.entries(log, first, last)]
+
+
+class ScanTests(unittest.TestCase):
+    COUNT = 1000
+
+    def tearDown(self):
+        remove_segmented_log(segments=self.COUNT)
+        for c in CHANNELS:
+            fn = rtshell.log_export.channel_file_name('test', c)
+            if os.path.isfile(fn):
+                os.remove(fn)
+
+    def write_log(self, l_type, **kwargs):
+        log = l_type(filename='test.log', mode='w', meta=METADATA,
+                verbose=VERBOSITY, **kwargs)
+        for ii in range(self.COUNT):
+            log.write(ii * 0.1, (CHANNELS[ii % 2], ii))
+        log.close()
+
+    def check_scan(self, l_type, jobs):
+        result = list(rtshell.parallel_scan.scan(l_type, 'test.log',
+            scan_indices, jobs=jobs, verbose=VERBOSITY))
+        self.assert_(all(result))
+        self.assertEqual(sum(result, []), list(range(self.COUNT)))
+        return result
+
+    def test_split(self):
+        self.assertEqual(rtshell.parallel_scan.split(0, 999, 4),
+                [(0, 249), (250, 499), (500, 749), (750, 999)])
+        self.assertEqual(rtshell.parallel_scan.split(5, 54, 4), [(5, 54)])
+        self.assertEqual(rtshell.parallel_scan.split(0, -1, 4), [])
+        self.assertEqual(len(rtshell.parallel_scan.split(0, 99999, 1)), 10)
+
+    def test_simpkl(self):
+        self.write_log(rtshell.simpkl_log.SimplePickleLog)
+        self.assertEqual(len(self.check_scan(
+            rtshell.simpkl_log.SimplePickleLog, 3)), 10)
+        self.check_scan(rtshell.simpkl_log.SimplePickleLog, 1)
+
+    def test_framed(self):
+        self.write_log(rtshell.framed_log.FramedLog)
+        self.check_scan(rtshell.framed_log.FramedLog, 3)
+
+    def test_chunked(self):
+        self.write_log(rtshell.chunked_log.ChunkedLog, chunk_size=500)
+        self.check_scan(rtshell.chunked_log.ChunkedLog, 3)
+
+    def test_segmented(self):
+        self.write_log(rtshell.segmented_log.SegmentedLog, segment_size=4096)
+        self.check_scan(rtshell.segmented_log.SegmentedLog, 3)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not available')
+    def test_parallel_export(self):
+        self.write_log(rtshell.simpkl_log.SimplePickleLog)
+        files = rtshell.log_export.export_npz_parallel(
+                rtshell.simpkl_log.SimplePickleLog, 'test.log', 'test',
+                batch_size=64, jobs=3, verbose=VERBOSITY)
+        for jj, c in enumerate(CHANNELS):
+            with numpy.load(files[c]) as f:
+                self.assertEqual(f['index'].tolist(),
+                        list(range(jj, self.COUNT, 2)))
+                self.assertEqual(f['value'].tolist(),
+                        list(range(jj, self.COUNT, 2)))
+
+
+class MergeSpec(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class MergeTests(unittest.TestCase):
+    def tearDown(self):
+        for fn in ('test.log', 'test2.log', 'test3.log'):
+            remove_test_log(fn)
+
+    def write_log(self, filename, start, names, timestamps):
+        log = rtshell.simpkl_log.SimplePickleLog(filename=filename, mode='w',
+                meta=(start, [MergeSpec(n) for n in set(names)]),
+                verbose=VERBOSITY)
+        for n, t in zip(names, timestamps):
+            log.write(rtshell.ilog.EntryTS(time=t), (n, t))
+        log.close()
+        return rtshell.simpkl_log.SimplePickleLog(filename=filename,
+                mode='r', verbose=VERBOSITY)
+
+    def test_metadata(self):
+        meta, renames = rtshell.log_merge.merge_metadata([
+            (5, [MergeSpec('a'), MergeSpec('b')]),
+            (3, [MergeSpec('b'), MergeSpec('c')]),
+            (4, [MergeSpec('b'), MergeSpec('b_2')])])
+        self.assertEqual(meta[0], 3)
+        self.assertEqual([p.name for p in meta[1]],
+                ['a', 'b', 'b_2', 'c', 'b_3', 'b_2_2'])
+        self.assertEqual(renames, [{}, {'b': 'b_2'},
+            {'b': 'b_3', 'b_2': 'b_2_2'}])
+
+    def test_is_rtlog_metadata(self):
+        self.assert_(rtshell.log_merge.is_rtlog_metadata(
+            (1, [MergeSpec('a')])))
+        self.assertFalse(rtshell.log_merge.is_rtlog_metadata(METADATA))
+
+    def test_merge(self):
+        a = self.write_log('test.log', 1, ['a'] * 5, TIMESTAMPS[0::2])
+        b = self.write_log('test2.log', 2, ['b', 'a'] * 2 + ['b'],
+                TIMESTAMPS[1::2])
+        meta, renames = rtshell.log_merge.merge_metadata([a.metadata,
+            b.metadata])
+        out = rtshell.simpkl_log.SimplePickleLog(filename='test3.log',
+                mode='w', meta=meta, verbose=VERBOSITY)
+        self.assertEqual(rtshell.log_merge.merge([a, b], out, renames),
+                len(TIMESTAMPS))
+        out.close()
+        a.close()
+        b.close()
+        with rtshell.simpkl_log.SimplePickleLog(filename='test3.log',
+                mode='r', verbose=VERBOSITY) as log:
+            self.assertEqual(log.metadata[0], 1)
+            self.assertEqual(sorted([p.name for p in log.metadata[1]]),
+                    ['a', 'a_2', 'b'])
+            entries = [e for e in log]
+        self.assertEqual([e[1] for e in entries], TIMESTAMPS)
+        self.assertEqual([e[2][0] for e in entries],
+                ['a', 'b', 'a', 'a_2', 'a', 'b', 'a', 'a_2', 'a', 'b'])
+
+    def test_equal_times(self):
+        a = self.write_log('test.log', 1, ['a'] * 3, [1, 2, 3])
+        b = self.write_log('test2.log', 1, ['b'] * 3, [1, 2, 3])
+        out = rtshell.simpkl_log.SimplePickleLog(filename='test3.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY)
+        rtshell.log_merge.merge([a, b], out)
+        out.close()
+        a.close()
+        b.close()
+        with rtshell.simpkl_log.SimplePickleLog(filename='test3.log',
+                mode='r', verbose=VERBOSITY) as log:
+            self.assertEqual([e[2][0] for e in log], ['a', 'b'] * 3)
+
+
+class SliceTests(unittest.TestCase):
+    def setUp(self):
+        log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='w', meta=METADATA, verbose=VERBOSITY)
+        for t, d in zip(TIMESTAMPS, DATA):
+            log.write(rtshell.ilog.EntryTS(time=t), d)
+        log.close()
+        self.log = rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY)
+
+    def tearDown(self):
+        self.log.close()
+        remove_test_log()
+        remove_test_log('test2.log')
+
+    def check_slice(self, first, last):
+        with rtshell.simpkl_log.SimplePickleLog(filename='test2.log',
+                mode='r', verbose=VERBOSITY) as log:
+            self.assertEqual(log.metadata, METADATA)
+            self.assertFalse(log.recovered)
+            entries = [e for e in log]
+            self.assertEqual([e[0] for e in entries],
+                    list(range(last - first + 1)))
+            self.assertEqual([e[2] for e in entries], DATA[first:last + 1])
+            self.assertEqual(log.end[0], last - first)
+            self.assertEqual(log.end[1], entries[-1][1])
+            log.seek(index=2)
+            self.assertEqual(log.read()[0][2], DATA[first + 2])
+            log.seek(timestamp=entries[1][1])
+            self.assertEqual(log.read()[0][2], DATA[first + 1])
+        # The index written with the slice must match the log
+        with rtshell.simpkl_log.SimplePickleLog(filename='test2.log',
+                mode='r', verbose=VERBOSITY) as log:
+            self.assertEqual(len(log._load_index()), last - first + 1)
+
+    def test_index_range(self):
+        self.assertEqual(self.log.slice('test2.log', start=2, end=6,
+            index=True), 5)
+        self.check_slice(2, 6)
+
+    def test_time_range(self):
+        self.assertEqual(self.log.slice('test2.log', start=1, end=3.3), 6)
+        self.check_slice(2, 7)
+
+    def test_open_ended(self):
+        self.log.slice('test2.log', start=5, index=True)
+        self.check_slice(5, len(DATA) - 1)
+        self.log.slice('test2.log', end=3, index=True)
+        self.check_slice(0, 3)
+
+    def test_rewrite_entry(self):
+        for old, new in [((3, 400, 300), (0, 300, 0)),
+                ((70000, 1 << 40, 1 << 39), (1, 300, 200)),
+                ((255, 65536, 65535), (254, 65535, 65534))]:
+            raw = pickle.dumps((old[0], 1.5, 'data', old[1], old[2]),
+                    pickle.HIGHEST_PROTOCOL)
+            result = rtshell.simpkl_log._rewrite_entry(raw, old, new)
+            self.assertEqual(len(result), len(raw))
+            self.assertEqual(pickle.loads(result),
+                    (new[0], 1.5, 'data', new[1], new[2]))
+        self.assertEqual(rtshell.simpkl_log._rewrite_entry(b'blag',
+            (0, 0, 0), (0, 0, 0)), None)
+        # A larger value may not fit
+        raw = pickle.dumps((0, 1.5, 'data', 10, 0), pickle.HIGHEST_PROTOCOL)
+        self.assertEqual(rtshell.simpkl_log._rewrite_entry(raw, (0, 10, 0),
+            (0, 1 << 20, 0)), None)
+
+
+class StatsTests(unittest.TestCase):
+    # Channel a every 10ms, with a 1s gap and a 5ms regression; channel b
+    # every 20ms
+    COUNT = 300
+
+    def setUp(self):
+        self.times = {'a': [], 'b': []}
+        self.entries = []
+        for ii in range(self.COUNT):
+            t = ii * 10000000
+            if ii >= 100:
+                t += 1000000000
+            if ii == 200:
+                t -= 15000000
+            self.entries.append(('a', t))
+            if ii % 2 == 0:
+                self.entries.append(('b', t + 1))
+
+    def tearDown(self):
+        remove_test_log()
+
+    def write_log(self, l_type):
+        log = l_type(filename='test.log', mode='w', meta=METADATA,
+                verbose=VERBOSITY)
+        for name, t in self.entries:
+            log.write(rtshell.ilog.EntryTS(sec=t // 1000000000,
+                nsec=t % 1000000000), (name, 'x' * 10))
+        log.close()
+
+    def check(self, stats):
+        self.assertEqual(stats.count, len(self.entries))
+        self.assertEqual(sorted(stats.channels.keys()), ['a', 'b'])
+        a = stats.channels['a']
+        self.assertEqual(a.count, self.COUNT)
+        self.assertEqual(a.regressions, 1)
+        self.assertEqual(a.max_regression, 5000000)
+        self.assertEqual(a.gaps[0], (1010000000, 990000000))
+        self.assertEqual(a.min_interval, 10000000)
+        self.assertAlmostEqual(a.percentile(50), 10000000, delta=120000)
+        self.assertAlmostEqual(a.percentile(99), 10000000, delta=120000)
+        self.assertEqual(a.percentile(100), 1010000000)
+        b = stats.channels['b']
+        self.assertEqual(b.count, self.COUNT // 2)
+        self.assertEqual(b.regressions, 0)
+        self.assertAlmostEqual(b.mean_rate, (self.COUNT // 2 - 1) /
+                (b.max_ts - b.min_ts) * 1e9)
+        self.assert_(a.bytes > 0)
+        self.assertEqual(a.mean_bytes, a.bytes / float(a.count))
+        # The regression of channel a is also one for the whole log
+        self.assertEqual(stats.regressions, 1)
+
+    def test_simpkl(self):
+        self.write_log(rtshell.simpkl_log.SimplePickleLog)
+        with rtshell.simpkl_log.SimplePickleLog(filename='test.log',
+                mode='r', verbose=VERBOSITY) as log:
+            self.check(rtshell.log_stats.gather(log))
+
+    def test_framed(self):
+        self.write_log(rtshell.framed_log.FramedLog)
+        with rtshell.framed_log.FramedLog(filename='test.log', mode='r',
+                verbose=VERBOSITY) as log:
+            stats = rtshell.log_stats.gather(log)
+        self.check(stats)
+        # Payload sizes come from the record headers
+        self.assertEqual(stats.channels['b'].bytes,
+                len(pickle.dumps('x' * 10, pickle.HIGHEST_PROTOCOL)) *
+                (self.COUNT // 2))
+
+    def test_parallel(self):
+        self.write_log(rtshell.simpkl_log.SimplePickleLog)
+        self.check(rtshell.log_stats.gather_parallel(
+            rtshell.simpkl_log.SimplePickleLog, 'test.log', jobs=3,
+            verbose=VERBOSITY))
+
+    def test_merge(self):
+        whole = rtshell.log_stats.LogStats()
+        parts = [rtshell.log_stats.LogStats() for ii in range(3)]
+        for ii, (name, t) in enumerate(self.entries):
+            whole.add(name, t, 1)
+            parts[ii * 3 // len(self.entries)].add(name, t, 1)
+        merged = rtshell.log_stats.LogStats()
+        for p in parts:
+            merged.merge(p)
+        self.assertEqual(merged.regressions, whole.regressions)
+        for name in ('a', 'b'):
+            m = merged.channels[name]
+            w = whole.channels[name]
+            self.assertEqual((m.count, m.bytes, m.regressions, m.gaps,
+                m.min_interval, m.max_interval, m.percentile(90)),
+                (w.count, w.bytes, w.regressions, w.gaps, w.min_interval,
+                    w.max_interval, w.percentile(90)))
+
+    def test_lateness(self):
+        late = rtshell.log_stats.Lateness()
+        self.assertEqual(late.mean, None)
+        self.assertEqual(late.percentile(99), None)
+        # 99 events 1ms late, one 50ms late and one early
+        for ii in range(99):
+            late.add(1000000)
+        late.add(50000000)
+        late.add(-2000000)
+        self.assertEqual(late.count, 101)
+        self.assertEqual(late.min, 0)
+        self.assertEqual(late.max, 50000000)
+        self.assertAlmostEqual(late.mean, 149000000 / 101.0)
+        self.assertAlmostEqual(late.percentile(50), 1000000, delta=12000)
+        self.assertAlmostEqual(late.percentile(100), 50000000, delta=600000)
+        self.assert_('max 50.000 ms' in str(late))
+
+
 class OtherTests(unittest.TestCase):
     def setUp(self):
         self.write_test_log()
 
     def tearDown(self):
-        if os.path.isfile(os.path.join(os.getcwd(), 'test.log')):
-            os.remove(os.path.join(os.getcwd(), 'test.log'))
+        remove_test_log()
 
     def write_test_log(self):
         log = rtshell.simpkl_log.SimplePickleLog(filename='test.log', mode='w',
@@ -1577,6 +3744,33 @@ class TimestampTests(unittest.TestCase):
         ts = rtshell.ilog.EntryTS(sec=0, nsec=200)
         self.assertEqual(ts.float, 0.0000002)
 
+    def test_ns(self):
+        ts = rtshell.ilog.EntryTS(ns=1000000002)
+        self.assertEqual(ts.sec, 1)
+        self.assertEqual(ts.nsec, 2)
+        self.assertEqual(ts.ns, 1000000002)
+        self.assertEqual(ts, rtshell.ilog.EntryTS(sec=1, nsec=2))
+        self.assertEqual(rtshell.ilog.ts_to_ns(ts), 1000000002)
+        self.assertEqual(rtshell.ilog.ts_to_ns(1.000000002), 1000000002)
+        ts.sec = 3
+        self.assertEqual(ts.ns, 3000000002)
+        ts.nsec = 5
+        self.assertEqual(ts.ns, 3000000005)
+        self.assertEqual(hash(ts), hash(rtshell.ilog.EntryTS(sec=3, nsec=5)))
+
+    def test_pickle(self):
+        # The pickled form is the same as that of logs written when the
+        # timestamp was stored as seconds and nanoseconds
+        old = b'\x80\x02crtshell.ilog\nEntryTS\nq\x00)\x81q\x01}q\x02(' \
+                b'X\x04\x00\x00\x00_secq\x03K\x01X\x05\x00\x00\x00_nsec' \
+                b'q\x04K\x02ub.'
+        ts = pickle.loads(old)
+        self.assertEqual(ts.sec, 1)
+        self.assertEqual(ts.nsec, 2)
+        self.assertEqual(pickle.dumps(ts, 2), old)
+        for p in range(pickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(pickle.loads(pickle.dumps(ts, p)), ts)
+
 
 def write_suite():
     return unittest.TestLoader().loadTestsFromTestCase(WriteTests)
@@ -1586,12 +3780,125 @@ def read_suite():
     return unittest.TestLoader().loadTestsFromTestCase(ReadTests)
 
 
+def index_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(NoIndexReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(RebuiltIndexReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(IndexTests)])
+
+
+def mmap_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(MmapReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(MmapTests)])
+
+
+def delta_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(DeltaTests)])
+
+
+def framed_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(FramedReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(FramedTests)])
+
+
+def cdr_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(CdrReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(CdrTests)])
+
+
+def chunked_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(ChunkedReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(ChunkedTests)])
+
+
+def segmented_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(SegmentedReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(SegmentedTests)])
+
+
+def text_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(TextReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(JsonlReadTests),
+        unittest.TestLoader().loadTestsFromTestCase(TextTests)])
+
+
+def recovery_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(RecoveryTests)
+
+
+def write_policy_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(WritePolicyTests)
+
+
+def async_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(AsyncTests)
+
+
+def prefetch_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(PrefetchTests)
+
+
+def loop_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(LoopTests)
+
+
+def ring_suite():
+    return unittest.TestSuite([
+        unittest.TestLoader().loadTestsFromTestCase(RingTests)])
+
+
+def stream_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(StreamTests)
+
+
+def record_policy_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(RecordPolicyTests)
+
+
+def export_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ExportTests)
+
+
+def read_channel_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ReadChannelTests)
+
+
+def scan_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(ScanTests)
+
+
+def merge_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(MergeTests)
+
+
+def slice_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(SliceTests)
+
+
+def stats_suite():
+    return unittest.TestLoader().loadTestsFromTestCase(StatsTests)
+
+
 def other_suite():
     return unittest.TestLoader().loadTestsFromTestCase(OtherTests)
 
 
 def suite():
-    return unittest.TestSuite([write_suite(), read_suite(), other_suite()])
+    return unittest.TestSuite([write_suite(), read_suite(), index_suite(),
+        mmap_suite(), delta_suite(), framed_suite(), cdr_suite(), chunked_suite(), segmented_suite(),
+        text_suite(), recovery_suite(),
+        write_policy_suite(), async_suite(), prefetch_suite(), loop_suite(),
+        ring_suite(), stream_suite(),
+        record_policy_suite(), export_suite(),
+        read_channel_suite(), scan_suite(), merge_suite(),
+        slice_suite(), stats_suite(), other_suite()])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+# -*- Python -*-
+# -*- coding: utf-8 -*-
+
+'''rtshell
+
+Copyright (C) 2009-2015
+    Geoffrey Biggs
+    RT-Synthesis Research Group
+    Intelligent Systems Research Institute,
+    National Institute of Advanced Industrial Science and Technology (AIST),
+    Japan
+    All rights reserved.
+Licensed under the GNU Lesser General Public License version 3.
+http://www.gnu.org/licenses/lgpl-3.0.en.html
+
+Micro-benchmark of log timestamps.
+
+Compares the integer-nanosecond EntryTS with the EntryTS it replaced, which
+stored separate seconds and nanoseconds (copied below from the baseline
+version of ilog), and times reading a SimplePickle log by timestamp.
+
+Usage: python timestamp_bench.py [number of entries]
+
+'''
+
+from __future__ import print_function
+
+import os
+import pickle
+import sys
+import timeit
+
+import rtshell.ilog
+import rtshell.simpkl_log
+
+
+class BaselineEntryTS(object):
+    '''EntryTS as it was before storing integer nanoseconds.'''
+    def __init__(self, sec=0, nsec=0, time=None):
+        super(BaselineEntryTS, self).__init__()
+        if time is not None:
+            self._sec, self._nsec = self._get_values(time)
+        else:
+            self._sec = sec
+            self._nsec = nsec
+
+    def __lt__(self, other):
+        sec, nsec = self._get_values(other)
+        if self._sec < sec:
+            return True
+        elif self._sec == sec:
+            if self._nsec < nsec:
+                return True
+        return False
+
+    def __le__(self, other):
+        sec, nsec = self._get_values(other)
+        if self._sec < sec:
+            return True
+        elif self._sec == sec:
+            if self._nsec <= nsec:
+                return True
+        return False
+
+    def __eq__(self, other):
+        sec, nsec = self._get_values(other)
+        if self._sec == sec and self._nsec == nsec:
+            return True
+        return False
+
+    @property
+    def float(self):
+        '''Get the time value as a float.'''
+        return float(self._sec) + float(self._nsec) / 1e9
+
+    @property
+    def sec(self):
+        return self._sec
+
+    @property
+    def nsec(self):
+        return self._nsec
+
+    def _get_values(self, other):
+        if type(other) == BaselineEntryTS:
+            return other.sec, other.nsec
+        else:
+            return int(other), int((other * 1000000000) % 1000000000)
+
+
+def time_per_call(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def bench(name, func, number):
+    print('{0:40} {1:8.3f} us'.format(name, time_per_call(func, number) * 1e6))
+
+
+def bench_pair(name, old, new, number):
+    '''Time the same operation on the baseline and the new timestamps.'''
+    t_old = time_per_call(old, number)
+    t_new = time_per_call(new, number)
+    print('{0:40} {1:8.3f} us {2:8.3f} us {3:6.2f}x'.format(name,
+        t_old * 1e6, t_new * 1e6, t_old / t_new))
+
+
+def bench_compare(number):
+    print('{0:40} {1:>11} {2:>11} {3:>7}'.format('', 'baseline', 'ns',
+        'speedup'))
+    old_a = BaselineEntryTS(sec=1, nsec=2)
+    old_b = BaselineEntryTS(sec=1, nsec=3)
+    new_a = rtshell.ilog.EntryTS(sec=1, nsec=2)
+    new_b = rtshell.ilog.EntryTS(sec=1, nsec=3)
+    bench_pair('Compare timestamps', lambda: old_a <= old_b,
+            lambda: new_a <= new_b, number)
+    bench_pair('Compare timestamp with float', lambda: old_a <= 1.5,
+            lambda: new_a <= 1.5, number)
+    bench_pair('Construct from sec, nsec',
+            lambda: BaselineEntryTS(sec=1, nsec=2),
+            lambda: rtshell.ilog.EntryTS(sec=1, nsec=2), number)
+    bench_pair('Construct from float', lambda: BaselineEntryTS(time=1.5),
+            lambda: rtshell.ilog.EntryTS(time=1.5), number)
+    bench_pair('Convert to float', lambda: old_a.float, lambda: new_a.float,
+            number)
+    # The work done for each record when reading to a time limit: unpickle
+    # the entry and compare its timestamp with the limit
+    old_rec = pickle.dumps((1, old_a, 1, 0, 0), pickle.HIGHEST_PROTOCOL)
+    new_rec = pickle.dumps((1, new_a, 1, 0, 0), pickle.HIGHEST_PROTOCOL)
+    bench_pair('Unpickle record and compare',
+            lambda: pickle.loads(old_rec)[1] <= old_b,
+            lambda: pickle.loads(new_rec)[1] <= new_b, number)
+    print('{0:40} {1:8} B  {2:8} B'.format('Pickled record size',
+        len(old_rec), len(new_rec)))
+
+
+def bench_read(count):
+    fn = 'timestamp_bench.log'
+    log = rtshell.simpkl_log.SimplePickleLog(filename=fn, mode='w',
+            meta=None, index=False)
+    for ii in range(count):
+        log.write(rtshell.ilog.EntryTS(ns=ii * 1000000), ii)
+    log.close()
+    def read():
+        log = rtshell.simpkl_log.SimplePickleLog(filename=fn, mode='r',
+                index=False)
+        log.read(timestamp=count / 1000.0)
+        log.close()
+    bench('Read {0} entries by timestamp'.format(count), read, 1)
+    os.remove(fn)
+
+
+def main(argv):
+    count = 10000
+    if len(argv) > 1:
+        count = int(argv[1])
+    bench_compare(100000)
+    bench_read(count)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
+